@@ -1,7 +1,26 @@
+import hashlib
+import hmac
+import threading
+import time
+import uuid
+
+from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
 from rest_framework import exceptions, permissions, authentication
+from rest_framework.authtoken.models import Token
+
+from api.cache import TieredCache
+from api.metrics import authentication_seconds
+from api.models import APIClient, TokenUsage
+from products.bulk import bulk_update
+
 
-from api.models import APIClient
+api_client_cache = TieredCache('apiclient', 'API_CLIENT_CACHE')
+token_cache = TieredCache('token', 'API_TOKEN_CACHE')
+basic_auth_cache = TieredCache('basicauth', 'API_BASIC_AUTH_CACHE')
 
 
 def validate_authkey(value):
@@ -15,7 +34,8 @@ class APIClientAuthentication(authentication.BaseAuthentication):
     
     def authenticate(self, request):
         accesskey = request.query_params.get('accesskey')
-        secretkey = request.META.get('secretkey')
+        # a `secretkey` HTTP header reaches WSGI as HTTP_SECRETKEY
+        secretkey = request.META.get('secretkey') or request.META.get('HTTP_SECRETKEY')
 
         # validate that AK and SK were given
         if not accesskey or not secretkey:
@@ -28,12 +48,189 @@ class APIClientAuthentication(authentication.BaseAuthentication):
             except ValidationError:
                 raise exceptions.AuthenticationFailed('Invalid APIClient credentials')
 
-        # validate that APIClient exists for given AK and SK
-        try:
-            api_client = APIClient.objects.get(accesskey=accesskey, secretkey=secretkey)
-            if api_client.is_active:
-                return (api_client, None)
+        # validate that APIClient exists for given AK and SK, unknown keys
+        # are cached as False for a few seconds so retries don't hit the db
+        cache_key = api_client_cache.make_key(accesskey, secretkey)
+        api_client = api_client_cache.get(cache_key)
+        if api_client is None:
+            try:
+                api_client = APIClient.objects.get(accesskey=accesskey, secretkey=secretkey)
+            except APIClient.DoesNotExist:
+                api_client = False
+                api_client_cache.set(cache_key, api_client, ttl=getattr(
+                    settings, 'API_CLIENT_CACHE', {}).get('NEGATIVE_TTL', 10))
             else:
-                raise api_client.DoesNotExist
-        except APIClient.DoesNotExist:
+                api_client_cache.set(cache_key, api_client)
+
+        if not api_client or not api_client.is_active:
             raise exceptions.AuthenticationFailed('Invalid APIClient credentials')
+        return (api_client, None)
+
+
+class TokenUsageRecorder(object):
+    """
+    Remembers when each token was last used and writes it to TokenUsage in
+    one batch every TOKEN_USAGE_FLUSH_INTERVAL seconds, and once more when
+    the gunicorn worker exits, see gunicorn.conf.py.
+    """
+
+    def __init__(self):
+        self.pending = {}
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+
+    def touch(self, key):
+        with self.lock:
+            self.pending[key] = timezone.now()
+
+    def flush_if_due(self):
+        interval = getattr(settings, 'TOKEN_USAGE_FLUSH_INTERVAL', 60)
+        if self.pending and time.monotonic() - self.last_flush >= interval:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.last_flush = time.monotonic()
+        if not pending:
+            return
+        with transaction.atomic():
+            # tokens deleted since they were used are skipped
+            keys = set(Token.objects.filter(key__in=list(pending)).values_list('key', flat=True))
+            existing = set(TokenUsage.objects.filter(
+                token_id__in=keys).values_list('token_id', flat=True))
+            bulk_update([TokenUsage(token_id=key, last_used=pending[key]) for key in existing],
+                        ['last_used'])
+            created = keys - existing
+            try:
+                with transaction.atomic():
+                    TokenUsage.objects.bulk_create([
+                        TokenUsage(token_id=key, last_used=pending[key]) for key in created])
+            except IntegrityError:
+                # another process flushed some of the same new tokens meanwhile
+                for key in created:
+                    TokenUsage.objects.update_or_create(
+                        token_id=key, defaults={'last_used': pending[key]})
+
+
+token_usage = TokenUsageRecorder()
+
+
+class CachedTokenAuthentication(authentication.TokenAuthentication):
+    """
+    TokenAuthentication that keeps resolved tokens, with their user, in
+    `token_cache`. Entries are dropped when the token is deleted or its user
+    saved, see api/signals.py, in every process if the cache has a shared
+    BACKEND. Changes that send no signals, like `queryset.update()`, are
+    only seen once the entry expires. Uses are recorded by `token_usage`
+    instead of writing to the database on every request.
+    """
+
+    def authenticate_credentials(self, key):
+        cache_key = token_cache.make_key(key)
+        token = token_cache.get(cache_key)
+        if token is None:
+            try:
+                token = Token.objects.select_related('user').get(key=key)
+            except Token.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            token_cache.set(cache_key, token)
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        token_usage.touch(key)
+        return (token.user, token)
+
+
+def get_basic_auth_version(username):
+    """
+    Returns the credentials version of username. A version that is missing,
+    even if just evicted, is replaced by a new random one, which orphans
+    every entry cached under the previous version.
+    """
+    key = basic_auth_cache.make_key('version', username)
+    version = basic_auth_cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        basic_auth_cache.set(key, version)
+    return version
+
+
+def bump_basic_auth_version(username):
+    # a delete, unlike a set, reaches the local tier of every process
+    basic_auth_cache.delete(basic_auth_cache.make_key('version', username))
+
+
+class CachedBasicAuthentication(authentication.BasicAuthentication):
+    """
+    BasicAuthentication that remembers verified credentials for
+    API_BASIC_AUTH_CACHE['TTL'] seconds, so repeated requests skip the
+    password hasher.
+
+    Entries are keyed by an HMAC of the username, password and credentials
+    version under SECRET_KEY, so the cache never holds anything a password
+    could be brute forced from. Saving a user bumps its version, see
+    api/signals.py. Failed attempts are never cached and pay the full
+    hashing cost every time.
+    """
+
+    def get_cache_key(self, userid, password):
+        message = '\0'.join([userid, password, get_basic_auth_version(userid)])
+        digest = hmac.new(settings.SECRET_KEY.encode('utf-8'), message.encode('utf-8'),
+                          hashlib.sha256).hexdigest()
+        return '{}:{}'.format(basic_auth_cache.prefix, digest)
+
+    def authenticate_credentials(self, userid, password, request=None):
+        cache_key = self.get_cache_key(userid, password)
+        user = basic_auth_cache.get(cache_key)
+        if user is None:
+            user = super().authenticate_credentials(userid, password, request)[0]
+            basic_auth_cache.set(cache_key, user)
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        return (user, None)
+
+
+class DispatchingAuthentication(authentication.BaseAuthentication):
+    """
+    Hands each request straight to the one authenticator its credentials
+    are meant for: the Authorization header keyword selects Basic or Token
+    authentication, an `accesskey` query param or `secretkey` header selects
+    APIClientAuthentication. Time spent in each of them is recorded in the
+    `api_authentication_seconds` histogram.
+    """
+
+    def __init__(self):
+        self.basic = CachedBasicAuthentication()
+        self.api_client = APIClientAuthentication()
+        self.keywords = {
+            b'basic': ('basic', self.basic),
+            b'token': ('token', CachedTokenAuthentication()),
+        }
+
+    def get_authenticator(self, request):
+        auth = authentication.get_authorization_header(request).split()
+        if auth and auth[0].lower() in self.keywords:
+            return self.keywords[auth[0].lower()]
+        if ('accesskey' in request.query_params or 'secretkey' in request.META or
+                'HTTP_SECRETKEY' in request.META):
+            return 'apiclient', self.api_client
+        return None, None
+
+    def authenticate(self, request):
+        name, authenticator = self.get_authenticator(request)
+        if authenticator is None:
+            return None
+        outcome = 'failure'
+        start = time.perf_counter()
+        try:
+            result = authenticator.authenticate(request)
+            outcome = 'anonymous' if result is None else 'success'
+            return result
+        finally:
+            authentication_seconds.observe(
+                time.perf_counter() - start, authenticator=name, outcome=outcome)
+
+    def authenticate_header(self, request):
+        # keeps unauthenticated requests answered with 401 and a Basic challenge
+        return self.basic.authenticate_header(request)
@@ -0,0 +1,156 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class LRUCache(object):
+    """Thread-safe in-process LRU cache whose entries expire after `ttl` seconds"""
+
+    def __init__(self, max_size=1024, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                return default
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def new_version():
+    # microseconds since the epoch rather than 1, so a version lost with an
+    # evicted key is never handed out again
+    return int(time.time() * 1000000)
+
+
+class TieredCache(object):
+    """
+    In-process LRU in front of an optional shared Django cache backend.
+
+    Configured through a settings dict (see `API_CLIENT_CACHE` in settings)
+    with the keys `TTL`, `MAX_SIZE` and `BACKEND`, the latter being an alias
+    of `CACHES` or None to keep entries local to the process.
+
+    With a shared backend, local entries are tagged with a generation kept
+    in it, which every delete bumps, so a delete in one process drops the
+    local entries of all of them. Without one, other processes only see a
+    delete once their entry expires.
+    """
+
+    def __init__(self, prefix, setting_name):
+        self.prefix = prefix
+        config = getattr(settings, setting_name, {})
+        self.ttl = config.get('TTL', 60)
+        self.local = LRUCache(max_size=config.get('MAX_SIZE', 1024), ttl=self.ttl)
+        backend = config.get('BACKEND')
+        self.shared = caches[backend] if backend else None
+        self.generation_key = '{}:generation'.format(prefix)
+
+    def make_key(self, *parts):
+        """Hashes `parts` so secrets never show up as cache keys"""
+        digest = hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+        return '{}:{}'.format(self.prefix, digest)
+
+    def get_generation(self):
+        generation = self.shared.get(self.generation_key)
+        if generation is None:
+            self.shared.add(self.generation_key, new_version(), None)
+            generation = self.shared.get(self.generation_key)
+        return generation
+
+    def get(self, key, default=None):
+        if self.shared is None:
+            return self.local.get(key, default)
+        generation = self.get_generation()
+        entry = self.local.get(key)
+        if entry is not None and entry[0] == generation:
+            return entry[1]
+        value = self.shared.get(key, default)
+        if value is not default:
+            self.local.set(key, (generation, value))
+        return value
+
+    def set(self, key, value, ttl=None):
+        if self.shared is None:
+            self.local.set(key, value, ttl)
+            return
+        self.local.set(key, (self.get_generation(), value), ttl)
+        self.shared.set(key, value, self.ttl if ttl is None else ttl)
+
+    def delete(self, key):
+        self.local.delete(key)
+        if self.shared is not None:
+            # dropped from the shared tier first, so a process reading the
+            # old generation can only fetch the entry again before it
+            self.shared.delete(key)
+            try:
+                self.shared.incr(self.generation_key)
+            except ValueError:
+                self.shared.set(self.generation_key, new_version(), None)
+
+    def clear(self):
+        self.local.clear()
+
+
+CATALOG_VERSION_KEY = 'catalog:version'
+CATALOG_MODIFIED_KEY = 'catalog:modified'
+
+
+def get_response_cache():
+    """Returns the backend of cached responses, None when caching is off"""
+    config = getattr(settings, 'API_RESPONSE_CACHE', {})
+    backend = config.get('BACKEND', 'default')
+    return caches[backend] if backend else None
+
+
+def get_catalog_state():
+    """Returns the current (version, last modified timestamp) of the catalog"""
+    cache = get_response_cache()
+    state = cache.get_many([CATALOG_VERSION_KEY, CATALOG_MODIFIED_KEY])
+    if len(state) < 2:
+        cache.add(CATALOG_VERSION_KEY, new_version(), None)
+        cache.add(CATALOG_MODIFIED_KEY, time.time(), None)
+        state = cache.get_many([CATALOG_VERSION_KEY, CATALOG_MODIFIED_KEY])
+    return state[CATALOG_VERSION_KEY], state[CATALOG_MODIFIED_KEY]
+
+
+def bump_catalog_version():
+    cache = get_response_cache()
+    if cache is None:
+        return
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.set(CATALOG_VERSION_KEY, new_version(), None)
+    cache.set(CATALOG_MODIFIED_KEY, time.time(), None)
@@ -0,0 +1,80 @@
+from decimal import Decimal, InvalidOperation
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+
+TRUE_VALUES = ('true', '1')
+FALSE_VALUES = ('false', '0')
+
+# largest value of an AutoField on every backend
+MAX_ID = 2 ** 31 - 1
+
+
+class ProductFilterBackend(BaseFilterBackend):
+    """
+    Whitelisted filtering and ordering for the products list.
+
+    `category` and `featured` equality filters may be combined with either
+    a price range or an ordering on one of `ordering_fields`. Each of those
+    shapes is covered by a composite index on products_product ending in
+    the id tie-breaker, see Product.Meta.indexes. `sku` has its own index
+    and combines with anything. Any other combination is rejected with 400.
+    """
+    ordering_param = 'ordering'
+    ordering_fields = ('price', 'created')
+    default_ordering = ('created', 'id')
+
+    def filter_queryset(self, request, queryset, view):
+        if getattr(view, 'detail', False):
+            return queryset
+        filters = self.get_filters(request)
+        ordering = self.get_ordering(request, queryset, view)
+        return queryset.filter(**filters).order_by(*ordering)
+
+    def get_filters(self, request):
+        params = request.query_params
+        filters = {}
+        if 'category' in params:
+            try:
+                filters['category_id'] = int(params['category'])
+            except ValueError:
+                raise ValidationError({'category': ['A valid integer is required.']})
+            if not 0 < filters['category_id'] <= MAX_ID:
+                raise ValidationError({'category': [
+                    'Ensure this value is between 1 and {}.'.format(MAX_ID)]})
+        if 'featured' in params:
+            value = params['featured'].lower()
+            if value not in TRUE_VALUES + FALSE_VALUES:
+                raise ValidationError({'featured': ['Must be either true or false.']})
+            filters['featured'] = value in TRUE_VALUES
+        if 'sku' in params:
+            filters['sku'] = params['sku']
+        for param, lookup in [('price_min', 'price__gte'), ('price_max', 'price__lte')]:
+            if param in params:
+                try:
+                    filters[lookup] = Decimal(params[param])
+                except InvalidOperation:
+                    raise ValidationError({param: ['A valid number is required.']})
+                # inf and nan parse, but no database can compare with them
+                if not filters[lookup].is_finite():
+                    raise ValidationError({param: ['A valid number is required.']})
+        return filters
+
+    def get_ordering(self, request, queryset, view):
+        """Returns the index backed ordering, also used by cursor pagination"""
+        params = request.query_params
+        has_price_range = 'price_min' in params or 'price_max' in params
+
+        ordering = params.get(self.ordering_param)
+        if not ordering:
+            return ('price', 'id') if has_price_range else self.default_ordering
+
+        field = ordering.lstrip('-')
+        if field not in self.ordering_fields:
+            raise ValidationError({self.ordering_param: [
+                'Ordering must be one of: {}.'.format(', '.join(self.ordering_fields))]})
+        if has_price_range and field != 'price':
+            raise ValidationError({self.ordering_param: [
+                'A price range can only be ordered by price.']})
+        return (ordering, '-id' if ordering.startswith('-') else 'id')
@@ -0,0 +1,49 @@
+"""Helpers to run the project under gunicorn for the benchmark commands"""
+import os
+import socket
+import subprocess
+import sys
+import time
+from urllib.error import HTTPError, URLError
+from urllib.request import urlopen
+
+from django.conf import settings
+from django.core.management.base import CommandError
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(stderr=subprocess.DEVNULL, app='ecommerce.wsgi', **env):
+    """
+    Starts gunicorn.conf.py on a free port with the current settings module,
+    `env` overriding the environment. Returns (process, port).
+    """
+    port = free_port()
+    env = dict(os.environ, PORT=str(port), **env)
+    env.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce.settings.prod')
+    # gunicorn 19 has no __main__ module
+    command = [sys.executable, '-c', 'from gunicorn.app.wsgiapp import run; run()',
+               '-c', 'gunicorn.conf.py', app]
+    process = subprocess.Popen(
+        command, cwd=settings.PROJECT_DIR, env=env, stdout=subprocess.DEVNULL,
+        stderr=stderr, universal_newlines=True)
+    return process, port
+
+
+def wait_for_response(port, path, start, timeout):
+    """Polls path until any response arrives, returns the perf_counter() then"""
+    url = 'http://127.0.0.1:{}{}'.format(port, path)
+    while time.perf_counter() - start < timeout:
+        try:
+            urlopen(url, timeout=timeout).close()
+        except HTTPError:
+            pass
+        except (URLError, ConnectionError):
+            time.sleep(0.005)
+            continue
+        return time.perf_counter()
+    raise CommandError('No response from {} after {}s'.format(url, timeout))
@@ -0,0 +1,253 @@
+import base64
+import http.client
+import json
+import math
+import random
+import re
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+from rest_framework.authtoken.models import Token
+
+from api.management.commands._gunicorn import start_gunicorn, wait_for_response
+from api.models import APIClient
+from products.loader import load_catalog, synthetic_records
+from products.models import Category, Product
+
+
+QUERIES_RE = re.compile(r'desc="(\d+) queries"')
+EXPECTED_STATUS = {'list': 200, 'retrieve': 200, 'create': 201}
+
+
+class Command(BaseCommand):
+    help = 'Load tests the products API under gunicorn and saves the results as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--products', type=int, default=10000,
+            help='Products seeded before the run')
+        parser.add_argument(
+            '--requests', type=int, default=500,
+            help='Requests per scenario')
+        parser.add_argument(
+            '--warmup', type=int, default=20,
+            help='Unmeasured requests sent before each scenario')
+        parser.add_argument(
+            '--concurrency', type=int, default=8,
+            help='Concurrent client connections')
+        parser.add_argument(
+            '--workers', type=int, default=2,
+            help='Gunicorn workers')
+        parser.add_argument(
+            '--threads', type=int, default=4,
+            help='Threads per gunicorn worker')
+        parser.add_argument(
+            '--auth', nargs='+', default=['basic', 'token', 'apiclient'],
+            choices=['basic', 'token', 'apiclient'])
+        parser.add_argument(
+            '--actions', nargs='+', default=['list', 'retrieve', 'create'],
+            choices=list(EXPECTED_STATUS))
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Seed of the requested pages, ids and payloads')
+        parser.add_argument(
+            '--output',
+            help='JSON file the results are written to, bench-<commit>.json by default')
+        parser.add_argument(
+            '--compare',
+            help='JSON results of an earlier run to compare against')
+
+    def handle(self, *args, **options):
+        if not getattr(settings, 'BENCHMARK', False):
+            raise CommandError(
+                'bench_api flushes the database, run it with --settings ecommerce.settings.bench')
+
+        self.seed(options['products'])
+        server, port = start_gunicorn(
+            WEB_CONCURRENCY=str(options['workers']), GUNICORN_THREADS=str(options['threads']),
+            GUNICORN_MAX_REQUESTS='0')
+        try:
+            wait_for_response(port, '/api/', time.perf_counter(), 30)
+            results = OrderedDict()
+            self.stdout.write('{:>20} {:>9} {:>9} {:>9} {:>10} {:>9} {:>7}'.format(
+                'scenario', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'requests/s',
+                'queries', 'errors'))
+            for auth in options['auth']:
+                for action in options['actions']:
+                    name = '{}:{}'.format(auth, action)
+                    results[name] = self.run_scenario(port, auth, action, options)
+                    self.stdout.write(
+                        '{:>20} {p50_ms:>9.2f} {p95_ms:>9.2f} {p99_ms:>9.2f} '
+                        '{requests_per_second:>10.1f} {queries_per_request:>9.2f} '
+                        '{errors:>7}'.format(name, **results[name]))
+        finally:
+            server.terminate()
+            server.wait()
+
+        commit = self.get_commit()
+        report = OrderedDict([
+            ('commit', commit),
+            ('created', timezone.now().isoformat()),
+            ('database', settings.DATABASES['default']['ENGINE']),
+            ('options', {key: options[key] for key in [
+                'products', 'requests', 'warmup', 'concurrency', 'workers', 'threads',
+                'seed']}),
+            ('results', results),
+        ])
+        output = options['output'] or 'bench-{}.json'.format(commit or 'unknown')
+        with open(output, 'w') as results_file:
+            json.dump(report, results_file, indent=2)
+        self.stdout.write('Results written to {}'.format(output))
+
+        if options['compare']:
+            with open(options['compare']) as previous_file:
+                self.compare(json.load(previous_file), report)
+
+    def seed(self, products):
+        call_command('migrate', interactive=False, verbosity=0)
+        call_command('flush', interactive=False, verbosity=0)
+        stats, seconds = load_catalog(synthetic_records(products))
+        self.stdout.write('Seeded {} products in {:.2f}s'.format(stats['rows'], seconds))
+
+        User.objects.create_superuser('bench', 'bench@example.com', 'bench')
+        user = User.objects.get(username='bench')
+        token = Token.objects.create(user=user)
+        api_client = APIClient.objects.create(
+            name='bench', accesskey=get_random_string(32), secretkey=get_random_string(32))
+        self.credentials = {
+            'basic': ({'Authorization': 'Basic ' + base64.b64encode(b'bench:bench').decode()}, ''),
+            'token': ({'Authorization': 'Token ' + token.key}, ''),
+            'apiclient': ({'secretkey': api_client.secretkey},
+                          'accesskey=' + api_client.accesskey),
+        }
+        # only odd ids may be retrieved, see IsOddProductID
+        self.product_ids = [
+            product_id for product_id in Product.objects.values_list('id', flat=True)
+            if product_id % 2]
+        self.category_ids = list(Category.objects.values_list('id', flat=True))
+        self.skus = iter(range(90000000, 100000000))
+
+    def build_requests(self, auth, action, count, seed):
+        """Returns `count` (method, path, body, headers), the same for every run"""
+        rnd = random.Random('{}:{}:{}'.format(seed, auth, action))
+        headers, query = self.credentials[auth]
+        pages = max(len(self.product_ids) * 2 // 20, 1)
+        requests = []
+        for _ in range(count):
+            body = None
+            if action == 'list':
+                method, path = 'GET', '/api/products/?page={}&page_size=20'.format(
+                    rnd.randint(1, pages))
+            elif action == 'retrieve':
+                method, path = 'GET', '/api/products/{}/'.format(rnd.choice(self.product_ids))
+            else:
+                method, path = 'POST', '/api/products/'
+                body = json.dumps({
+                    'name': 'Bench product', 'sku': str(next(self.skus)),
+                    'category': rnd.choice(self.category_ids),
+                    'description': 'Created by bench_api',
+                    'price': '{:.2f}'.format(rnd.uniform(1, 500)),
+                    'featured': rnd.random() < 0.1,
+                })
+            if query:
+                path += ('&' if '?' in path else '?') + query
+            request_headers = dict(headers, **({'Content-Type': 'application/json'} if body else {}))
+            requests.append((method, path, body, request_headers))
+        return requests
+
+    def run_scenario(self, port, auth, action, options):
+        self.send_all(port, self.build_requests(
+            auth, action, options['warmup'], options['seed'] - 1), options['concurrency'])
+        requests = self.build_requests(auth, action, options['requests'], options['seed'])
+        start = time.perf_counter()
+        samples = self.send_all(port, requests, options['concurrency'])
+        elapsed = time.perf_counter() - start
+
+        latencies = sorted(latency for latency, _, _ in samples)
+        queries = [count for _, _, count in samples if count is not None]
+        return OrderedDict([
+            ('requests', len(samples)),
+            ('errors', sum(status != EXPECTED_STATUS[action] for _, status, _ in samples)),
+            ('requests_per_second', len(samples) / elapsed),
+            ('p50_ms', self.percentile(latencies, 50) * 1000),
+            ('p95_ms', self.percentile(latencies, 95) * 1000),
+            ('p99_ms', self.percentile(latencies, 99) * 1000),
+            ('queries_per_request', sum(queries) / len(queries) if queries else 0),
+        ])
+
+    def send_all(self, port, requests, concurrency):
+        """Sends requests over `concurrency` keep-alive connections"""
+        pending = iter(requests)
+        lock = threading.Lock()
+        samples = []
+
+        def client():
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            while True:
+                with lock:
+                    request = next(pending, None)
+                if request is None:
+                    break
+                sample = self.send(connection, *request)
+                with lock:
+                    samples.append(sample)
+            connection.close()
+
+        threads = [threading.Thread(target=client) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return samples
+
+    def send(self, connection, method, path, body, headers):
+        """Returns (seconds, status, queries) of one request, status 0 on failure"""
+        start = time.perf_counter()
+        try:
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            return time.perf_counter() - start, 0, None
+        elapsed = time.perf_counter() - start
+        match = QUERIES_RE.search(response.getheader('Server-Timing') or '')
+        return elapsed, response.status, int(match.group(1)) if match else None
+
+    def percentile(self, values, percent):
+        if not values:
+            return 0
+        return values[max(int(math.ceil(percent / 100 * len(values))) - 1, 0)]
+
+    def get_commit(self):
+        try:
+            return subprocess.check_output(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.PROJECT_DIR,
+                stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def compare(self, previous, current):
+        self.stdout.write('Compared to {}:'.format(previous.get('commit')))
+        self.stdout.write('{:>20} {:>22} {:>22}'.format('scenario', 'requests/s', 'p95 (ms)'))
+        for name, result in current['results'].items():
+            before = previous['results'].get(name)
+            if before is None:
+                continue
+            self.stdout.write('{:>20} {:>22} {:>22}'.format(
+                name,
+                self.change(before['requests_per_second'], result['requests_per_second']),
+                self.change(before['p95_ms'], result['p95_ms'])))
+
+    def change(self, before, after):
+        if not before:
+            return '{:.1f} -> {:.1f}'.format(before, after)
+        return '{:.1f} -> {:.1f} ({:+.0%})'.format(before, after, after / before - 1)
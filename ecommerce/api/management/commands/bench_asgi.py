@@ -0,0 +1,176 @@
+import asyncio
+import itertools
+import resource
+import time
+
+from django.conf import settings
+from django.core.management.base import CommandError
+
+from api.management.commands import bench_api
+from api.management.commands._gunicorn import start_gunicorn, wait_for_response
+
+
+STACKS = {
+    # (application, worker class)
+    'wsgi': ('ecommerce.wsgi', 'gthread'),
+    'asgi': ('ecommerce.asgi', 'uvicorn'),
+}
+
+
+class Command(bench_api.Command):
+    help = ('Compares how the gthread (WSGI) and uvicorn (ASGI) workers hold up '
+            'under many concurrent keep-alive clients')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--products', type=int, default=2000,
+            help='Products seeded before the run')
+        parser.add_argument(
+            '--clients', type=int, nargs='+', default=[100, 1000],
+            help='Concurrent client connections of each run')
+        parser.add_argument(
+            '--duration', type=float, default=10,
+            help='Seconds each run lasts')
+        parser.add_argument(
+            '--think-time', type=float, default=0,
+            help='Milliseconds each client waits between its requests')
+        parser.add_argument(
+            '--timeout', type=float, default=30,
+            help='Seconds before a connection or a response counts as an error')
+        parser.add_argument(
+            '--workers', type=int, default=2,
+            help='Gunicorn workers')
+        parser.add_argument(
+            '--threads', type=int, default=4,
+            help='Threads per gthread worker, and ASGI_THREADS of uvicorn workers')
+        parser.add_argument(
+            '--stacks', nargs='+', default=list(STACKS), choices=list(STACKS))
+        parser.add_argument(
+            '--auth', default='token', choices=['basic', 'token', 'apiclient'])
+        parser.add_argument(
+            '--action', default='retrieve', choices=['list', 'retrieve'])
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Seed of the requested pages and ids')
+
+    def handle(self, *args, **options):
+        if not getattr(settings, 'BENCHMARK', False):
+            raise CommandError(
+                'bench_asgi flushes the database, run it with --settings ecommerce.settings.bench')
+        # every client holds a socket, on both ends when the server is local
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        needed = max(options['clients']) * 2 + 256
+        if soft != resource.RLIM_INFINITY and soft < needed:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (min(needed, hard), hard))
+
+        self.seed(options['products'])
+        requests = self.build_requests(
+            options['auth'], options['action'], 1000, options['seed'])
+
+        self.stdout.write('{:>6} {:>8} {:>10} {:>9} {:>9} {:>10} {:>7}'.format(
+            'stack', 'clients', 'connected', 'p50 (ms)', 'p99 (ms)', 'requests/s', 'errors'))
+        for name in options['stacks']:
+            app, worker_class = STACKS[name]
+            server, port = start_gunicorn(
+                app=app, GUNICORN_WORKER_CLASS=worker_class,
+                WEB_CONCURRENCY=str(options['workers']),
+                GUNICORN_THREADS=str(options['threads']), ASGI_THREADS=str(options['threads']),
+                GUNICORN_MAX_REQUESTS='0',
+                GUNICORN_WORKER_CONNECTIONS=str(max(options['clients'])),
+                GUNICORN_KEEPALIVE=str(int(options['timeout'])))
+            try:
+                wait_for_response(port, '/api/', time.perf_counter(), 30)
+                for clients in options['clients']:
+                    result = self.run_clients(port, requests, clients, options)
+                    self.stdout.write(
+                        '{:>6} {:>8} {connected:>10} {p50_ms:>9.2f} {p99_ms:>9.2f} '
+                        '{requests_per_second:>10.1f} {errors:>7}'.format(
+                            name, clients, **result))
+            finally:
+                server.terminate()
+                server.wait()
+
+    def run_clients(self, port, requests, clients, options):
+        loop = asyncio.new_event_loop()
+        samples = []
+        try:
+            start = time.perf_counter()
+            deadline = loop.time() + options['duration']
+            served = loop.run_until_complete(asyncio.gather(*[
+                self.client(port, requests[index:] + requests[:index], deadline,
+                            samples, options)
+                for index in range(clients)
+            ], loop=loop))
+            elapsed = time.perf_counter() - start
+        finally:
+            loop.close()
+
+        latencies = sorted(latency for latency, status in samples if status == 200)
+        return {
+            'connected': sum(served),
+            'errors': sum(status != 200 for _, status in samples),
+            'requests_per_second': len(latencies) / elapsed,
+            'p50_ms': self.percentile(latencies, 50) * 1000,
+            'p99_ms': self.percentile(latencies, 99) * 1000,
+        }
+
+    async def client(self, port, requests, deadline, samples, options):
+        """
+        Sends requests over one keep-alive connection until the deadline,
+        returns whether any of them was answered.
+        """
+        loop = asyncio.get_event_loop()
+        start = time.perf_counter()
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection('127.0.0.1', port), options['timeout'])
+        except (OSError, asyncio.TimeoutError):
+            samples.append((time.perf_counter() - start, 0))
+            return False
+        served = False
+        try:
+            for request in itertools.cycle(requests):
+                if loop.time() >= deadline:
+                    break
+                start = time.perf_counter()
+                try:
+                    status = await asyncio.wait_for(
+                        self.send_async(reader, writer, *request), options['timeout'])
+                except (OSError, ValueError, asyncio.TimeoutError,
+                        asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    samples.append((time.perf_counter() - start, 0))
+                    break
+                samples.append((time.perf_counter() - start, status))
+                served = True
+                if options['think_time']:
+                    await asyncio.sleep(options['think_time'] / 1000)
+        finally:
+            writer.close()
+        return served
+
+    async def send_async(self, reader, writer, method, path, body, headers):
+        """Returns the status of one request, reading its whole response"""
+        payload = body.encode('utf-8') if body else b''
+        lines = ['{} {} HTTP/1.1'.format(method, path), 'Host: 127.0.0.1']
+        lines += ['{}: {}'.format(name, value) for name, value in headers.items()]
+        if payload:
+            lines.append('Content-Length: {}'.format(len(payload)))
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + payload)
+
+        head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1')
+        status_line, *header_lines = head.strip().split('\r\n')
+        response_headers = {}
+        for line in header_lines:
+            name, _, value = line.partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+        if response_headers.get('transfer-encoding') == 'chunked':
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                await reader.readexactly(size + 2)
+                if not size:
+                    break
+        else:
+            await reader.readexactly(int(response_headers.get('content-length', 0)))
+        if response_headers.get('connection') == 'close':
+            raise ConnectionError('The server closed the connection')
+        return int(status_line.split()[1])
@@ -0,0 +1,49 @@
+import base64
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.authentication import BasicAuthentication
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.authentication import CachedBasicAuthentication, basic_auth_cache
+
+
+class Command(BaseCommand):
+    help = 'Compares BasicAuthentication against CachedBasicAuthentication'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests', type=int, default=20,
+            help='Authentications per run')
+        parser.add_argument(
+            '--repeat', type=int, default=3,
+            help='Runs per authenticator, the best one is reported')
+
+    def handle(self, *args, **options):
+        username, password = 'bench-basic-auth', 'bench-basic-auth-password'
+        credentials = base64.b64encode('{}:{}'.format(username, password).encode('utf-8'))
+        request = Request(APIRequestFactory().get(
+            '/api/products/', HTTP_AUTHORIZATION='Basic ' + credentials.decode('ascii')))
+
+        self.stdout.write('{:>10} {:>14} {:>12}'.format('auth', 'ms/request', 'requests/s'))
+        # the user only exists for the duration of the benchmark
+        with transaction.atomic():
+            User.objects.create_user(username, password=password)
+            for name, authenticator in [('uncached', BasicAuthentication()),
+                                        ('cached', CachedBasicAuthentication())]:
+                basic_auth_cache.clear()
+                elapsed = min(self.measure(authenticator, request, options['requests'])
+                              for _ in range(options['repeat']))
+                self.stdout.write('{:>10} {:>14.3f} {:>12.0f}'.format(
+                    name, elapsed * 1000, 1 / elapsed))
+            transaction.set_rollback(True)
+        basic_auth_cache.clear()
+
+    def measure(self, authenticator, request, requests):
+        start = time.perf_counter()
+        for _ in range(requests):
+            user, _ = authenticator.authenticate(request)
+        return (time.perf_counter() - start) / requests
@@ -0,0 +1,63 @@
+import re
+import subprocess
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.management.commands._gunicorn import start_gunicorn, wait_for_response
+
+
+READY_RE = re.compile(r'Worker (\d+) ready in ([\d.]+) ms')
+
+
+class Command(BaseCommand):
+    help = 'Measures gunicorn cold starts with and without preload_app'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Gunicorn workers started on each run')
+        parser.add_argument(
+            '--runs', type=int, default=3,
+            help='Cold starts per mode, the best one is reported')
+        parser.add_argument(
+            '--path', default='/api/',
+            help='Requested until the first response arrives')
+        parser.add_argument(
+            '--timeout', type=float, default=30,
+            help='Seconds to wait for a cold start')
+
+    def handle(self, *args, **options):
+        self.stdout.write('{:>8} {:>16} {:>16} {:>16}'.format(
+            'preload', 'first resp (ms)', 'worker avg (ms)', 'worker max (ms)'))
+        for preload in ['1', '0']:
+            runs = [self.cold_start(preload, options) for _ in range(options['runs'])]
+            first_response, workers = min(runs, key=lambda run: run[0])
+            self.stdout.write('{:>8} {:>16.1f} {:>16.1f} {:>16.1f}'.format(
+                'yes' if preload == '1' else 'no', first_response * 1000,
+                sum(workers) / len(workers), max(workers)))
+
+    def cold_start(self, preload, options):
+        """Returns (seconds to first response, ms each worker took to boot)"""
+        start = time.perf_counter()
+        server, port = start_gunicorn(
+            stderr=subprocess.PIPE, GUNICORN_PRELOAD=preload,
+            WEB_CONCURRENCY=str(options['workers']))
+        try:
+            first_response = wait_for_response(
+                port, options['path'], start, options['timeout']) - start
+            workers = self.wait_for_workers(server, options['workers'])
+        finally:
+            server.terminate()
+            server.wait()
+        return first_response, workers
+
+    def wait_for_workers(self, server, count):
+        booted = {}
+        for line in server.stderr:
+            match = READY_RE.search(line)
+            if match:
+                booted[match.group(1)] = float(match.group(2))
+                if len(booted) == count:
+                    return list(booted.values())
+        raise CommandError('Gunicorn exited before {} workers booted'.format(count))
@@ -0,0 +1,55 @@
+import time
+
+from api.management.commands import bench_serializers
+from api.middleware import Compressor, brotli
+from api.renderers import FastJSONRenderer
+from api.serializers import ProductSerializer
+
+
+class Command(bench_serializers.Command):
+    help = ('Measures the CPU time and bytes saved compressing product pages at '
+            'each gzip level and brotli quality, see RESPONSE_COMPRESSION')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', nargs='+', type=int, default=[20, 100, 1000, 10000],
+            help='Number of products on each page')
+        parser.add_argument(
+            '--gzip-levels', nargs='+', type=int, default=[1, 6, 9])
+        parser.add_argument(
+            '--brotli-qualities', nargs='+', type=int, default=[1, 4, 6, 11])
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Runs per size and setting, the best one is reported')
+
+    def handle(self, *args, **options):
+        settings = [('gzip', {'GZIP_LEVEL': level}, level) for level in options['gzip_levels']]
+        if brotli is not None:
+            settings += [('br', {'BROTLI_QUALITY': quality}, quality)
+                         for quality in options['brotli_qualities']]
+        else:
+            self.stderr.write('brotli is not installed, only gzip is measured')
+
+        self.stdout.write('{:>6} {:>9} {:>6} {:>10} {:>10} {:>7} {:>8}'.format(
+            'rows', 'encoding', 'level', 'time (ms)', 'size (KB)', 'ratio', 'MB/s'))
+        for size in options['sizes']:
+            content = FastJSONRenderer().render(
+                ProductSerializer(self.build_products(size), many=True).data)
+            self.stdout.write('{:>6} {:>9} {:>6} {:>10} {:>10.1f} {:>7} {:>8}'.format(
+                size, 'identity', '-', '-', len(content) / 1024, '-', '-'))
+            for encoding, config, level in settings:
+                elapsed, compressed = self.measure_compression(
+                    options['repeat'], encoding, config, content)
+                self.stdout.write(
+                    '{:>6} {:>9} {:>6} {:>10.2f} {:>10.1f} {:>6.1f}x {:>8.1f}'.format(
+                        size, encoding, level, elapsed * 1000, len(compressed) / 1024,
+                        len(content) / len(compressed), len(content) / elapsed / 1e6))
+
+    def measure_compression(self, repeat, encoding, config, content):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            compressed = Compressor(encoding, config).compress(content)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, compressed
@@ -0,0 +1,62 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import Client, override_settings
+from django.urls import path
+
+
+STOCK_MIDDLEWARE = [
+    'django.middleware.security.SecurityMiddleware',
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+]
+
+
+def ping(request):
+    return HttpResponse('pong', content_type='application/json')
+
+
+# served instead of the project URLs, so only the middleware is measured
+urlpatterns = [
+    path('api/ping/', ping),
+]
+
+
+class Command(BaseCommand):
+    help = 'Measures the per-request overhead of the middleware on API paths'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests', type=int, default=5000,
+            help='Requests per run')
+        parser.add_argument(
+            '--repeat', type=int, default=3,
+            help='Runs per stack, the best one is reported')
+
+    def handle(self, *args, **options):
+        self.stdout.write('{:>10} {:>16}'.format('stack', 'us/request'))
+        results = {}
+        for name, middleware in [('stock', STOCK_MIDDLEWARE), ('scoped', settings.MIDDLEWARE)]:
+            results[name] = min(
+                self.measure(middleware, options['requests'])
+                for _ in range(options['repeat']))
+            self.stdout.write('{:>10} {:>16.1f}'.format(name, results[name] * 1e6))
+        self.stdout.write('saved {:.1f} us/request ({:.0%})'.format(
+            (results['stock'] - results['scoped']) * 1e6,
+            1 - results['scoped'] / results['stock']))
+
+    def measure(self, middleware, requests):
+        with override_settings(MIDDLEWARE=middleware, ROOT_URLCONF=__name__,
+                               ALLOWED_HOSTS=['*']):
+            client = Client()
+            client.get('/api/ping/')
+            start = time.perf_counter()
+            for _ in range(requests):
+                client.get('/api/ping/')
+            return (time.perf_counter() - start) / requests
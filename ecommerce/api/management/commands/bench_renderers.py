@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import CommandError
+from rest_framework.renderers import JSONRenderer
+
+from api.management.commands import bench_serializers
+from api.renderers import FastJSONRenderer, MessagePackRenderer, msgpack, orjson
+from api.serializers import ProductSerializer
+
+
+class Command(bench_serializers.Command):
+    help = 'Compares the time and payload size of each response format'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', nargs='+', type=int, default=[10, 1000, 100000],
+            help='Number of products rendered on each run')
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Runs per size and format, the best one is reported')
+
+    def handle(self, *args, **options):
+        renderers = [('json', JSONRenderer())]
+        if orjson is not None:
+            renderers.append(('orjson', FastJSONRenderer()))
+        else:
+            self.stderr.write('orjson is not installed, FastJSONRenderer is skipped')
+        if msgpack is not None:
+            renderers.append(('msgpack', MessagePackRenderer()))
+        else:
+            self.stderr.write('msgpack is not installed, MessagePackRenderer is skipped')
+
+        self.stdout.write('{:>8} {:>8} {:>12} {:>12} {:>8}'.format(
+            'rows', 'format', 'render (ms)', 'size (KB)', 'speedup'))
+        for size in options['sizes']:
+            data = ProductSerializer(self.build_products(size), many=True).data
+            baseline = None
+            for name, renderer in renderers:
+                elapsed, output = self.measure_render(options['repeat'], renderer, data)
+                if baseline is None:
+                    baseline, expected = elapsed, output
+                elif renderer.media_type == 'application/json' and output != expected:
+                    raise CommandError('{} output differs for {} rows'.format(name, size))
+                self.stdout.write('{:>8} {:>8} {:>12.2f} {:>12.1f} {:>7.1f}x'.format(
+                    size, name, elapsed * 1000, len(output) / 1024, baseline / elapsed))
+
+    def measure_render(self, repeat, renderer, data):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            output = renderer.render(data, renderer.media_type)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, output
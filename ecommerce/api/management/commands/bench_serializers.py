@@ -0,0 +1,65 @@
+import time
+from collections import namedtuple
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from api.serializers import ProductSerializer, ProductReadSerializer
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Compares ProductSerializer against ProductReadSerializer'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', nargs='+', type=int, default=[10, 1000, 100000],
+            help='Number of rows serialized on each run')
+        parser.add_argument(
+            '--repeat', type=int, default=3,
+            help='Runs per size, the best one is reported')
+
+    def handle(self, *args, **options):
+        renderer = JSONRenderer()
+        columns = ProductReadSerializer.get_columns()
+        Row = namedtuple('Row', columns)
+
+        self.stdout.write('{:>8} {:>14} {:>14} {:>8}'.format(
+            'rows', 'model (ms)', 'read (ms)', 'speedup'))
+        for size in options['sizes']:
+            products = self.build_products(size)
+            rows = [Row(*(getattr(p, c if c != 'category' else 'category_id')
+                          for c in columns)) for p in products]
+
+            model_time, model_output = self.measure(
+                options['repeat'], renderer, ProductSerializer, products)
+            read_time, read_output = self.measure(
+                options['repeat'], renderer, ProductReadSerializer, rows)
+            if model_output != read_output:
+                raise CommandError(
+                    'Serializers disagree for {} rows'.format(size))
+
+            self.stdout.write('{:>8} {:>14.2f} {:>14.2f} {:>7.1f}x'.format(
+                size, model_time * 1000, read_time * 1000, model_time / read_time))
+
+    def build_products(self, size):
+        created = timezone.now()
+        return [
+            Product(id=i, name='Product {}'.format(i), sku='{:08d}'.format(i),
+                    category_id=i % 10 + 1, description='Description {}'.format(i),
+                    price=Decimal(i % 10000) / 100 + Decimal('0.00'),
+                    created=created - timedelta(seconds=i), featured=i % 2 == 0)
+            for i in range(1, size + 1)
+        ]
+
+    def measure(self, repeat, renderer, serializer_class, rows):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            output = renderer.render(serializer_class(rows, many=True).data)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, output
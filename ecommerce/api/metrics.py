@@ -0,0 +1,202 @@
+"""
+Minimal in-process metrics, exposed in the Prometheus text format by the
+/api/metrics/ endpoint.
+
+Metrics live in the memory of each process, so every gunicorn worker reports
+its own; scrape the workers individually or aggregate on the Prometheus
+side.
+"""
+import cProfile
+import io
+import itertools
+import pstats
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+registry = OrderedDict()
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in labels))
+
+
+class Histogram(object):
+    """Cumulative histogram of observed values, per combination of labels"""
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+        registry[name] = self
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.series.get(key)
+            if counts is None:
+                # one count per bucket, then +Inf, then the sum
+                counts = self.series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def reset(self):
+        with self.lock:
+            self.series.clear()
+
+    def collect(self):
+        with self.lock:
+            series = sorted((key, list(counts)) for key, counts in self.series.items())
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} {}'.format(self.name, self.type)]
+        for key, counts in series:
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(
+                    self.name, format_labels(labels + [('le', bound)]), cumulative))
+            lines.append('{}_sum{} {}'.format(self.name, format_labels(labels), counts[-1]))
+            lines.append('{}_count{} {}'.format(self.name, format_labels(labels), cumulative))
+        return lines
+
+
+def render_metrics():
+    lines = []
+    for metric in registry.values():
+        lines.extend(metric.collect())
+    return '\n'.join(lines) + '\n'
+
+
+authentication_seconds = Histogram(
+    'api_authentication_seconds', 'Time spent authenticating API requests.',
+    labelnames=('authenticator', 'outcome'))
+
+request_seconds = Histogram(
+    'api_request_seconds', 'Wall time of API requests.',
+    labelnames=('view', 'action'))
+request_db_queries = Histogram(
+    'api_request_db_queries', 'Database queries made by API requests.',
+    labelnames=('view', 'action'), buckets=COUNT_BUCKETS)
+request_db_seconds = Histogram(
+    'api_request_db_seconds', 'Time API requests spent in database queries.',
+    labelnames=('view', 'action'))
+request_serializer_seconds = Histogram(
+    'api_request_serializer_seconds', 'Time API requests spent serializing.',
+    labelnames=('view', 'action'))
+response_bytes = Histogram(
+    'api_response_bytes', 'Size of API response bodies, streams excluded.',
+    labelnames=('view', 'action'), buckets=SIZE_BUCKETS)
+
+
+class RequestMetrics(object):
+    """Timings of a single request, collected by InstrumentationMiddleware"""
+
+    def __init__(self):
+        self.view = 'unresolved'
+        self.action = 'unknown'
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.profiler = None
+        self.profile_requested = False
+
+    def start_profile(self, requested=False):
+        """Runs the rest of the request under cProfile, until the middleware stops it"""
+        self.profiler = cProfile.Profile()
+        self.profile_requested = requested
+        self.profiler.enable()
+
+    def record_query(self, execute, sql, params, many, context):
+        """Database execute wrapper, see connection.execute_wrapper()"""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += time.perf_counter() - start
+
+    @contextmanager
+    def serializing(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.serializer_time += time.perf_counter() - start
+
+
+@contextmanager
+def timed_serialization(request):
+    """Adds the time spent in the block to the metrics of request, if any"""
+    metrics = getattr(request, 'api_metrics', None)
+    if metrics is None:
+        yield
+    else:
+        with metrics.serializing():
+            yield
+
+
+class ProfileBuffer(object):
+    """The last `INSTRUMENTATION['PROFILE_BUFFER_SIZE']` request profiles"""
+
+    def __init__(self):
+        self.profiles = deque()
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def add(self, profiler, **info):
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(50)
+        max_size = getattr(settings, 'INSTRUMENTATION', {}).get('PROFILE_BUFFER_SIZE', 20)
+        with self.lock:
+            profile = dict(info, id=next(self.ids), stats=stream.getvalue())
+            self.profiles.append(profile)
+            while len(self.profiles) > max_size:
+                self.profiles.popleft()
+        return profile['id']
+
+    def get(self, profile_id):
+        with self.lock:
+            for profile in self.profiles:
+                if profile['id'] == profile_id:
+                    return profile
+        return None
+
+    def list(self):
+        with self.lock:
+            return [{key: value for key, value in profile.items() if key != 'stats'}
+                    for profile in reversed(self.profiles)]
+
+    def clear(self):
+        with self.lock:
+            self.profiles.clear()
+
+
+profiles = ProfileBuffer()
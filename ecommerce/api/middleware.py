@@ -0,0 +1,215 @@
+import random
+import re
+import time
+import zlib
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.utils.cache import patch_vary_headers
+
+from api import metrics
+from ecommerce.middleware import is_api_request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+STRONG_ETAG_RE = re.compile(r'^"')
+
+
+class InstrumentationMiddleware(object):
+    """
+    Records wall time, database queries, serializer time and response size
+    of API requests per view and action in the histograms of api.metrics,
+    and reports the timings of each request in a Server-Timing header.
+
+    A fraction of requests (INSTRUMENTATION['PROFILE_SAMPLE_RATE']) is run
+    under cProfile, as are views of admins asking for it, see
+    api.mixins.RequestProfileMixin. Profiles are kept in api.metrics.profiles,
+    the id of a requested one is returned in the X-Profile-Id header.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not is_api_request(request):
+            return self.get_response(request)
+
+        config = getattr(settings, 'INSTRUMENTATION', {})
+        request.api_metrics = request_metrics = metrics.RequestMetrics()
+
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(request_metrics.record_query))
+            if random.random() < config.get('PROFILE_SAMPLE_RATE', 0):
+                request_metrics.start_profile()
+            try:
+                response = self.get_response(request)
+            finally:
+                if request_metrics.profiler is not None:
+                    request_metrics.profiler.disable()
+        elapsed = time.perf_counter() - start
+
+        self.observe(request_metrics, elapsed, response)
+        if request_metrics.profiler is not None:
+            profile_id = metrics.profiles.add(
+                request_metrics.profiler, path=request.get_full_path(),
+                view=request_metrics.view, action=request_metrics.action,
+                duration_ms=round(elapsed * 1000, 3), captured=time.time())
+            if request_metrics.profile_requested:
+                response['X-Profile-Id'] = str(profile_id)
+        if config.get('SERVER_TIMING', True):
+            response['Server-Timing'] = self.get_server_timing(request_metrics, elapsed)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request_metrics = getattr(request, 'api_metrics', None)
+        if request_metrics is None:
+            return None
+        view_class = getattr(view_func, 'cls', None)
+        request_metrics.view = view_class.__name__ if view_class else view_func.__name__
+        # viewsets map http methods to actions, plain views are their method
+        actions = getattr(view_func, 'actions', None) or {}
+        method = request.method.lower()
+        request_metrics.action = actions.get(method, method)
+        return None
+
+    def observe(self, request_metrics, elapsed, response):
+        labels = {'view': request_metrics.view, 'action': request_metrics.action}
+        metrics.request_seconds.observe(elapsed, **labels)
+        metrics.request_db_queries.observe(request_metrics.queries, **labels)
+        metrics.request_db_seconds.observe(request_metrics.db_time, **labels)
+        metrics.request_serializer_seconds.observe(request_metrics.serializer_time, **labels)
+        if not response.streaming:
+            metrics.response_bytes.observe(len(response.content), **labels)
+
+    def get_server_timing(self, request_metrics, elapsed):
+        return 'app;dur={:.3f}, db;dur={:.3f};desc="{} queries", serializer;dur={:.3f}'.format(
+            elapsed * 1000, request_metrics.db_time * 1000, request_metrics.queries,
+            request_metrics.serializer_time * 1000)
+
+
+class Compressor(object):
+    """Incremental gzip or brotli compression of a response body"""
+
+    def __init__(self, encoding, config):
+        self.encoding = encoding
+        if encoding == 'br':
+            self.compressor = brotli.Compressor(quality=config.get('BROTLI_QUALITY', 4))
+        else:
+            # wbits 16 + 15 writes a gzip header and trailer around the deflate stream
+            self.compressor = zlib.compressobj(config.get('GZIP_LEVEL', 6), zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        if self.encoding == 'br':
+            return self.compressor.process(data) + self.compressor.finish()
+        return self.compressor.compress(data) + self.compressor.flush()
+
+    def compress_chunk(self, data):
+        """Compresses data and flushes it, so a client can decode it right away"""
+        if self.encoding == 'br':
+            return self.compressor.process(data) + self.compressor.flush()
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self.compressor.finish()
+        return self.compressor.flush()
+
+
+class CompressionMiddleware(object):
+    """
+    Compresses API responses with brotli or gzip, whichever the client
+    prefers in Accept-Encoding, configured by RESPONSE_COMPRESSION.
+
+    Responses shorter than MIN_SIZE, of a type not in CONTENT_TYPES, or
+    already encoded are left alone. So are bodiless responses, 304s
+    included. Streaming responses are compressed and flushed chunk by
+    chunk. Strong ETags are made weak, since they no longer describe the
+    bytes sent, and weak ones still match If-None-Match. Browser pages
+    are never compressed here: HTML holding a CSRF token next to
+    reflected input is open to BREACH.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not is_api_request(request):
+            return response
+
+        config = getattr(settings, 'RESPONSE_COMPRESSION', {})
+        encoding = self.get_encoding(request, response, config)
+        if encoding is None:
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        compressor = Compressor(encoding, config)
+        if response.streaming:
+            response.streaming_content = self.compress_stream(
+                compressor, response.streaming_content)
+            # the length is unknown until the stream ends
+            del response['Content-Length']
+        else:
+            content = compressor.compress(response.content)
+            if len(content) >= len(response.content):
+                return response
+            response.content = content
+            response['Content-Length'] = str(len(content))
+
+        if response.has_header('ETag'):
+            response['ETag'] = STRONG_ETAG_RE.sub('W/"', response['ETag'])
+        response['Content-Encoding'] = encoding
+        return response
+
+    def get_encoding(self, request, response, config):
+        """Returns the encoding to compress response with, None to leave it alone"""
+        if (response.status_code < 200 or response.status_code in (204, 304) or
+                request.method == 'HEAD' or response.has_header('Content-Encoding')):
+            return None
+        if 'no-transform' in response.get('Cache-Control', ''):
+            return None
+        content_type = response.get('Content-Type', '').split(';')[0].strip()
+        if content_type not in config.get('CONTENT_TYPES', ()):
+            return None
+        if not response.streaming and len(response.content) < config.get('MIN_SIZE', 1024):
+            return None
+        return self.negotiate(
+            request.META.get('HTTP_ACCEPT_ENCODING', ''), config.get('ENCODINGS', ('gzip',)))
+
+    def negotiate(self, accept_encoding, encodings):
+        """Returns the client's best rated of encodings, ours break ties"""
+        ratings = {}
+        for item in accept_encoding.split(','):
+            coding, _, params = item.strip().lower().partition(';')
+            quality = 1.0
+            for param in params.split(';'):
+                name, _, value = param.strip().partition('=')
+                if name == 'q':
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            if coding:
+                ratings[coding.strip()] = quality
+        best, best_quality = None, 0.0
+        for encoding in encodings:
+            if encoding == 'br' and brotli is None:
+                continue
+            quality = ratings.get(encoding, ratings.get('*', 0.0))
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def compress_stream(self, compressor, chunks):
+        for chunk in chunks:
+            data = compressor.compress_chunk(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
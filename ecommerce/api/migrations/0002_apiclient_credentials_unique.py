@@ -0,0 +1,17 @@
+# Generated by Django 2.1.5 on 2026-10-18 11:14
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='apiclient',
+            unique_together={('accesskey', 'secretkey')},
+        ),
+    ]
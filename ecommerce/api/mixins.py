@@ -0,0 +1,152 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Exists, OuterRef
+from django.http import Http404
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, urlencode
+from rest_framework.generics import get_object_or_404
+from rest_framework.response import Response
+
+from api.cache import get_catalog_state, get_response_cache
+from api.permissions import QuerysetPermission
+
+
+class CachedResponseMixin(object):
+    """
+    Caches list and retrieve responses until the catalog version changes.
+
+    Only successful responses are cached, after view and object permissions
+    have run, so a cache hit implies the same permission outcome was already
+    granted for that key. Conditional GETs are answered with 304 from the
+    catalog version alone, before any query or serialization.
+    """
+    cache_excluded_params = ('accesskey',)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, super().retrieve, *args, **kwargs)
+
+    def get_response_cache_digest(self, request):
+        params = sorted(
+            (key, value)
+            for key, values in request.query_params.lists()
+            if key not in self.cache_excluded_params
+            for value in values)
+        # pagination links are absolute, so the host is part of the key too
+        raw_key = '{}?{}|staff={}'.format(
+            request.build_absolute_uri(request.path), urlencode(params),
+            bool(request.user.is_staff))
+        return hashlib.md5(raw_key.encode('utf-8')).hexdigest()
+
+    def cached_response(self, request, handler, *args, **kwargs):
+        cache = get_response_cache()
+        if cache is None:
+            return handler(request, *args, **kwargs)
+        version, modified = get_catalog_state()
+        digest = self.get_response_cache_digest(request)
+        key = 'response:{}:{}'.format(version, digest)
+        # the cached data is rendered per request, but each representation
+        # of it needs an entity tag of its own
+        etag = '"{}-{}-{}"'.format(digest, version, request.accepted_renderer.format)
+
+        data = cache.get(key)
+        if data is not None:
+            response = get_conditional_response(
+                request, etag=etag, last_modified=int(modified))
+            if response is None:
+                response = Response(data)
+        else:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            config = getattr(settings, 'API_RESPONSE_CACHE', {})
+            # with a read replica, data read right after a write may be stale
+            if time.time() - modified >= config.get('SETTLE_TIME', 0):
+                cache.set(key, response.data, config.get('TIMEOUT', 300))
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(modified)
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+class QuerysetPermissionMixin(object):
+    """
+    Decides QuerysetPermissions in the database.
+
+    List views are filtered by the permissions that set `filter_lists`.
+    `get_object` first runs a single indexed query telling whether the
+    object exists and which permissions allow it, and only fetches the row
+    once they all do, so a denied object is never loaded.
+    """
+
+    def get_queryset_permissions(self):
+        return [permission for permission in self.get_permissions()
+                if isinstance(permission, QuerysetPermission)]
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if not getattr(self, 'detail', False):
+            for permission in self.get_queryset_permissions():
+                if permission.filter_lists:
+                    queryset = permission.filter_queryset(self.request, queryset, self)
+        return queryset
+
+    def get_object(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        filter_kwargs = {self.lookup_field: self.kwargs[lookup_url_kwarg]}
+
+        permissions = self.get_queryset_permissions()
+        if permissions:
+            decisions = {
+                'permission_{}'.format(index): Exists(permission.filter_queryset(
+                    self.request, queryset, self).filter(pk=OuterRef('pk')))
+                for index, permission in enumerate(permissions)
+            }
+            try:
+                row = queryset.filter(**filter_kwargs).annotate(
+                    **decisions).values(*decisions).first()
+            except (TypeError, ValueError, ValidationError):
+                # lookups of the wrong type, such as /products/abc/
+                raise Http404
+            if row is None:
+                raise Http404
+            for index, permission in enumerate(permissions):
+                if not row['permission_{}'.format(index)]:
+                    self.permission_denied(
+                        self.request, message=getattr(permission, 'message', None))
+
+        obj = get_object_or_404(queryset, **filter_kwargs)
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    def check_object_permissions(self, request, obj):
+        # QuerysetPermissions were already applied by get_object
+        for permission in self.get_permissions():
+            if isinstance(permission, QuerysetPermission):
+                continue
+            if not permission.has_object_permission(request, self, obj):
+                self.permission_denied(request, message=getattr(permission, 'message', None))
+
+
+class RequestProfileMixin(object):
+    """
+    Runs the view under cProfile when an admin asks for it with `?profile`,
+    see InstrumentationMiddleware. The user is only known once the view
+    authenticated the request, so nobody else can make the server pay for
+    profiling their requests.
+    """
+    profile_param = 'profile'
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        request_metrics = getattr(request, 'api_metrics', None)
+        if (request_metrics is not None and request_metrics.profiler is None and
+                self.profile_param in request.query_params and request.user.is_staff):
+            request_metrics.start_profile(requested=True)
@@ -7,6 +7,9 @@ class APIClient(models.Model):
     secretkey = models.CharField(max_length=32)
     is_active = models.BooleanField(default=True)
 
+    class Meta:
+        unique_together = (('accesskey', 'secretkey'),)
+
     def __str__(self):
         return self.name
 
@@ -20,3 +23,14 @@ class APIClient(models.Model):
     def save(self, *args, **kwargs):
         self.full_clean()
         super(APIClient, self).save(*args, **kwargs)
+
+
+class TokenUsage(models.Model):
+    """When each auth token was last used, written in batches"""
+    token = models.OneToOneField(
+        'authtoken.Token', primary_key=True, on_delete=models.CASCADE,
+        related_name='usage')
+    last_used = models.DateTimeField()
+
+    def __str__(self):
+        return '{} used at {}'.format(self.token_id, self.last_used)
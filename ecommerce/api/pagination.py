@@ -0,0 +1,51 @@
+from rest_framework import pagination
+
+
+class ProductPageNumberPagination(pagination.PageNumberPagination):
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class ProductCursorPagination(pagination.CursorPagination):
+    # backed by the (created, id) index on products_product
+    ordering = ('created', 'id')
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class ProductPagination(pagination.BasePagination):
+    """
+    Page number pagination by default. Clients opt in to keyset pagination,
+    which needs neither COUNT(*) nor OFFSET, with `?pagination=cursor`.
+    """
+    mode_query_param = 'pagination'
+
+    def __init__(self):
+        self.page_number = ProductPageNumberPagination()
+        self.cursor = ProductCursorPagination()
+        self.paginator = self.page_number
+
+    @property
+    def display_page_controls(self):
+        return self.paginator.display_page_controls
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if request.query_params.get(self.mode_query_param) == 'cursor':
+            self.paginator = self.cursor
+        else:
+            self.paginator = self.page_number
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def to_html(self):
+        return self.paginator.to_html()
+
+    def get_results(self, data):
+        return self.paginator.get_results(data)
+
+    def get_schema_fields(self, view):
+        return (self.page_number.get_schema_fields(view) +
+                [field for field in self.cursor.get_schema_fields(view)
+                 if field.name != self.page_number.page_size_query_param])
@@ -1,7 +1,22 @@
+from django.db.models import F
 from rest_framework import permissions
 from api.models import APIClient
 
 
+class QuerysetPermission(permissions.BasePermission):
+    """
+    Object level permission that can also be expressed as a queryset
+    filter. `filter_queryset` must keep exactly the objects
+    `has_object_permission` allows. QuerysetPermissionMixin decides
+    retrieves with it before fetching the object and, with `filter_lists`,
+    only shows allowed objects in list views.
+    """
+    filter_lists = False
+
+    def filter_queryset(self, request, queryset, view):
+        return queryset
+
+
 class IsNotHacker(permissions.BasePermission):
 
     # view level permission
@@ -16,7 +31,11 @@ class IsNotHacker(permissions.BasePermission):
         return True
 
 
-class IsOddProductID(permissions.BasePermission):
+class IsOddProductID(QuerysetPermission):
+
+    def filter_queryset(self, request, queryset, view):
+        # Django 2.1 has no Mod function, the % operator of F does the same
+        return queryset.annotate(id_parity=F('id') % 2).filter(id_parity=1)
 
     # object level permission
     def has_object_permission(self, request, view, obj):
@@ -0,0 +1,94 @@
+import re
+
+from rest_framework import renderers
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# values the fast encoders can't handle natively are converted like
+# rest_framework's JSONRenderer converts them: datetimes to ISO 8601 strings,
+# decimals to floats, querysets and generators to lists...
+encoder = JSONEncoder()
+
+# starts with the literal `e`, a leading character class searches several times slower
+EXPONENT_RE = re.compile(rb'e-?[0-9]')
+
+
+def has_float_exponent(content):
+    """Whether orjson wrote a float as 1e16 or 1e-7, where json writes 1e+16 or 1e-07"""
+    for match in EXPONENT_RE.finditer(content):
+        if content[match.start() - 1:match.start()].isdigit():
+            return True
+    return False
+
+
+class PlainTextRenderer(BaseRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, str):
+            return data.encode(self.charset)
+        # error responses, e.g. {'detail': ...}
+        return '\n'.join('{}: {}'.format(key, value) for key, value in data.items()).encode(
+            self.charset)
+
+
+class FastJSONRenderer(renderers.JSONRenderer):
+    """
+    JSONRenderer encoding with orjson, when installed, to the very same bytes.
+
+    Indented output, as asked for by the browsable API, and the rare
+    payloads orjson would spell differently, such as floats in exponent
+    notation or integers over 64 bits, go through the stdlib encoder.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or not self.compact or self.ensure_ascii or
+                self.get_indent(accepted_media_type, renderer_context or {})):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=encoder.default,
+                               option=orjson.OPT_PASSTHROUGH_DATETIME)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        if has_float_exponent(ret):
+            return super().render(data, accepted_media_type, renderer_context)
+        # same escaping of line separators as JSONRenderer, for JSONP
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class MessagePackRenderer(BaseRenderer):
+    """Renders data as MessagePack, converting values as JSONRenderer would"""
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=encoder.default, use_bin_type=True)
+
+
+class MessagePackParser(BaseParser):
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except (ValueError, TypeError, msgpack.UnpackException) as exc:
+            raise ParseError('MessagePack parse error - {}'.format(exc))
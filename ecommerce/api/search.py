@@ -0,0 +1,154 @@
+import re
+import threading
+from collections import defaultdict
+
+from django.db import connection
+from django.db.models import Max
+
+from products.changes import get_compaction_horizon
+from products.models import Change, Product
+from products.search import uses_search_vector
+
+
+TOKEN_RE = re.compile(r'\w+')
+
+# weight of a token match on each indexed column, mirrors the A/B/C weights
+# given to the tsvector on Postgres
+FIELD_WEIGHTS = (
+    ('name', 1.0),
+    ('sku', 1.0),
+    ('category__name', 0.4),
+    ('description', 0.2),
+)
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower()) if text else []
+
+
+class TokenIndex(object):
+    """
+    In-process inverted index over the product search fields, used on
+    databases without full text search.
+
+    The index remembers the seq of the last change log entry it reflects,
+    see products.changes, so writes made by any process are caught up
+    with incrementally on the next search. It is only built from scratch
+    the first time, once the entries it needs were compacted away, or when
+    it was built inside a transaction that may have rolled back since.
+    """
+
+    def __init__(self):
+        self.postings = defaultdict(dict)
+        self.documents = {}
+        self.built = False
+        self.seq = 0
+        # built or updated from rows a transaction might still roll back
+        self.provisional = False
+        self.unconfirmed = set()
+        self.lock = threading.RLock()
+
+    def rebuild(self):
+        with self.lock:
+            seq = Change.objects.aggregate(seq=Max('seq'))['seq'] or 0
+            self.postings.clear()
+            self.documents.clear()
+            columns = [column for column, _ in FIELD_WEIGHTS]
+            for row in Product.objects.values_list('id', *columns).iterator():
+                self._add(row[0], row[1:])
+            self.built = True
+            self.seq = seq
+            self.provisional = connection.in_atomic_block
+            self.unconfirmed.clear()
+
+    def sync(self):
+        """Applies the changes logged since the index was last synced"""
+        with self.lock:
+            in_transaction = connection.in_atomic_block
+            if (not self.built or (self.provisional and not in_transaction) or
+                    self.seq < get_compaction_horizon()):
+                self.rebuild()
+                return
+            changes = list(Change.objects.filter(
+                seq__gt=self.seq, model__in=['product', 'category'],
+            ).values_list('seq', 'model', 'object_id'))
+            product_ids = set()
+            category_ids = set()
+            for _, model, object_id in changes:
+                (product_ids if model == 'product' else category_ids).add(object_id)
+            if category_ids:
+                product_ids.update(Product.objects.filter(
+                    category_id__in=category_ids).values_list('id', flat=True))
+            self.update(product_ids | self.unconfirmed)
+            if in_transaction:
+                # changes of this transaction are read again on later syncs,
+                # which undoes them if it rolls back
+                self.unconfirmed.update(product_ids)
+            else:
+                self.unconfirmed.clear()
+                if changes:
+                    self.seq = max(seq for seq, _, _ in changes)
+
+    def update(self, product_ids):
+        with self.lock:
+            if not self.built or not product_ids:
+                return
+            for product_id in product_ids:
+                self._remove(product_id)
+            columns = [column for column, _ in FIELD_WEIGHTS]
+            rows = Product.objects.filter(id__in=product_ids).values_list('id', *columns)
+            for row in rows:
+                self._add(row[0], row[1:])
+
+    def search(self, query):
+        """Returns ids of products matching every token of query, best first"""
+        tokens = set(tokenize(query))
+        if not tokens:
+            return []
+        with self.lock:
+            self.sync()
+            postings = sorted((self.postings.get(token, {}) for token in tokens), key=len)
+            scores = dict(postings[0])
+            for posting in postings[1:]:
+                scores = {product_id: score + posting[product_id]
+                          for product_id, score in scores.items()
+                          if product_id in posting}
+        return sorted(scores, key=lambda product_id: (-scores[product_id], product_id))
+
+    def _add(self, product_id, values):
+        weights = defaultdict(float)
+        for (_, weight), value in zip(FIELD_WEIGHTS, values):
+            for token in tokenize(value):
+                weights[token] += weight
+        for token, weight in weights.items():
+            self.postings[token][product_id] = weight
+        self.documents[product_id] = list(weights)
+
+    def _remove(self, product_id):
+        for token in self.documents.pop(product_id, []):
+            posting = self.postings.get(token)
+            if posting is not None:
+                posting.pop(product_id, None)
+                if not posting:
+                    del self.postings[token]
+
+
+token_index = TokenIndex()
+
+
+def search_products(queryset, query):
+    """
+    Returns the products of queryset matching query, ranked by relevance.
+
+    On Postgres this is a queryset filtered through the GIN indexed
+    `search_vector` column, elsewhere a list of ids from the token index.
+    """
+    if uses_search_vector():
+        return queryset.extra(
+            select={'rank': "ts_rank(search_vector, plainto_tsquery('simple', %s))"},
+            select_params=[query],
+            where=["search_vector @@ plainto_tsquery('simple', %s)"],
+            params=[query],
+        ).order_by('-rank', 'id')
+    return token_index.search(query)
+
@@ -1,11 +1,231 @@
-from rest_framework import serializers
+import decimal
 
-from products.models import Product, Category
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.utils import timezone
+from rest_framework import fields, relations, serializers
+from rest_framework.settings import api_settings
 
+from api.metrics import timed_serialization
+from products.models import Category, Change, Product, ProductImage
 
-class ProductSerializer(serializers.ModelSerializer):
+
+CENTS = decimal.Decimal('0.01')
+
+class TimedListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        with timed_serialization(self.context.get('request')):
+            return super().to_representation(data)
+
+
+class TimedSerializerMixin(object):
+    """Adds the time spent serializing to the request metrics, see api.metrics"""
+
+    def to_representation(self, instance):
+        # nested and list items are covered by the outermost serializer
+        if self.parent is not None:
+            return super().to_representation(instance)
+        with timed_serialization(self.context.get('request')):
+            return super().to_representation(instance)
+
+
+class ProductSerializer(TimedSerializerMixin, serializers.ModelSerializer):
 
     class Meta:
         model = Product
         fields = ('id', 'name', 'sku', 'category', 'description', 'price',
                   'created', 'featured',)
+        list_serializer_class = TimedListSerializer
+
+
+class CategorySerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = Category
+        fields = ('id', 'name',)
+
+
+class CategoryStatsSerializer(CategorySerializer):
+    """
+    Category with the aggregates of its products, read from the
+    `stats` relation the view has to select_related.
+    """
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # categories created since the last recompute have no stats row yet
+        stats = getattr(instance, 'stats', None)
+        count = stats.product_count if stats is not None else 0
+        data['product_count'] = count
+        data['featured_count'] = stats.featured_count if stats is not None else 0
+        for name, value in [
+            ('price_min', stats.price_min if count else None),
+            ('price_max', stats.price_max if count else None),
+            ('price_avg', stats.price_sum / count if count else None),
+        ]:
+            data[name] = None if value is None else '{0:f}'.format(value.quantize(CENTS))
+        return data
+
+
+class ProductImageSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = ProductImage
+        fields = ('id', 'product', 'url',)
+
+
+class ProductChangeSerializer(ProductSerializer):
+
+    class Meta(ProductSerializer.Meta):
+        fields = ProductSerializer.Meta.fields + ('updated',)
+
+
+class ChangeSerializer(serializers.ModelSerializer):
+    """
+    Change with the current state of its object in `data`, null once the
+    object is deleted. The objects of every change serialized at once have
+    to be given by model name and primary key in `context['objects']`.
+    """
+    id = serializers.IntegerField(source='object_id')
+    data = serializers.SerializerMethodField()
+
+    object_serializers = {
+        'category': CategorySerializer,
+        'product': ProductChangeSerializer,
+        'productimage': ProductImageSerializer,
+    }
+
+    class Meta:
+        model = Change
+        fields = ('seq', 'model', 'id', 'action', 'timestamp', 'data',)
+
+    def get_data(self, change):
+        obj = self.context['objects'].get(change.model, {}).get(change.object_id)
+        if obj is None:
+            return None
+        return self.object_serializers[change.model](obj, context=self.context).data
+
+
+class ProductExpandSerializer(ProductSerializer):
+    """
+    Read-only ProductSerializer embedding the relations named in
+    `context['expand']`, which the view has to select_related/prefetch.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        expand = self.context.get('expand', ())
+        if 'category' in expand:
+            fields['category'] = CategorySerializer(read_only=True)
+        if 'images' in expand:
+            fields['images'] = serializers.SlugRelatedField(
+                source='productimage_set', slug_field='url', many=True,
+                read_only=True)
+        return fields
+
+
+class PrefetchedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    PrimaryKeyRelatedField resolving every key against one `in_bulk` of its
+    queryset, loaded the first time the field is used. Meant for small
+    related tables, such as categories, when validating many items at once.
+    """
+
+    def to_internal_value(self, data):
+        if self.pk_field is not None:
+            data = self.pk_field.to_internal_value(data)
+        if not hasattr(self, '_objects'):
+            self._objects = self.get_queryset().in_bulk()
+        try:
+            pk = self.get_queryset().model._meta.pk.to_python(data)
+            return self._objects[pk]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError, DjangoValidationError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
+class ProductBulkSerializer(ProductSerializer):
+    category = PrefetchedPrimaryKeyRelatedField(queryset=Category.objects.all())
+
+
+def get_fast_converter(field):
+    """
+    Returns a callable that gives the same representation as
+    `field.to_representation` for the raw column value of `field`.
+    """
+    field_class = type(field)
+    if field_class is fields.IntegerField:
+        return int
+    if field_class is fields.CharField:
+        return str
+    if field_class is fields.BooleanField:
+        return bool
+    if field_class is relations.PrimaryKeyRelatedField and field.pk_field is None:
+        # the column already holds the primary key of the related object
+        return lambda value: value
+
+    coerce_to_string = getattr(
+        field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+    if field_class is fields.DecimalField and coerce_to_string and not field.localize:
+        exponent = -field.decimal_places
+
+        def convert_decimal(value):
+            if isinstance(value, decimal.Decimal) and value.as_tuple().exponent == exponent:
+                return '{0:f}'.format(value)
+            return field.to_representation(value)
+        return convert_decimal
+
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    if field_class is fields.DateTimeField and output_format == fields.ISO_8601:
+        field_timezone = getattr(field, 'timezone', field.default_timezone())
+
+        def convert_datetime(value):
+            if field_timezone is None or not timezone.is_aware(value):
+                return field.to_representation(value)
+            value = value.astimezone(field_timezone).isoformat()
+            if value.endswith('+00:00'):
+                value = value[:-6] + 'Z'
+            return value
+        return convert_datetime
+
+    return field.to_representation
+
+
+class ProductReadSerializer(TimedSerializerMixin, serializers.BaseSerializer):
+    """
+    Read-only counterpart of ProductSerializer for list and retrieve.
+
+    Serializes rows from `values_list(*get_columns(), named=True)` through
+    one converter per field, built from ProductSerializer's own fields, so
+    the output is the same without creating model instances or running
+    the generic field machinery per row.
+    """
+    model_serializer_class = ProductSerializer
+
+    class Meta:
+        list_serializer_class = TimedListSerializer
+
+    @classmethod
+    def get_model_fields(cls):
+        if '_model_fields' not in cls.__dict__:
+            cls._model_fields = list(cls.model_serializer_class().fields.values())
+        return cls._model_fields
+
+    @classmethod
+    def get_columns(cls):
+        return [field.source for field in cls.get_model_fields()]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # converters are built per serializer, not per row, since datetime
+        # ones depend on the timezone active for the current request
+        self.converters = [
+            (field.field_name, get_fast_converter(field))
+            for field in self.get_model_fields()
+        ]
+
+    def to_representation(self, row):
+        return {
+            name: None if value is None else convert(value)
+            for (name, convert), value in zip(self.converters, row)
+        }
@@ -0,0 +1,97 @@
+from django.contrib.auth.models import User
+from django.core.signals import request_finished
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from api.authentication import (
+    api_client_cache, bump_basic_auth_version, token_cache, token_usage)
+from api.cache import bump_catalog_version
+from api.models import APIClient
+from products.models import Category, Product, ProductImage
+from products.signals import bulk_deleted, bulk_saved, per_object
+
+
+def invalidate(func, *args):
+    # once more on commit, or a request reading the old rows meanwhile
+    # would cache them again
+    func(*args)
+    if connection.in_atomic_block:
+        transaction.on_commit(lambda: func(*args))
+
+
+@receiver(pre_save, sender=APIClient)
+def remember_api_client_credentials(sender, instance, **kwargs):
+    # credentials may change on save, so the entry cached under the old
+    # ones has to be dropped as well
+    if instance.pk is None:
+        return
+    previous = sender.objects.filter(pk=instance.pk).values_list(
+        'accesskey', 'secretkey').first()
+    if previous is not None:
+        invalidate(api_client_cache.delete, api_client_cache.make_key(*previous))
+
+
+@receiver(post_save, sender=APIClient)
+@receiver(post_delete, sender=APIClient)
+def invalidate_api_client_cache(sender, instance, **kwargs):
+    invalidate(api_client_cache.delete,
+               api_client_cache.make_key(instance.accesskey, instance.secretkey))
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_token_cache(sender, instance, **kwargs):
+    invalidate(token_cache.delete, token_cache.make_key(instance.key))
+
+
+@receiver(pre_save, sender=User)
+def remember_username(sender, instance, **kwargs):
+    # entries cached under a previous username must not outlive a rename
+    if instance.pk is None:
+        return
+    previous = sender.objects.filter(pk=instance.pk).values_list('username', flat=True).first()
+    if previous is not None and previous != instance.username:
+        bump_basic_auth_version(previous)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_basic_auth_cache(sender, instance, **kwargs):
+    bump_basic_auth_version(instance.get_username())
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(sender, instance, created, **kwargs):
+    # cached tokens carry a copy of their user, flags included
+    if not created:
+        for key in Token.objects.filter(user=instance).values_list('key', flat=True):
+            invalidate(token_cache.delete, token_cache.make_key(key))
+
+
+@receiver(request_finished)
+def flush_token_usage(sender, **kwargs):
+    token_usage.flush_if_due()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@per_object
+def invalidate_cached_responses(sender, **kwargs):
+    # bumping only once the transaction commits keeps readers from caching
+    # the old rows under the new version; the immediate bump covers readers
+    # inside this same transaction
+    bump_catalog_version()
+    if connection.in_atomic_block:
+        transaction.on_commit(bump_catalog_version)
+
+
+@receiver(bulk_saved)
+@receiver(bulk_deleted)
+def invalidate_cached_responses_in_bulk(sender, **kwargs):
+    invalidate_cached_responses(sender)
@@ -1,18 +1,59 @@
+import asyncio
 import base64
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import threading
+import zlib
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import mock, skipIf
 from freezegun import freeze_time
+import psycopg2
 
-from django.test import TestCase
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import cache
+from django.core.signals import request_finished
+from django.core.management import call_command
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from django.contrib.auth.models import User
 from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
 
-from api.models import APIClient
-from products.models import Product, Category
+from ecommerce.db.backends.postgresql.base import BlockingConnectionPool
+from ecommerce.db.routers import ReplicaRouter, use_replica
+from ecommerce.handlers import ASGIHandler
+from api.cache import CATALOG_VERSION_KEY, TieredCache, bump_catalog_version, get_catalog_state
+from api.authentication import (
+    CachedBasicAuthentication, api_client_cache, basic_auth_cache, token_cache, token_usage)
+from api.filters import ProductFilterBackend
+from api import metrics
+from api.middleware import CompressionMiddleware, brotli
+from api.metrics import authentication_seconds
+from api.models import APIClient, TokenUsage
+from api.permissions import IsOddProductID
+from api.search import TokenIndex
+from api.renderers import FastJSONRenderer, msgpack
+from api.serializers import ProductSerializer, ProductReadSerializer
+from products.bulk import bulk_update
+from products.changes import compact_changes, get_last_pk
+from products.models import Product, Category, Change, ProductImage
+from products.signals import bulk_saved
+from products.stats import update_category_stats, update_dirty_category_stats
 
 
 class ProductTestCase(TestCase):
 
     @freeze_time('2018-12-20T10:15:30+00:00')
     def setUp(self):
+        cache.clear()
         self.user_1 = User.objects.create(username='test')
         self.user_1.set_password('test')
         self.user_1.save()
@@ -414,3 +455,1799 @@ class ProductTestCase(TestCase):
             '/api/products/{}/'.format(self.product_1.id), **headers)
         self.assertEqual(response.status_code, 204)
         self.assertEqual(Product.objects.count(), 1)
+
+
+class APIClientAuthenticationCacheTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        api_client_cache.clear()
+        self.api_client = APIClient.objects.create(
+            name='test', accesskey='a' * 32, secretkey='s' * 32)
+        self.url = '/api/products/?accesskey={}'.format(self.api_client.accesskey)
+        self.headers = {'secretkey': self.api_client.secretkey}
+
+    def apiclient_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.url, **self.headers)
+        queries = [q['sql'] for q in context.captured_queries
+                   if 'api_apiclient' in q['sql']]
+        return response, queries
+
+    def test_credentials_are_cached(self):
+        """Should only hit the database for the first request of an APIClient"""
+        response, queries = self.apiclient_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 1)
+
+        response, queries = self.apiclient_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, [])
+
+    def test_deactivation_invalidates_cache(self):
+        """Should return 401 as soon as a cached APIClient is deactivated"""
+        self.apiclient_queries()
+        self.api_client.is_active = False
+        self.api_client.save()
+
+        response = self.client.get(self.url, **self.headers)
+        expected = {'detail': 'Invalid APIClient credentials'}
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json(), expected)
+
+    def test_credentials_change_invalidates_cache(self):
+        """Should stop accepting the old keys once an APIClient changes them"""
+        self.apiclient_queries()
+        self.api_client.secretkey = 'x' * 32
+        self.api_client.save()
+
+        response = self.client.get(self.url, **self.headers)
+        self.assertEqual(response.status_code, 401)
+
+    @override_settings(API_CLIENT_CACHE={'TTL': 60, 'BACKEND': 'default'})
+    def test_delete_reaches_other_processes(self):
+        """Should drop the local entries of every process sharing the backend on delete"""
+        worker_a = TieredCache('apiclient', 'API_CLIENT_CACHE')
+        worker_b = TieredCache('apiclient', 'API_CLIENT_CACHE')
+        key = worker_a.make_key(self.api_client.accesskey, self.api_client.secretkey)
+        worker_a.set(key, self.api_client)
+        self.assertEqual(worker_b.get(key), self.api_client)
+        # served from the local tier while the generation is unchanged
+        cache.delete(key)
+        self.assertEqual(worker_b.get(key), self.api_client)
+
+        worker_b.set(key, self.api_client)
+        worker_a.delete(key)
+        self.assertIsNone(worker_b.get(key))
+
+    def test_secretkey_http_header(self):
+        """Should accept the secretkey as sent by HTTP clients"""
+        response = self.client.get(self.url, HTTP_SECRETKEY=self.api_client.secretkey)
+        self.assertEqual(response.status_code, 200)
+
+    def test_unknown_credentials_are_cached(self):
+        """Should not hit the database again for recently rejected credentials"""
+        self.url = '/api/products/?accesskey={}'.format('b' * 32)
+        response, queries = self.apiclient_queries()
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(len(queries), 1)
+
+        response, queries = self.apiclient_queries()
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(queries, [])
+
+        APIClient.objects.create(name='new', accesskey='b' * 32, secretkey='s' * 32)
+        response, _ = self.apiclient_queries()
+        self.assertEqual(response.status_code, 200)
+
+    def test_credentials_are_unique(self):
+        """Should not allow two APIClients with the same accesskey and secretkey"""
+        with self.assertRaises(ValidationError):
+            APIClient.objects.create(
+                name='copy', accesskey='a' * 32, secretkey='s' * 32)
+
+
+class TokenAuthenticationCacheTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        token_usage.pending.clear()
+        self.user = User.objects.create(username='test')
+        self.token = Token.objects.create(user=self.user)
+        self.headers = {'HTTP_AUTHORIZATION': 'Token ' + str(self.token)}
+
+    def token_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/products/', **self.headers)
+        queries = [q['sql'] for q in context.captured_queries
+                   if 'authtoken_token' in q['sql'] or 'api_tokenusage' in q['sql']]
+        return response, queries
+
+    def test_tokens_are_cached(self):
+        """Should only hit the database for the first request of a token"""
+        response, queries = self.token_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 1)
+
+        response, queries = self.token_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, [])
+
+    def test_token_delete_invalidates_cache(self):
+        """Should return 401 as soon as a cached token is deleted"""
+        self.token_queries()
+        self.token.delete()
+
+        response, _ = self.token_queries()
+        self.assertEqual(response.status_code, 401)
+
+    def test_user_deactivation_invalidates_cache(self):
+        """Should return 401 as soon as the user of a cached token is deactivated"""
+        self.token_queries()
+        self.user.is_active = False
+        self.user.save()
+
+        response, _ = self.token_queries()
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json(), {'detail': 'User inactive or deleted.'})
+
+    @override_settings(API_TOKEN_CACHE={'TTL': 60, 'BACKEND': 'default'})
+    def test_deactivation_in_another_process(self):
+        """Should return 401 once the user is deactivated by another process"""
+        serving = TieredCache('token', 'API_TOKEN_CACHE')
+        writing = TieredCache('token', 'API_TOKEN_CACHE')
+        with mock.patch('api.authentication.token_cache', serving), \
+                mock.patch('api.signals.token_cache', writing):
+            self.assertEqual(self.token_queries()[0].status_code, 200)
+            self.user.is_active = False
+            self.user.save()
+            response, _ = self.token_queries()
+        self.assertEqual(response.status_code, 401)
+
+    def test_last_use_is_written_in_batches(self):
+        """Should record token uses in memory and write them on flush"""
+        with freeze_time('2018-12-20T10:15:30+00:00'):
+            self.token_queries()
+        with freeze_time('2018-12-20T10:16:30+00:00'):
+            self.token_queries()
+        self.assertFalse(TokenUsage.objects.exists())
+
+        token_usage.flush()
+        usage = TokenUsage.objects.get(token=self.token)
+        self.assertEqual(usage.last_used, datetime(2018, 12, 20, 10, 16, 30, tzinfo=timezone.utc))
+
+        with freeze_time('2018-12-20T10:17:30+00:00'):
+            self.token_queries()
+        with self.settings(TOKEN_USAGE_FLUSH_INTERVAL=0):
+            self.token_queries()
+        usage.refresh_from_db()
+        self.assertGreater(usage.last_used, datetime(2018, 12, 20, 10, 16, 30, tzinfo=timezone.utc))
+
+
+    def test_concurrent_flush(self):
+        """Should update the usage another process created while flushing"""
+        def racing_bulk_update(objs, fields):
+            # runs once the existing usages were read
+            TokenUsage.objects.create(token=self.token, last_used=timezone.now())
+            return bulk_update(objs, fields)
+
+        with freeze_time('2018-12-20T10:15:30+00:00'):
+            token_usage.touch(self.token.key)
+        with mock.patch('api.authentication.bulk_update', racing_bulk_update):
+            token_usage.flush()
+        usage = TokenUsage.objects.get(token=self.token)
+        self.assertEqual(usage.last_used, datetime(2018, 12, 20, 10, 15, 30, tzinfo=timezone.utc))
+
+
+class BasicAuthenticationCacheTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        basic_auth_cache.clear()
+        self.user = User.objects.create(username='test')
+        self.user.set_password('test')
+        self.user.save()
+
+    def user_queries(self, password='test'):
+        credentials = base64.b64encode('test:{}'.format(password).encode('ascii'))
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(
+                '/api/products/', HTTP_AUTHORIZATION='Basic ' + credentials.decode('ascii'))
+        queries = [q['sql'] for q in context.captured_queries if 'auth_user' in q['sql']]
+        return response, queries
+
+    def test_credentials_are_cached(self):
+        """Should only check the password on the first request"""
+        response, queries = self.user_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 1)
+
+        response, queries = self.user_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, [])
+
+    def test_failures_are_not_cached(self):
+        """Should check the password again on every failed attempt"""
+        for _ in range(2):
+            response, queries = self.user_queries(password='wrong')
+            self.assertEqual(response.status_code, 401)
+            self.assertEqual(len(queries), 1)
+
+    def test_password_change_invalidates_cache(self):
+        """Should stop accepting the old password as soon as it changes"""
+        self.user_queries()
+        self.user.set_password('changed')
+        self.user.save()
+
+        response, _ = self.user_queries()
+        self.assertEqual(response.status_code, 401)
+        response, _ = self.user_queries(password='changed')
+        self.assertEqual(response.status_code, 200)
+
+    def test_deactivation_invalidates_cache(self):
+        """Should return 401 as soon as a cached user is deactivated"""
+        self.user_queries()
+        self.user.is_active = False
+        self.user.save()
+
+        response, _ = self.user_queries()
+        self.assertEqual(response.status_code, 401)
+
+    def test_cached_inactive_user(self):
+        """Should return 401 for a cached user found inactive"""
+        self.user_queries()
+        cache_key = CachedBasicAuthentication().get_cache_key('test', 'test')
+        inactive = User.objects.get(pk=self.user.pk)
+        inactive.is_active = False
+        basic_auth_cache.set(cache_key, inactive)
+
+        response, _ = self.user_queries()
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json(), {'detail': 'User inactive or deleted.'})
+
+    @override_settings(API_BASIC_AUTH_CACHE={'TTL': 30, 'BACKEND': 'default'})
+    def test_password_change_in_another_process(self):
+        """Should stop accepting the old password once another process changes it"""
+        serving = TieredCache('basicauth', 'API_BASIC_AUTH_CACHE')
+        writing = TieredCache('basicauth', 'API_BASIC_AUTH_CACHE')
+        with mock.patch('api.authentication.basic_auth_cache', serving):
+            self.assertEqual(self.user_queries()[0].status_code, 200)
+            with mock.patch('api.authentication.basic_auth_cache', writing):
+                self.user.set_password('changed')
+                self.user.save()
+            response, _ = self.user_queries()
+        self.assertEqual(response.status_code, 401)
+
+
+class AuthenticationDispatchTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        api_client_cache.clear()
+        authentication_seconds.reset()
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        self.token = Token.objects.create(user=self.admin)
+        self.api_client = APIClient.objects.create(
+            name='test', accesskey='a' * 32, secretkey='s' * 32)
+
+    def test_dispatch_by_credentials(self):
+        """Should only run the authenticator matching the credentials sent"""
+        self.client.get('/api/products/', HTTP_AUTHORIZATION='Token ' + str(self.token))
+        self.client.get('/api/products/?accesskey={}'.format('a' * 32), secretkey='s' * 32)
+        self.client.get('/api/products/?accesskey={}'.format('a' * 32), secretkey='x' * 32)
+
+        self.assertEqual(sorted(authentication_seconds.series), [
+            ('apiclient', 'failure'), ('apiclient', 'success'), ('token', 'success')])
+
+    def test_anonymous_requests_get_basic_challenge(self):
+        """Should answer requests without credentials with 401 and a Basic challenge"""
+        response = self.client.get('/api/products/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Basic realm="api"')
+
+    def test_metrics_endpoint(self):
+        """Should expose authentication timings to admins in the Prometheus format"""
+        headers = {'HTTP_AUTHORIZATION': 'Token ' + str(self.token)}
+        self.client.get('/api/products/', **headers)
+        response = self.client.get('/api/metrics/', **headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        body = response.content.decode('utf-8')
+        self.assertIn('# TYPE api_authentication_seconds histogram', body)
+        # the metrics request itself was authenticated too
+        self.assertIn(
+            'api_authentication_seconds_count{authenticator="token",outcome="success"} 2', body)
+        self.assertIn(
+            'api_authentication_seconds_bucket{authenticator="token",outcome="success",le="+Inf"} 2',
+            body)
+
+    def test_metrics_require_admin(self):
+        """Should not expose metrics to APIClients or regular users"""
+        user = User.objects.create(username='test')
+        token = Token.objects.create(user=user)
+        response = self.client.get('/api/metrics/', HTTP_AUTHORIZATION='Token ' + str(token))
+        self.assertEqual(response.status_code, 403)
+
+
+class InstrumentationTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        metrics.profiles.clear()
+        for histogram in metrics.registry.values():
+            histogram.reset()
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        self.admin_headers = {'HTTP_AUTHORIZATION': 'Token ' + str(Token.objects.create(user=self.admin))}
+        self.user = User.objects.create(username='test')
+        self.headers = {'HTTP_AUTHORIZATION': 'Token ' + str(Token.objects.create(user=self.user))}
+        category = Category.objects.create(name='Sport')
+        Product.objects.create(
+            id=1, name='Nike Vapor', sku='44444444', category=category, price=129.99)
+
+    def test_server_timing(self):
+        """Should report app, database and serializer time of API requests"""
+        response = self.client.get('/api/products/', **self.headers)
+        self.assertRegex(
+            response['Server-Timing'],
+            r'^app;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries", serializer;dur=[\d.]+$')
+        self.assertNotIn('Server-Timing', self.client.get('/admin/login/'))
+
+    def test_metrics_per_action(self):
+        """Should aggregate request metrics per view and action"""
+        self.client.get('/api/products/', **self.headers)
+        self.client.get('/api/products/1/', **self.headers)
+
+        key = ('ProductViewSet', 'list')
+        self.assertGreater(metrics.request_db_queries.series[key][-1], 0)
+        self.assertGreater(metrics.request_serializer_seconds.series[key][-1], 0)
+        self.assertIn(('ProductViewSet', 'retrieve'), metrics.response_bytes.series)
+
+        body = self.client.get('/api/metrics/', **self.admin_headers).content.decode('utf-8')
+        self.assertIn('api_request_seconds_count{view="ProductViewSet",action="list"} 1', body)
+        self.assertIn('api_request_seconds_count{view="ProductViewSet",action="retrieve"} 1', body)
+
+    def test_requested_profile(self):
+        """Should profile requests of admins asking for it"""
+        response = self.client.get('/api/products/?profile=1', **self.admin_headers)
+        profile_id = response['X-Profile-Id']
+
+        listed = self.client.get('/api/metrics/profiles/', **self.admin_headers).json()
+        self.assertEqual([profile['id'] for profile in listed], [int(profile_id)])
+        self.assertEqual(listed[0]['action'], 'list')
+        stats = self.client.get(
+            '/api/metrics/profiles/{}/'.format(profile_id), **self.admin_headers)
+        self.assertEqual(stats.status_code, 200)
+        self.assertIn('function calls', stats.content.decode('utf-8'))
+
+    def test_profiles_are_admin_only(self):
+        """Should neither run, keep nor show profiles asked for by other users"""
+        with mock.patch('cProfile.Profile') as profile:
+            response = self.client.get('/api/products/?profile=1', **self.headers)
+            self.client.get('/api/products/?profile=1')
+        self.assertFalse(profile.called)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(metrics.profiles.list(), [])
+        response = self.client.get('/api/metrics/profiles/', **self.headers)
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(INSTRUMENTATION={'PROFILE_SAMPLE_RATE': 1.0, 'PROFILE_BUFFER_SIZE': 2})
+    def test_sampled_profiles(self):
+        """Should keep the last PROFILE_BUFFER_SIZE sampled profiles"""
+        for _ in range(3):
+            self.client.get('/api/products/', **self.headers)
+        listed = [profile['id'] for profile in metrics.profiles.list()]
+        self.assertEqual(len(listed), 2)
+        self.assertEqual(listed[0], listed[1] + 1)
+
+
+class QuerysetPermissionTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='test')
+        self.headers = {'HTTP_AUTHORIZATION': 'Token ' + str(Token.objects.create(user=self.user))}
+        category = Category.objects.create(name='Sport')
+        for product_id in [1, 2, 3]:
+            Product.objects.create(
+                id=product_id, name='Product {}'.format(product_id),
+                sku='0000000{}'.format(product_id), category=category, price=10)
+
+    def product_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, **self.headers)
+        queries = [q['sql'] for q in context.captured_queries
+                   if 'products_product' in q['sql']]
+        return response, queries
+
+    def test_allowed_retrieve(self):
+        """Should fetch an allowed product once its permission check passed"""
+        response, queries = self.product_queries('/api/products/1/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 2)
+
+    def test_denied_retrieve(self):
+        """Should deny a product with a single query that never loads its row"""
+        response, queries = self.product_queries('/api/products/2/')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('"products_product"."name"', queries[0])
+
+    def test_missing_retrieve(self):
+        """Should still tell missing products apart from denied ones"""
+        response, _ = self.product_queries('/api/products/5/')
+        self.assertEqual(response.status_code, 404)
+        response, _ = self.product_queries('/api/products/abc/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_filter_matches_object_permission(self):
+        """Should keep exactly the products has_object_permission allows"""
+        permission = IsOddProductID()
+        allowed = permission.filter_queryset(None, Product.objects.all(), None)
+        self.assertEqual(
+            sorted(product.id for product in allowed),
+            [product.id for product in Product.objects.order_by('id')
+             if permission.has_object_permission(None, None, product)])
+
+
+class ChangeFeedTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='test')
+        self.headers = {'HTTP_AUTHORIZATION': 'Token ' + str(Token.objects.create(user=self.user))}
+        self.start = Change.objects.order_by('seq').values_list('seq', flat=True).last() or 0
+        self.sport = Category.objects.create(name='Sport')
+        self.vapor = Product.objects.create(
+            name='Nike Vapor', sku='44444444', category=self.sport, price=Decimal('129.99'))
+
+    def get_changes(self, after=None, **params):
+        params['after'] = self.start if after is None else after
+        return self.client.get('/api/changes/', params, **self.headers)
+
+    def summarize(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [(change['model'], change['id'], change['action'])
+                for change in response.json()['results']]
+
+    def test_changes(self):
+        """Should list creates, updates and deletes in order, deletes as tombstones"""
+        image = ProductImage.objects.create(product=self.vapor, url='http://example.com/1.jpg')
+        self.vapor.name = 'Nike Vapor 2'
+        self.vapor.save()
+        image_id = image.id
+        image.delete()
+
+        response = self.get_changes()
+        self.assertEqual(self.summarize(response), [
+            ('category', self.sport.id, 'created'),
+            ('product', self.vapor.id, 'created'),
+            ('productimage', image_id, 'created'),
+            ('product', self.vapor.id, 'updated'),
+            ('productimage', image_id, 'deleted'),
+        ])
+        results = response.json()['results']
+        # every change carries the current state of its object
+        self.assertEqual(results[1]['data']['name'], 'Nike Vapor 2')
+        self.assertEqual(results[1]['data']['updated'], results[3]['data']['updated'])
+        self.assertIsNone(results[2]['data'])
+        self.assertIsNone(results[4]['data'])
+        self.assertEqual(response.json()['last_seq'], results[-1]['seq'])
+        self.assertFalse(response.json()['has_more'])
+
+    def test_batches(self):
+        """Should return up to `limit` changes after `after`"""
+        response = self.get_changes(limit=1)
+        self.assertEqual(self.summarize(response), [('category', self.sport.id, 'created')])
+        self.assertTrue(response.json()['has_more'])
+
+        response = self.get_changes(after=response.json()['last_seq'], limit=1)
+        self.assertEqual(self.summarize(response), [('product', self.vapor.id, 'created')])
+        self.assertFalse(response.json()['has_more'])
+
+        last_seq = response.json()['last_seq']
+        response = self.get_changes(after=last_seq)
+        self.assertEqual(self.summarize(response), [])
+        self.assertEqual(response.json()['last_seq'], last_seq)
+
+    def test_invalid_params(self):
+        """Should reject parameters that are not positive integers"""
+        self.assertEqual(self.get_changes(after='abc').status_code, 400)
+        self.assertEqual(self.get_changes(after=-1).status_code, 400)
+        self.assertEqual(self.get_changes(after=2 ** 63).status_code, 400)
+        self.assertEqual(self.get_changes(after='99999999999999999999').status_code, 400)
+        self.assertEqual(self.get_changes(limit=0).status_code, 400)
+        self.assertEqual(self.get_changes(after=2 ** 63 - 1).status_code, 200)
+
+    def test_cascade(self):
+        """Should leave a tombstone for the objects deleted in cascade"""
+        image = ProductImage.objects.create(product=self.vapor, url='http://example.com/1.jpg')
+        ids = (self.sport.id, self.vapor.id, image.id)
+        after = Change.objects.latest('seq').seq
+        self.sport.delete()
+        self.assertCountEqual(self.summarize(self.get_changes(after)), [
+            ('category', ids[0], 'deleted'),
+            ('product', ids[1], 'deleted'),
+            ('productimage', ids[2], 'deleted'),
+        ])
+
+    def test_bulk_saved(self):
+        """Should log objects created and updated in bulk"""
+        after = Change.objects.latest('seq').seq
+        products = [
+            Product(name='Leggings', sku='99999999', category=self.sport, price=Decimal('30')),
+            Product(name='Sweater', sku='88888888', category=self.sport, price=Decimal('60')),
+        ]
+        Product.objects.bulk_create(products)
+        bulk_saved.send(sender=Product, objs=products, created=True)
+        self.vapor.price = Decimal('99.99')
+        bulk_update([self.vapor], ['price'])
+        bulk_saved.send(sender=Product, objs=[self.vapor], created=False)
+
+        ids = dict(Product.objects.values_list('sku', 'id'))
+        self.assertCountEqual(self.summarize(self.get_changes(after)), [
+            ('product', ids['99999999'], 'created'),
+            ('product', ids['88888888'], 'created'),
+            ('product', self.vapor.id, 'updated'),
+        ])
+
+    def test_bulk_created_with_existing_sku(self):
+        """Should not log existing products sharing a sku with bulk created ones"""
+        after = Change.objects.latest('seq').seq
+        created = Product(name='Nike Vapor 2', sku='44444444', category=self.sport,
+                          price=Decimal('139.99'))
+        created_after = get_last_pk(Product)
+        Product.objects.bulk_create([created])
+        bulk_saved.send(sender=Product, objs=[created], created=True,
+                        created_after=created_after)
+        created = Product.objects.get(name='Nike Vapor 2')
+        self.assertEqual(self.summarize(self.get_changes(after)), [
+            ('product', created.id, 'created'),
+        ])
+
+    def test_rollback(self):
+        """Should not log changes rolled back"""
+        after = Change.objects.latest('seq').seq
+        with self.assertRaises(ValidationError):
+            with transaction.atomic():
+                Category.objects.create(name='Clothes')
+                self.vapor.delete()
+                raise ValidationError('rollback')
+        self.assertEqual(self.summarize(self.get_changes(after)), [])
+
+    def test_compaction(self):
+        """Should keep the latest change of each object and purge old tombstones"""
+        for price in ('99.99', '89.99'):
+            self.vapor.price = Decimal(price)
+            self.vapor.save()
+        with freeze_time(timezone.now() - timedelta(days=60)):
+            old = Category.objects.create(name='Old')
+            stale = Change.objects.latest('seq').seq
+            old.delete()
+        recent = Category.objects.create(name='Recent')
+        recent_id = recent.id
+        recent.delete()
+
+        compaction = compact_changes(timedelta(days=30))
+        self.assertEqual(compaction.deleted, 5)
+        self.assertGreater(compaction.purged_seq, stale)
+        self.assertEqual(self.summarize(self.get_changes()), [
+            ('category', self.sport.id, 'created'),
+            ('product', self.vapor.id, 'updated'),
+            ('category', recent_id, 'deleted'),
+        ])
+
+        # clients that synced before the purged tombstone have to start over
+        self.assertEqual(self.get_changes(stale).status_code, 410)
+        self.assertEqual(self.get_changes(0).status_code, 200)
+
+
+class CategoryStatsTestCase(TransactionTestCase):
+    # stats are written on commit, which TestCase never does
+
+    def setUp(self):
+        cache.clear()
+        # categories left dirty by transactions earlier tests never committed
+        update_dirty_category_stats()
+        self.user = User.objects.create(username='test')
+        self.headers = {'HTTP_AUTHORIZATION': 'Token ' + str(Token.objects.create(user=self.user))}
+        self.sport = Category.objects.create(name='Sport')
+        self.clothes = Category.objects.create(name='Clothes')
+        self.empty = Category.objects.create(name='Empty')
+        self.vapor = Product.objects.create(
+            name='Nike Vapor', sku='44444444', category=self.sport,
+            price=Decimal('129.99'), featured=True)
+        Product.objects.create(
+            name='Leggings', sku='99999999', category=self.sport, price=Decimal('30.00'))
+        Product.objects.create(
+            name='Sweater', sku='88888888', category=self.clothes, price=Decimal('59.99'))
+
+    def get_stats(self):
+        response = self.client.get('/api/categories/stats/', **self.headers)
+        self.assertEqual(response.status_code, 200)
+        return {category['name']: category for category in response.json()}
+
+    def test_stats(self):
+        """Should return the aggregates of every category"""
+        stats = self.get_stats()
+        self.assertEqual(stats['Sport'], {
+            'id': self.sport.id, 'name': 'Sport', 'product_count': 2,
+            'featured_count': 1, 'price_min': '30.00', 'price_max': '129.99',
+            'price_avg': '80.00'})
+        self.assertEqual(stats['Empty'], {
+            'id': self.empty.id, 'name': 'Empty', 'product_count': 0,
+            'featured_count': 0, 'price_min': None, 'price_max': None,
+            'price_avg': None})
+
+    def test_stats_do_not_read_products(self):
+        """Should answer without querying the products table"""
+        with CaptureQueriesContext(connection) as context:
+            self.get_stats()
+        self.assertFalse(any('products_product' in query['sql']
+                             for query in context.captured_queries))
+
+    def test_moved_product(self):
+        """Should update both categories when a product changes category"""
+        self.vapor.category = self.clothes
+        self.vapor.save()
+        stats = self.get_stats()
+        self.assertEqual(stats['Sport']['product_count'], 1)
+        self.assertEqual(stats['Sport']['featured_count'], 0)
+        self.assertEqual(stats['Clothes']['product_count'], 2)
+        self.assertEqual(stats['Clothes']['price_max'], '129.99')
+
+    def test_deleted_products(self):
+        """Should update the stats once products are deleted"""
+        Product.objects.filter(category=self.sport).delete()
+        self.assertEqual(self.get_stats()['Sport']['product_count'], 0)
+
+    def test_bulk_writes(self):
+        """Should update the stats on bulk_saved"""
+        with transaction.atomic():
+            products = [Product(name='Socks', sku='11111111', category=self.empty,
+                                price=Decimal('8.99'))]
+            Product.objects.bulk_create(products)
+            bulk_saved.send(sender=Product, objs=products, created=True)
+        self.assertEqual(self.get_stats()['Empty']['price_min'], '8.99')
+
+        self.vapor.price = Decimal('10.00')
+        with transaction.atomic():
+            bulk_update([self.vapor], ['price'])
+            bulk_saved.send(sender=Product, objs=[self.vapor], created=False)
+        self.assertEqual(self.get_stats()['Sport']['price_min'], '10.00')
+
+    def test_bulk_update_recomputes_touched_categories(self):
+        """Should only recompute the categories products updated in bulk left or joined"""
+        vapor = Product.objects.get(id=self.vapor.id)
+        vapor.category = self.clothes
+        with CaptureQueriesContext(connection) as context:
+            with transaction.atomic():
+                bulk_update([vapor], ['category_id'])
+                bulk_saved.send(sender=Product, objs=[vapor], created=False)
+        recomputes = [query['sql'] for query in context.captured_queries
+                      if 'MIN(' in query['sql']]
+        self.assertEqual(len(recomputes), 1)
+        self.assertIn('"category_id" IN (', recomputes[0])
+
+        stats = self.get_stats()
+        self.assertEqual(stats['Sport']['product_count'], 1)
+        self.assertEqual(stats['Clothes']['product_count'], 2)
+
+    def test_rollback(self):
+        """Should leave the stats alone when the transaction rolls back"""
+        try:
+            with transaction.atomic():
+                self.vapor.delete()
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(self.get_stats()['Sport']['product_count'], 2)
+
+    def test_single_writes_apply_deltas(self):
+        """Should update the stats of single writes without aggregating the category"""
+        with CaptureQueriesContext(connection) as context:
+            with transaction.atomic():
+                for i in range(5):
+                    Product.objects.create(name='Product {}'.format(i), sku=str(i),
+                                           category=self.clothes, price=i + 1)
+            self.vapor.featured = False
+            self.vapor.price = Decimal('139.99')
+            self.vapor.save()
+            Product.objects.get(sku='2').delete()
+        self.assertFalse(any('MIN(' in query['sql'] for query in context.captured_queries))
+
+        stats = self.get_stats()
+        self.assertEqual(stats['Clothes']['product_count'], 5)
+        self.assertEqual(stats['Clothes']['price_min'], '1.00')
+        self.assertEqual(stats['Sport']['featured_count'], 0)
+        self.assertEqual(stats['Sport']['price_max'], '139.99')
+        self.assertEqual(stats['Sport']['price_avg'], '85.00')
+
+    def test_removed_bound_recomputes(self):
+        """Should recompute a category whose lowest or highest price was removed"""
+        with CaptureQueriesContext(connection) as context:
+            self.vapor.delete()
+        recomputes = [query for query in context.captured_queries
+                      if 'MIN(' in query['sql']]
+        self.assertEqual(len(recomputes), 1)
+        stats = self.get_stats()
+        self.assertEqual(stats['Sport']['product_count'], 1)
+        self.assertEqual(stats['Sport']['price_max'], '30.00')
+
+    def test_writes_are_folded(self):
+        """Should recompute the stats once per transaction"""
+        with CaptureQueriesContext(connection) as context:
+            with transaction.atomic():
+                for product in Product.objects.all():
+                    product.price = Decimal('1.00')
+                    product.save()
+        recomputes = [query for query in context.captured_queries
+                      if 'MIN(' in query['sql']]
+        self.assertEqual(len(recomputes), 1)
+
+    def test_full_recompute(self):
+        """Should repair stats written behind the signals' back"""
+        Product.objects.filter(category=self.sport).update(featured=True)
+        self.assertEqual(self.get_stats()['Sport']['featured_count'], 1)
+        self.assertEqual(update_category_stats(), 3)
+        cache.clear()
+        self.assertEqual(self.get_stats()['Sport']['featured_count'], 2)
+
+    def test_categories(self):
+        """Should list and retrieve categories"""
+        response = self.client.get('/api/categories/{}/'.format(self.sport.id), **self.headers)
+        self.assertEqual(response.json(), {'id': self.sport.id, 'name': 'Sport'})
+        response = self.client.get('/api/categories/', **self.headers)
+        self.assertEqual(response.json()['count'], 3)
+
+
+class ProductPaginationTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='test')
+        self.token = Token.objects.create(user=self.user)
+        self.headers = {'HTTP_AUTHORIZATION': 'Token ' + str(self.token)}
+        category = Category.objects.create(name='Sport')
+        Product.objects.bulk_create([
+            Product(name='Product {}'.format(i), sku='{:08d}'.format(i),
+                    category=category, price=10)
+            for i in range(5)
+        ])
+
+    def test_page_size(self):
+        """Should let clients choose the page size in page number mode"""
+        response = self.client.get('/api/products/?page_size=4', **self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 5)
+        self.assertEqual(len(response.json()['results']), 4)
+        self.assertEqual(
+            response.json()['next'],
+            'http://testserver/api/products/?page=2&page_size=4')
+
+    def test_page_size_is_bounded(self):
+        """Should never return more than max_page_size products per page"""
+        category = Category.objects.first()
+        Product.objects.bulk_create([
+            Product(name='Extra', sku='00000000', category=category, price=10)
+            for _ in range(100)
+        ])
+        response = self.client.get('/api/products/?page_size=1000', **self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 100)
+
+    def test_cursor_pagination(self):
+        """Should walk the catalog by (created, id) without counting rows"""
+        url = '/api/products/?pagination=cursor&page_size=3'
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, **self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('count', response.json())
+        self.assertFalse(any('COUNT(' in q['sql'] for q in context.captured_queries))
+
+        first_page = response.json()
+        self.assertIsNone(first_page['previous'])
+        self.assertEqual(len(first_page['results']), 3)
+
+        response = self.client.get(first_page['next'], **self.headers)
+        second_page = response.json()
+        self.assertIsNone(second_page['next'])
+        self.assertEqual(len(second_page['results']), 2)
+
+        names = [p['name'] for p in first_page['results'] + second_page['results']]
+        self.assertEqual(names, ['Product {}'.format(i) for i in range(5)])
+
+
+class ProductResponseCacheTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='test')
+        self.token = Token.objects.create(user=self.user)
+        self.headers = {'HTTP_AUTHORIZATION': 'Token ' + str(self.token)}
+        self.category = Category.objects.create(name='Sport')
+        self.product_1 = Product.objects.create(
+            id=1, name='Nike Vapor', sku='44444444', category=self.category,
+            price=129.99)
+        self.product_2 = Product.objects.create(
+            id=2, name='Sweater', sku='88888888', category=self.category,
+            price=59.99)
+
+    def get(self, url, **extra):
+        extra.update(self.headers)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, **extra)
+        queries = [q['sql'] for q in context.captured_queries
+                   if 'products_product' in q['sql']]
+        return response, queries
+
+    def test_list_is_cached(self):
+        """Should serve a repeated list request without querying products"""
+        response, queries = self.get('/api/products/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(queries)
+
+        cached, queries = self.get('/api/products/')
+        self.assertEqual(cached.status_code, 200)
+        self.assertEqual(queries, [])
+        self.assertEqual(cached.json(), response.json())
+        self.assertEqual(cached['ETag'], response['ETag'])
+        self.assertIn('Last-Modified', cached)
+
+    def test_conditional_get(self):
+        """Should return 304 when the client already has the current version"""
+        response, _ = self.get('/api/products/1/')
+        self.assertEqual(response.status_code, 200)
+
+        response, queries = self.get(
+            '/api/products/1/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(queries, [])
+
+    def test_write_invalidates_cache(self):
+        """Should serve fresh data with a new ETag after a product changes"""
+        response, _ = self.get('/api/products/1/')
+        self.product_1.name = 'Updated name'
+        self.product_1.save()
+
+        updated, queries = self.get(
+            '/api/products/1/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(updated.status_code, 200)
+        self.assertTrue(queries)
+        self.assertEqual(updated.json()['name'], 'Updated name')
+        self.assertNotEqual(updated['ETag'], response['ETag'])
+
+    @override_settings(API_RESPONSE_CACHE={'TIMEOUT': 300, 'BACKEND': 'default',
+                                           'SETTLE_TIME': 60})
+    def test_recent_writes_are_not_cached(self):
+        """Should not cache responses until the catalog settled for SETTLE_TIME"""
+        self.product_1.save()
+        self.get('/api/products/1/')
+        _, queries = self.get('/api/products/1/')
+        self.assertTrue(queries)
+
+    def test_evicted_version_is_not_reused(self):
+        """Should not serve responses cached under a version lost to eviction"""
+        version, _ = get_catalog_state()
+        cache.delete(CATALOG_VERSION_KEY)
+        self.assertGreater(get_catalog_state()[0], version)
+
+        version, _ = get_catalog_state()
+        cache.delete(CATALOG_VERSION_KEY)
+        bump_catalog_version()
+        self.assertGreater(get_catalog_state()[0], version)
+
+    @override_settings(API_RESPONSE_CACHE={'TIMEOUT': 300, 'BACKEND': None})
+    def test_caching_disabled(self):
+        """Should query every time and send no ETag without a cache backend"""
+        for _ in range(2):
+            response, queries = self.get('/api/products/1/')
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(queries)
+            self.assertNotIn('ETag', response)
+        # nor do writes, which have no version to bump
+        self.product_1.save()
+
+    def test_denied_responses_are_not_cached(self):
+        """Should keep running object permissions for denied products"""
+        for _ in range(2):
+            response, queries = self.get('/api/products/2/')
+            self.assertEqual(response.status_code, 403)
+            self.assertTrue(queries)
+
+    def test_api_clients_share_cache_entries(self):
+        """Should not key cached responses on the APIClient credentials"""
+        for name, key in [('first', 'a'), ('second', 'b')]:
+            api_client = APIClient.objects.create(
+                name=name, accesskey=key * 32, secretkey=key * 32)
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(
+                    '/api/products/?accesskey={}'.format(api_client.accesskey),
+                    secretkey=api_client.secretkey)
+            self.assertEqual(response.status_code, 200)
+
+        self.assertFalse(any('products_product' in q['sql']
+                             for q in context.captured_queries))
+
+
+class APIMiddlewareTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='test')
+        self.token = Token.objects.create(user=self.user)
+
+    def test_api_skips_browser_middleware(self):
+        """Should not touch sessions, CSRF or X-Frame-Options on API requests"""
+        response = self.client.get(
+            '/api/products/', HTTP_AUTHORIZATION='Token ' + str(self.token))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(hasattr(response.wsgi_request, 'session'))
+        self.assertNotIn('X-Frame-Options', response)
+        self.assertNotIn('Cookie', response.get('Vary', ''))
+
+    def test_admin_keeps_browser_middleware(self):
+        """Should still run the full middleware stack for the admin"""
+        response = self.client.get('/admin/login/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('csrftoken', response.cookies)
+        self.assertEqual(response['X-Frame-Options'], 'SAMEORIGIN')
+
+    def test_browsable_api_cannot_be_framed(self):
+        """Should keep X-Frame-Options on HTML API responses"""
+        response = self.client.get(
+            '/api/products/', HTTP_ACCEPT='text/html',
+            HTTP_AUTHORIZATION='Token ' + str(self.token))
+        self.assertEqual(response['X-Frame-Options'], 'SAMEORIGIN')
+
+
+class CompressionMiddlewareTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        self.headers = {'HTTP_AUTHORIZATION': 'Token ' + str(Token.objects.create(user=self.admin))}
+        category = Category.objects.create(name='Sport')
+        for i in range(50):
+            Product.objects.create(
+                name='Product {}'.format(i), sku='{:08d}'.format(i), category=category,
+                description='Some product description', price=10)
+
+    def get(self, url, encoding, **extra):
+        return self.client.get(url, HTTP_ACCEPT_ENCODING=encoding, **dict(self.headers, **extra))
+
+    def test_gzip(self):
+        """Should gzip large API responses and weaken their ETag"""
+        plain = self.get('/api/products/?page_size=50', '')
+        response = self.get('/api/products/?page_size=50', 'gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertEqual(response['ETag'], 'W/' + plain['ETag'])
+
+        # the weak ETag still matches, and a 304 has nothing to compress
+        response = self.get('/api/products/?page_size=50', 'gzip',
+                            HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertNotIn('Content-Encoding', response)
+
+    @skipIf(brotli is None, 'brotli is not installed')
+    def test_brotli_preferred(self):
+        """Should pick brotli unless the client rates it lower"""
+        plain = self.get('/api/products/?page_size=50', '')
+        response = self.get('/api/products/?page_size=50', 'gzip, deflate, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.content), plain.content)
+        response = self.get('/api/products/?page_size=50', 'br;q=0.5, gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        response = self.get('/api/products/?page_size=50', 'identity, *;q=0')
+        self.assertNotIn('Content-Encoding', response)
+
+    def test_small_responses(self):
+        """Should not compress responses under MIN_SIZE"""
+        response = self.get('/api/products/?page_size=1', 'gzip')
+        self.assertNotIn('Content-Encoding', response)
+
+    def test_streaming_response(self):
+        """Should compress streaming responses chunk by chunk"""
+        plain = b''.join(self.get('/api/products/export/', '').streaming_content)
+        response = self.get('/api/products/export/', 'gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', response)
+        # every chunk is flushed, so what arrived so far always decodes
+        decompressor = zlib.decompressobj(31)
+        content = b''
+        for chunk in response.streaming_content:
+            content += decompressor.decompress(chunk)
+        self.assertEqual(content, plain)
+
+    def test_encoded_responses(self):
+        """Should not compress a response twice"""
+        content = gzip.compress(b'[]' * 1000)
+
+        def get_response(request):
+            response = HttpResponse(content, content_type='application/json')
+            response['Content-Encoding'] = 'gzip'
+            return response
+
+        request = RequestFactory().get('/api/products/', HTTP_ACCEPT_ENCODING='gzip')
+        response = CompressionMiddleware(get_response)(request)
+        self.assertEqual(response.content, content)
+
+    def test_html_is_not_compressed(self):
+        """Should leave the browsable API and non API pages alone"""
+        response = self.get('/api/products/?page_size=50', 'gzip', HTTP_ACCEPT='text/html')
+        self.assertNotIn('Content-Encoding', response)
+        response = self.client.get('/admin/login/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertNotIn('Content-Encoding', response)
+
+
+class ASGIHandlerTestCase(TransactionTestCase):
+    # views run on the handler's threads, which only see committed rows
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        self.token = Token.objects.create(user=self.admin)
+        self.category = Category.objects.create(name='Sport')
+        self.product = Product.objects.create(
+            id=1, name='Nike Vapor', sku='44444444', category=self.category, price=129.99)
+        self.handler = ASGIHandler()
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.handler.executor.shutdown()
+        self.loop.close()
+
+    def request(self, method, path, query_string=b'', body_chunks=(b'',), headers=()):
+        scope = {
+            'type': 'http', 'method': method, 'path': path, 'query_string': query_string,
+            'http_version': '1.1', 'scheme': 'http', 'server': ('testserver', 80),
+            'client': ('127.0.0.1', 12345),
+            'headers': [(b'authorization', 'Token {}'.format(self.token).encode())] + list(headers),
+        }
+        messages = [{'type': 'http.request', 'body': chunk,
+                     'more_body': index < len(body_chunks) - 1}
+                    for index, chunk in enumerate(body_chunks)]
+        sent = []
+
+        async def receive():
+            return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        self.loop.run_until_complete(self.handler(scope, receive, send))
+        return sent
+
+    def test_retrieve(self):
+        """Should answer like the WSGI handler, through the same auth and permissions"""
+        sent = self.request('GET', '/api/products/1/')
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn((b'content-type', b'application/json'), sent[0]['headers'])
+        expected = self.client.get(
+            '/api/products/1/', HTTP_AUTHORIZATION='Token {}'.format(self.token))
+        self.assertEqual(json.loads(sent[1]['body'].decode()), expected.json())
+
+    def test_body_in_several_messages(self):
+        """Should read request bodies sent in several messages"""
+        body = json.dumps({'name': 'Sweater', 'sku': '88888888', 'category': self.category.id,
+                           'description': '', 'price': '59.99'}).encode()
+        sent = self.request('POST', '/api/products/', body_chunks=[body[:10], body[10:]],
+                            headers=[(b'content-type', b'application/json'),
+                                     (b'content-length', str(len(body)).encode())])
+        self.assertEqual(sent[0]['status'], 201)
+        self.assertTrue(Product.objects.filter(sku='88888888').exists())
+
+    def test_streaming_response(self):
+        """Should send streaming responses chunk by chunk"""
+        sent = self.request('GET', '/api/products/export/')
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertTrue(all(message['more_body'] for message in sent[1:-1]))
+        self.assertFalse(sent[-1].get('more_body', False))
+        body = b''.join(message.get('body', b'') for message in sent[1:])
+        self.assertEqual(json.loads(body.decode())['sku'], '44444444')
+
+    def test_response_closed_on_pool_thread(self):
+        """Should close responses, releasing the connection, on the thread that ran the view"""
+        threads = []
+
+        def receiver(**kwargs):
+            threads.append(threading.current_thread().name)
+
+        request_finished.connect(receiver)
+        try:
+            self.request('GET', '/api/products/1/')
+            self.request('GET', '/api/products/export/')
+        finally:
+            request_finished.disconnect(receiver)
+        self.assertEqual(len(threads), 2)
+        self.assertTrue(all(name.startswith('asgi') for name in threads))
+
+    def test_client_disconnect(self):
+        """Should not run the view for a client gone before sending its body"""
+        sent = self.request('POST', '/api/products/', body_chunks=())
+        self.assertEqual(sent, [])
+
+
+class StaticFilesTestCase(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.static_root = tempfile.mkdtemp()
+        cls.settings_override = override_settings(
+            STATIC_ROOT=cls.static_root,
+            STATICFILES_STORAGE='whitenoise.storage.CompressedManifestStaticFilesStorage')
+        cls.settings_override.enable()
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings_override.disable()
+        shutil.rmtree(cls.static_root)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.name = 'rest_framework/css/bootstrap.min.css'
+        self.url = staticfiles_storage.url(self.name)
+        self.path = os.path.join(self.static_root, self.url[len('/static/'):])
+
+    def get(self, url, encoding):
+        # the compressors are off limits while serving
+        with mock.patch('gzip.GzipFile', side_effect=AssertionError), \
+                mock.patch('zlib.compress', side_effect=AssertionError), \
+                mock.patch('brotli.compress', side_effect=AssertionError):
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING=encoding)
+            return response, b''.join(response.streaming_content)
+
+    def test_hashed_names(self):
+        """Should serve content hashed names with an immutable Cache-Control"""
+        self.assertNotEqual(self.url, '/static/' + self.name)
+        response, _ = self.get(self.url, '')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+
+    def test_encoding_negotiation(self):
+        """Should serve the variant written by collectstatic for each encoding"""
+        for encoding, suffix in [('gzip, deflate, br', '.br'), ('gzip', '.gz'), ('', '')]:
+            response, content = self.get(self.url, encoding)
+            self.assertEqual(response.get('Content-Encoding'), {
+                '.br': 'br', '.gz': 'gzip', '': None}[suffix])
+            with open(self.path + suffix, 'rb') as variant:
+                self.assertEqual(content, variant.read())
+
+
+class ReplicaRouterTestCase(TestCase):
+    replica = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': 'replica'}
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+
+    def test_reads_stay_on_primary_by_default(self):
+        """Should only route reads inside use_replica() blocks"""
+        with self.settings(DATABASES={'default': {}, 'replica': self.replica}):
+            self.assertIsNone(self.router.db_for_read(Product))
+            with use_replica():
+                self.assertEqual(self.router.db_for_read(Product), 'replica')
+                self.assertIsNone(self.router.db_for_read(User))
+                self.assertIsNone(self.router.db_for_write(Product))
+            self.assertIsNone(self.router.db_for_read(Product))
+
+    @override_settings(DATABASE_ROUTERS=['api.tests.RecordingReplicaRouter'])
+    def test_streamed_export_reads_replica(self):
+        """Should read the rows of streamed exports from the replica too"""
+        user = User.objects.create(username='test')
+        headers = {'HTTP_AUTHORIZATION': 'Token ' + str(Token.objects.create(user=user))}
+        Product.objects.create(name='Nike Vapor', sku='44444444', price=129.99,
+                               category=Category.objects.create(name='Sport'))
+        RecordingReplicaRouter.product_reads = []
+        response = self.client.get('/api/products/export/', **headers)
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 1)
+        self.assertEqual(set(RecordingReplicaRouter.product_reads), {'default'})
+
+    def test_without_replica(self):
+        """Should keep every read on the primary when no replica is configured"""
+        with use_replica():
+            self.assertIsNone(self.router.db_for_read(Product))
+        self.assertFalse(self.router.allow_migrate('replica', 'products'))
+
+
+class RecordingReplicaRouter(ReplicaRouter):
+    """ReplicaRouter using the default database as replica, recording product reads"""
+    replica_alias = 'default'
+    product_reads = []
+
+    def db_for_read(self, model, **hints):
+        alias = super().db_for_read(model, **hints)
+        if model is Product:
+            self.product_reads.append(alias)
+        return alias
+
+
+class ConnectionPoolTestCase(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('psycopg2.connect', side_effect=lambda **kwargs: mock.MagicMock(closed=0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool = BlockingConnectionPool(1, 1, timeout=5)
+
+    def test_waits_for_a_connection(self):
+        """Should hand out a connection given back while waiting for one"""
+        connection = self.pool.getconn()
+        threading.Timer(0.1, self.pool.putconn, [connection]).start()
+        self.assertIs(self.pool.getconn(), connection)
+
+    def test_timeout(self):
+        """Should fail with OperationalError once no connection came back in time"""
+        self.pool.timeout = 0.1
+        self.pool.getconn()
+        with self.assertRaises(psycopg2.OperationalError):
+            self.pool.getconn()
+
+    def test_replaces_dropped_connection(self):
+        """Should ping a connection idle for the interval and replace it when it fails"""
+        self.pool.health_check_interval = 0
+        connection = self.pool.getconn()
+        execute = connection.cursor.return_value.__enter__.return_value.execute
+        execute.side_effect = psycopg2.OperationalError('server closed the connection')
+        self.pool.putconn(connection)
+        self.assertIsNot(self.pool.getconn(), connection)
+        execute.assert_called_once_with('SELECT 1')
+        connection.close.assert_called_once_with()
+
+    def test_recently_returned_connection(self):
+        """Should hand out a connection returned within the interval without pinging it"""
+        self.pool.health_check_interval = 30
+        connection = self.pool.getconn()
+        self.pool.putconn(connection)
+        self.assertIs(self.pool.getconn(), connection)
+        connection.cursor.assert_not_called()
+
+
+class RendererTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        self.headers = {'HTTP_AUTHORIZATION': 'Token ' + str(Token.objects.create(user=self.admin))}
+        self.category = Category.objects.create(name='Sport')
+        Product.objects.create(
+            id=1, name='Nike Vapor \u2028 é', sku='44444444', category=self.category,
+            price=129.99)
+
+    def test_fast_json_output(self):
+        """Should render the same bytes as JSONRenderer"""
+        values = [
+            {'text': 'quotes " \\ newline \n control \x1f é \u2028 \u2029', 'none': None},
+            {'created': timezone.now(), 'date': timezone.now().date(), 'price': Decimal('1.10')},
+            [1, -0.0, 0.1, 1e16, 1e-7, 2 ** 64, True],
+            {1: 'integer key'},
+            self.client.get('/api/products/', **self.headers).data,
+        ]
+        for value in values:
+            for media_type in ['application/json', 'application/json; indent=4']:
+                self.assertEqual(
+                    FastJSONRenderer().render(value, media_type),
+                    JSONRenderer().render(value, media_type))
+
+    @skipIf(msgpack is None, 'msgpack is not installed')
+    def test_msgpack_response(self):
+        """Should render MessagePack when asked for it"""
+        response = self.client.get(
+            '/api/products/', HTTP_ACCEPT='application/msgpack', **self.headers)
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        json_response = self.client.get('/api/products/', **self.headers)
+        self.assertEqual(msgpack.unpackb(response.content, raw=False), json_response.json())
+        self.assertNotEqual(response['ETag'], json_response['ETag'])
+
+    @skipIf(msgpack is None, 'msgpack is not installed')
+    def test_msgpack_request(self):
+        """Should parse MessagePack request bodies"""
+        data = {'name': 'Sweater', 'sku': '88888888', 'category': self.category.id,
+                'description': '', 'price': '59.99'}
+        response = self.client.post(
+            '/api/products/', msgpack.packb(data), content_type='application/msgpack',
+            **self.headers)
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post(
+            '/api/products/', b'\xc1', content_type='application/msgpack', **self.headers)
+        self.assertEqual(response.status_code, 400)
+
+
+class ProductReadSerializerTestCase(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(name='Sport')
+        created = datetime(2018, 12, 20, 10, 15, 30, 123456, tzinfo=timezone.utc)
+        for i, price in enumerate([Decimal('129.99'), Decimal('5'), 0.1, 1000]):
+            product = Product.objects.create(
+                name='Product {}'.format(i), sku='{:08d}'.format(i),
+                category=category, description='' if i % 2 else 'Ünïcode',
+                price=price, featured=bool(i % 2))
+            Product.objects.filter(id=product.id).update(created=created)
+
+    def render(self, serializer_class, queryset):
+        return JSONRenderer().render(serializer_class(queryset, many=True).data)
+
+    def assertSameOutput(self):
+        queryset = Product.objects.order_by('id')
+        rows = queryset.values_list(*ProductReadSerializer.get_columns(), named=True)
+        self.assertEqual(
+            self.render(ProductReadSerializer, rows),
+            self.render(ProductSerializer, queryset))
+
+    def test_same_output_as_model_serializer(self):
+        """Should render exactly the same JSON as ProductSerializer"""
+        self.assertSameOutput()
+
+    def test_same_output_in_other_timezone(self):
+        """Should convert datetimes to the active timezone like ProductSerializer"""
+        with timezone.override('America/Argentina/Buenos_Aires'):
+            self.assertSameOutput()
+
+
+class ProductSearchTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='test')
+        self.token = Token.objects.create(user=self.user)
+        self.headers = {'HTTP_AUTHORIZATION': 'Token ' + str(self.token)}
+        self.sport = Category.objects.create(name='Sport')
+        self.clothes = Category.objects.create(name='Clothes')
+        self.vapor = Product.objects.create(
+            name='Nike Vapor', sku='44444444', category=self.sport,
+            description='Running shoes', price=129.99)
+        self.cap = Product.objects.create(
+            name='Cap', sku='33333333', category=self.clothes,
+            description='Nike cap for running', price=27.99)
+        self.sweater = Product.objects.create(
+            name='Sweater', sku='55555555', category=self.clothes,
+            description='Wool sweater', price=49.99)
+
+    def search(self, query):
+        response = self.client.get(
+            '/api/products/search/', {'q': query}, **self.headers)
+        self.assertEqual(response.status_code, 200)
+        return [product['id'] for product in response.json()['results']]
+
+    def test_search_ranks_results(self):
+        """Should rank name matches above description matches"""
+        self.assertEqual(self.search('nike'), [self.vapor.id, self.cap.id])
+        self.assertEqual(self.search('NIKE running'), [self.vapor.id, self.cap.id])
+        self.assertEqual(self.search('nike wool'), [])
+
+    def test_search_sku_and_category(self):
+        """Should match products by sku and by category name"""
+        self.assertEqual(self.search('55555555'), [self.sweater.id])
+        self.assertEqual(self.search('clothes'), [self.cap.id, self.sweater.id])
+
+    def test_search_follows_writes(self):
+        """Should reflect product and category changes in later searches"""
+        self.assertEqual(self.search('wool'), [self.sweater.id])
+        self.sweater.description = 'Cotton sweater'
+        self.sweater.save()
+        self.assertEqual(self.search('wool'), [])
+
+        self.clothes.name = 'Apparel'
+        self.clothes.save()
+        self.assertEqual(self.search('apparel'), [self.cap.id, self.sweater.id])
+
+        self.cap.delete()
+        self.assertEqual(self.search('apparel'), [self.sweater.id])
+
+    def test_search_is_paginated(self):
+        """Should paginate search results in pages of PAGE_SIZE"""
+        response = self.client.get(
+            '/api/products/search/', {'q': 'clothes', 'page_size': 1}, **self.headers)
+        self.assertEqual(response.json()['count'], 2)
+        self.assertEqual(len(response.json()['results']), 1)
+        self.assertIsNotNone(response.json()['next'])
+
+    def test_search_requires_query(self):
+        """Should return 400 when no query is given"""
+        response = self.client.get('/api/products/search/', **self.headers)
+        expected = {'q': ['This query parameter is required.']}
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), expected)
+
+    def test_token_index_follows_change_log(self):
+        """Should catch up with writes logged by any process, and undo rolled back ones"""
+        index = TokenIndex()
+        self.assertEqual(index.search('wool'), [self.sweater.id])
+        self.sweater.description = 'Cotton sweater'
+        self.sweater.save()
+        self.assertEqual(index.search('cotton'), [self.sweater.id])
+
+        with self.assertRaises(ValidationError):
+            with transaction.atomic():
+                Product.objects.create(
+                    name='Wool cap', sku='22222222', category=self.clothes, price=19.99)
+                self.assertEqual(len(index.search('wool')), 1)
+                raise ValidationError('rollback')
+        self.assertEqual(index.search('wool'), [])
+
+    def test_token_index_incremental_update(self):
+        """Should update only the given products once the index is built"""
+        index = TokenIndex()
+        self.assertEqual(index.search('wool'), [self.sweater.id])
+        Product.objects.filter(id=self.sweater.id).update(description='Cotton')
+        self.assertEqual(index.search('wool'), [self.sweater.id])
+
+        index.update([self.sweater.id])
+        self.assertEqual(index.search('wool'), [])
+        self.assertEqual(index.search('cotton'), [self.sweater.id])
+
+
+class ProductFilterTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='test')
+        self.token = Token.objects.create(user=self.user)
+        self.headers = {'HTTP_AUTHORIZATION': 'Token ' + str(self.token)}
+        self.sport = Category.objects.create(name='Sport')
+        self.clothes = Category.objects.create(name='Clothes')
+        self.vapor = Product.objects.create(
+            name='Nike Vapor', sku='44444444', category=self.sport,
+            price=129.99, featured=True)
+        self.cap = Product.objects.create(
+            name='Nike Cap', sku='33333333', category=self.sport, price=27.99)
+        self.sweater = Product.objects.create(
+            name='Sweater', sku='55555555', category=self.clothes,
+            price=49.99, featured=True)
+
+    def list_ids(self, params):
+        params['page_size'] = 100
+        response = self.client.get('/api/products/', params, **self.headers)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [product['id'] for product in response.json()['results']]
+
+    def test_filters(self):
+        """Should filter by category, featured, sku and price range"""
+        self.assertEqual(self.list_ids({'category': self.sport.id}),
+                         [self.vapor.id, self.cap.id])
+        self.assertEqual(self.list_ids({'featured': 'true'}),
+                         [self.vapor.id, self.sweater.id])
+        self.assertEqual(self.list_ids({'sku': '33333333'}), [self.cap.id])
+        self.assertEqual(self.list_ids({'price_min': '30', 'price_max': '130'}),
+                         [self.sweater.id, self.vapor.id])
+        self.assertEqual(
+            self.list_ids({'category': self.sport.id, 'featured': 'false'}),
+            [self.cap.id])
+
+    def test_ordering(self):
+        """Should order by price or created in both directions"""
+        self.assertEqual(self.list_ids({'ordering': 'price'}),
+                         [self.cap.id, self.sweater.id, self.vapor.id])
+        self.assertEqual(self.list_ids({'ordering': '-price', 'featured': '1'}),
+                         [self.vapor.id, self.sweater.id])
+        self.assertEqual(self.list_ids({'ordering': '-created'}),
+                         [self.sweater.id, self.cap.id, self.vapor.id])
+
+    def test_cursor_pagination_follows_ordering(self):
+        """Should walk cursor pages in the requested ordering"""
+        response = self.client.get(
+            '/api/products/',
+            {'pagination': 'cursor', 'ordering': '-price', 'page_size': 2},
+            **self.headers)
+        ids = [product['id'] for product in response.json()['results']]
+        response = self.client.get(response.json()['next'], **self.headers)
+        ids += [product['id'] for product in response.json()['results']]
+        self.assertEqual(ids, [self.vapor.id, self.sweater.id, self.cap.id])
+
+    def test_rejected_combinations(self):
+        """Should return 400 for invalid values and non indexed query shapes"""
+        for params in [{'ordering': 'name'},
+                       {'ordering': 'created', 'price_min': '10'},
+                       {'category': 'sport'},
+                       {'category': '99999999999999999999'},
+                       {'category': '0'},
+                       {'featured': 'maybe'},
+                       {'price_max': 'cheap'},
+                       {'price_min': 'inf'},
+                       {'price_max': '-Infinity'},
+                       {'price_min': 'nan'},
+                       {'price_max': 'snan'}]:
+            response = self.client.get('/api/products/', params, **self.headers)
+            self.assertEqual(response.status_code, 400, params)
+
+    def test_query_shapes_use_indexes(self):
+        """Should never scan products_product without an index"""
+        shapes = [
+            {},
+            {'sku': '1'},
+            {'ordering': '-price'},
+            {'price_min': '1', 'price_max': '2'},
+            {'category': '1', 'ordering': 'price'},
+            {'category': '1', 'price_min': '1'},
+            {'featured': 'true', 'ordering': '-created'},
+            {'featured': 'true', 'price_max': '1'},
+            {'category': '1', 'featured': 'false'},
+            {'category': '1', 'featured': 'false', 'ordering': 'price'},
+        ]
+        backend = ProductFilterBackend()
+        for params in shapes:
+            request = self.client.get('/', params).wsgi_request
+            request.query_params = request.GET
+            queryset = backend.filter_queryset(request, Product.objects.all(), None)
+            sql, sql_params = queryset.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, sql_params)
+                plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+            self.assertIn('INDEX', plan, params)
+            if 'sku' not in params:
+                # sku lookups only sort the handful of rows sharing that sku
+                self.assertNotIn('TEMP B-TREE', plan, params)
+
+
+class ProductBulkTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        self.headers = {
+            'HTTP_AUTHORIZATION': 'Token ' + str(Token.objects.create(user=self.admin))}
+        self.category = Category.objects.create(name='Sport')
+        self.product = Product.objects.create(
+            name='Nike Vapor', sku='44444444', category=self.category, price=129.99)
+
+    def send(self, method, data, **headers):
+        headers = headers or self.headers
+        return getattr(self.client, method)(
+            '/api/products/bulk/', data=json.dumps(data),
+            content_type='application/json', **headers)
+
+    def test_bulk_create(self):
+        """Should create every valid product and report per item results"""
+        payload = [
+            {'name': 'First', 'sku': '11111111', 'category': self.category.id,
+             'price': 10},
+            {'name': 'Second', 'sku': '22222222', 'category': 999, 'price': 10},
+            {'name': 'Third', 'sku': '33333333', 'category': self.category.id,
+             'price': 20, 'featured': True},
+        ]
+        with CaptureQueriesContext(connection) as context:
+            response = self.send('post', payload)
+        self.assertEqual(response.status_code, 207)
+
+        results = response.json()
+        self.assertEqual([result['status'] for result in results], [201, 400, 201])
+        self.assertEqual(results[1]['errors'],
+                         {'category': ['Invalid pk "999" - object does not exist.']})
+        self.assertEqual(
+            list(Product.objects.order_by('id').values_list('name', flat=True)),
+            ['Nike Vapor', 'First', 'Third'])
+        ids = dict(Product.objects.values_list('name', 'id'))
+        self.assertEqual([results[0]['id'], results[2]['id']], [ids['First'], ids['Third']])
+        category_queries = [q for q in context.captured_queries
+                            if 'FROM "products_category"' in q['sql']]
+        self.assertEqual(len(category_queries), 1)
+
+    def test_bulk_update(self):
+        """Should fully or partially update products by id"""
+        other = Product.objects.create(
+            name='Cap', sku='33333333', category=self.category, price=27.99)
+        payload = [
+            {'id': self.product.id, 'name': 'Renamed'},
+            {'id': other.id, 'price': '30.00', 'featured': True},
+            {'id': 999, 'name': 'Missing'},
+            {'name': 'No id'},
+        ]
+        response = self.send('patch', payload)
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([result['status'] for result in response.json()],
+                         [200, 200, 404, 400])
+
+        self.product.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.product.name, 'Renamed')
+        self.assertEqual(float(self.product.price), 129.99)
+        self.assertEqual(float(other.price), 30)
+        self.assertTrue(other.featured)
+
+        response = self.send('put', [{'id': self.product.id, 'name': 'Renamed'}])
+        self.assertEqual(response.status_code, 207)
+        self.assertIn('sku', response.json()[0]['errors'])
+
+    def test_bulk_boolean_ids(self):
+        """Should reject JSON booleans as ids rather than reading true as 1"""
+        if not Product.objects.filter(pk=1).exists():
+            Product.objects.create(
+                id=1, name='Nike Vapor', sku='11111111', category=self.category, price=10)
+        response = self.send('patch', [{'id': True, 'name': 'Renamed'}])
+        self.assertEqual(response.json()[0]['status'], 400)
+        response = self.send('delete', [True])
+        self.assertEqual(response.json()[0]['status'], 400)
+        self.assertEqual(Product.objects.get(pk=1).name, 'Nike Vapor')
+
+    def test_bulk_destroy(self):
+        """Should delete products by id and report missing ones"""
+        response = self.send('delete', [self.product.id, 999])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([result['status'] for result in response.json()], [204, 404])
+        self.assertEqual(Product.objects.count(), 0)
+
+    def test_bulk_destroy_logs_in_batches(self):
+        """Should log a bulk delete, cascades included, with one insert per model"""
+        products = [Product(name='Product {}'.format(index), sku='{:08}'.format(index),
+                            category=self.category, price=10) for index in range(20)]
+        Product.objects.bulk_create(products)
+        ids = list(Product.objects.values_list('id', flat=True))
+        ProductImage.objects.bulk_create([
+            ProductImage(product_id=product_id, url='http://example.com/1.jpg')
+            for product_id in ids])
+        image_ids = list(ProductImage.objects.values_list('id', flat=True))
+        after = Change.objects.order_by('seq').values_list('seq', flat=True).last() or 0
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.send('delete', ids)
+        self.assertEqual(response.status_code, 200)
+        inserts = [q for q in context.captured_queries
+                   if q['sql'].startswith('INSERT INTO "products_change"')]
+        self.assertEqual(len(inserts), 2)
+        self.assertLess(len(context.captured_queries), 20)
+
+        tombstones = Change.objects.filter(seq__gt=after, action=Change.DELETED)
+        self.assertCountEqual(tombstones.filter(model='product').values_list(
+            'object_id', flat=True), ids)
+        self.assertCountEqual(tombstones.filter(model='productimage').values_list(
+            'object_id', flat=True), image_ids)
+
+    def test_bulk_requires_list(self):
+        """Should return 400 when the payload is not a list"""
+        response = self.send('post', {'name': 'Single'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_not_admin(self):
+        """Should return 403 when a non admin user uses the bulk endpoints"""
+        user = User.objects.create(username='test')
+        headers = {'HTTP_AUTHORIZATION': 'Token ' + str(Token.objects.create(user=user))}
+        for method in ['post', 'put', 'patch', 'delete']:
+            response = self.send(method, [], **headers)
+            self.assertEqual(response.status_code, 403)
+
+    def test_bulk_writes_invalidate_caches(self):
+        """Should serve fresh list and search results after bulk writes"""
+        self.client.get('/api/products/', **self.headers)
+        self.client.get('/api/products/search/?q=vapor', **self.headers)
+        self.send('patch', [{'id': self.product.id, 'name': 'Nike Pegasus'}])
+
+        response = self.client.get('/api/products/', **self.headers)
+        self.assertEqual(response.json()['results'][0]['name'], 'Nike Pegasus')
+        response = self.client.get('/api/products/search/?q=pegasus', **self.headers)
+        self.assertEqual(response.json()['count'], 1)
+
+
+class ProductExportTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='test')
+        self.headers = {
+            'HTTP_AUTHORIZATION': 'Token ' + str(Token.objects.create(user=self.user))}
+        category = Category.objects.create(name='Sport')
+        with freeze_time('2018-12-20T10:15:30+00:00'):
+            self.old = Product.objects.create(
+                name='Nike Vapor', sku='44444444', category=category,
+                description='Line\u2028separator', price=129.99, featured=True)
+        with freeze_time('2019-01-10T08:00:00+00:00'):
+            self.new = Product.objects.create(
+                name='Cap, "red"', sku='33333333', category=category, price=27.99)
+
+    def export(self, params=None):
+        response = self.client.get('/api/products/export/', params or {}, **self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode('utf-8')
+
+    def test_export_ndjson(self):
+        """Should stream one JSON object per product, as ProductSerializer renders it"""
+        response, content = self.export()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = content.splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn('\\u2028', lines[0])
+
+        expected = JSONRenderer().render(
+            ProductSerializer([self.old, self.new], many=True).data).decode('utf-8')
+        self.assertEqual('[' + ','.join(lines) + ']', expected)
+
+    def test_export_csv(self):
+        """Should stream a CSV file with a header row"""
+        response, content = self.export({'output': 'csv'})
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(content.splitlines()[0],
+                         'id,name,sku,category,description,price,created,featured')
+        self.assertEqual(
+            content.splitlines()[-1],
+            '{},"Cap, ""red""",33333333,{},,27.99,2019-01-10T08:00:00Z,false'.format(
+                self.new.id, self.new.category_id))
+
+    def test_export_since(self):
+        """Should only export products created after the watermark"""
+        _, content = self.export({'since': '2019-01-01T00:00:00Z'})
+        self.assertEqual([json.loads(line)['id'] for line in content.splitlines()],
+                         [self.new.id])
+
+    def test_export_invalid_params(self):
+        """Should return 400 for unknown formats and malformed watermarks"""
+        for params in [{'output': 'xml'}, {'since': 'yesterday'}]:
+            response = self.client.get('/api/products/export/', params, **self.headers)
+            self.assertEqual(response.status_code, 400)
+
+
+class QueryCountAssertionsMixin(object):
+
+    def assertQueryCountConstant(self, url, page_sizes=(2, 10), **extra):
+        """
+        Fails if requesting url costs more queries for bigger pages, which
+        means some relation is fetched once per row
+        """
+        separator = '&' if '?' in url else '?'
+        # warm up per process state, such as the search index, then bust
+        # the response cache with a parameter nothing else reads
+        self.client.get(url, **extra)
+        counts = []
+        for page_size in page_sizes:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get('{}{}page_size={}&_={}'.format(
+                    url, separator, page_size, page_size), **extra)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json()['results']), page_size)
+            counts.append(len(context.captured_queries))
+        self.assertEqual(len(set(counts)), 1, 'Query counts grew with page size: {}'.format(
+            dict(zip(page_sizes, counts))))
+
+
+class ProductExpandTestCase(QueryCountAssertionsMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='test')
+        self.headers = {
+            'HTTP_AUTHORIZATION': 'Token ' + str(Token.objects.create(user=self.user))}
+        categories = [Category.objects.create(name='Category {}'.format(i))
+                      for i in range(3)]
+        for i in range(12):
+            product = Product.objects.create(
+                name='Product {}'.format(i), sku='{:08d}'.format(i),
+                category=categories[i % 3], price=10)
+            for j in range(2):
+                ProductImage.objects.create(
+                    product=product, url='https://example.com/{}-{}.jpg'.format(i, j))
+        self.product = Product.objects.order_by('id').first()
+
+    def test_expand_category_and_images(self):
+        """Should embed the category and the image urls of each product"""
+        response = self.client.get(
+            '/api/products/{}/?expand=category,images'.format(self.product.id),
+            **self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['category'],
+                         {'id': self.product.category.id, 'name': 'Category 0'})
+        self.assertEqual(response.json()['images'],
+                         ['https://example.com/0-0.jpg', 'https://example.com/0-1.jpg'])
+
+    def test_expand_is_opt_in(self):
+        """Should keep the category id and no images without expand"""
+        response = self.client.get(
+            '/api/products/{}/'.format(self.product.id), **self.headers)
+        self.assertEqual(response.json()['category'], self.product.category.id)
+        self.assertNotIn('images', response.json())
+
+    def test_unknown_expand(self):
+        """Should return 400 when asked to expand an unknown relation"""
+        response = self.client.get('/api/products/?expand=owner', **self.headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_constant_queries(self):
+        """Should cost the same number of queries regardless of page size"""
+        for url in ['/api/products/',
+                    '/api/products/?expand=category',
+                    '/api/products/?expand=images',
+                    '/api/products/?expand=category,images',
+                    '/api/products/search/?q=product&expand=category,images']:
+            self.assertQueryCountConstant(url, **self.headers)
@@ -8,6 +8,13 @@ from api import views
 
 router = DefaultRouter()
 router.register('products', views.ProductViewSet, base_name='products')
+router.register('categories', views.CategoryViewSet, base_name='categories')
 
-urlpatterns = []
+urlpatterns = [
+    path('changes/', views.ChangeListView.as_view(), name='changes'),
+    path('metrics/', views.MetricsView.as_view(), name='metrics'),
+    path('metrics/profiles/', views.ProfileListView.as_view(), name='profiles'),
+    path('metrics/profiles/<int:profile_id>/', views.ProfileDetailView.as_view(),
+         name='profile'),
+]
 urlpatterns += router.urls
@@ -1,19 +1,426 @@
-from rest_framework import viewsets
-from rest_framework.permissions import IsAuthenticated, IsAdminUser
+import csv
+import json
 
-from products.models import Product
-from api.serializers import ProductSerializer
+from django.db import transaction
+from django.db.models import QuerySet
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import serializers, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.permissions import SAFE_METHODS, IsAuthenticated, IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from ecommerce.db.routers import use_replica
+from products.bulk import bulk_update
+from products.changes import (
+    LOGGED_MODELS, get_compaction_horizon, get_last_pk, set_created_pks)
+from products.models import Category, Change, Product
+from products.signals import bulk_deleting, bulk_saved
+from api.filters import ProductFilterBackend
+from api.metrics import profiles, render_metrics
+from api.mixins import CachedResponseMixin, QuerysetPermissionMixin, RequestProfileMixin
+from api.pagination import ProductPagination, ProductPageNumberPagination
+from api.search import search_products
+from api.serializers import (
+    CategorySerializer, CategoryStatsSerializer, ChangeSerializer, ProductSerializer,
+    ProductBulkSerializer, ProductExpandSerializer, ProductReadSerializer)
 from api.permissions import IsOddProductID, IsNotHacker
+from api.renderers import PlainTextRenderer
 
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(RequestProfileMixin, CachedResponseMixin, QuerysetPermissionMixin,
+                     viewsets.ModelViewSet):
     serializer_class = ProductSerializer
     queryset = Product.objects.all()
+    pagination_class = ProductPagination
+    filter_backends = [ProductFilterBackend]
+    bulk_batch_size = 1000
+    export_chunk_size = 2000
+    expandable_fields = ('category', 'images')
+
+    def dispatch(self, request, *args, **kwargs):
+        # product reads may go to the read replica, see ReplicaRouter
+        if request.method in SAFE_METHODS:
+            with use_replica():
+                return super().dispatch(request, *args, **kwargs)
+        return super().dispatch(request, *args, **kwargs)
 
     def get_permissions(self):
         permissions = [IsAuthenticated(), IsNotHacker()]
-        if self.action in ['create', 'update', 'partial_update', 'destroy']:
+        if self.action in ['create', 'update', 'partial_update', 'destroy',
+                           'bulk_create', 'bulk_update', 'bulk_partial_update',
+                           'bulk_destroy']:
             permissions += [IsAdminUser()]
         elif self.action == 'retrieve':
             permissions += [IsOddProductID()]
         return permissions
+
+    def get_expand(self):
+        """Returns the relations to embed, from `?expand=category,images`"""
+        if self.action not in ['list', 'retrieve', 'search']:
+            return set()
+        if not hasattr(self, '_expand'):
+            value = self.request.query_params.get('expand', '')
+            expand = {name.strip() for name in value.split(',') if name.strip()}
+            unknown = expand - set(self.expandable_fields)
+            if unknown:
+                raise ValidationError({'expand': ['Unknown fields: {}.'.format(
+                    ', '.join(sorted(unknown)))]})
+            self._expand = expand
+        return self._expand
+
+    def use_read_serializer(self):
+        # the browsable API builds forms from the serializer, which needs
+        # model instances and a regular ModelSerializer
+        renderer = getattr(self.request, 'accepted_renderer', None)
+        return (self.action in ['list', 'retrieve'] and not self.get_expand() and
+                renderer is not None and renderer.format != 'api')
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.use_read_serializer():
+            return queryset.values_list(
+                *ProductReadSerializer.get_columns(), named=True)
+
+        expand = self.get_expand()
+        if 'category' in expand:
+            queryset = queryset.select_related('category')
+        if 'images' in expand:
+            queryset = queryset.prefetch_related('productimage_set')
+        return queryset
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['expand'] = self.get_expand()
+        return context
+
+    def get_serializer_class(self):
+        if self.use_read_serializer():
+            return ProductReadSerializer
+        if self.get_expand():
+            return ProductExpandSerializer
+        if self.action and self.action.startswith('bulk_'):
+            return ProductBulkSerializer
+        return super().get_serializer_class()
+
+    @action(detail=False, pagination_class=ProductPageNumberPagination)
+    def search(self, request):
+        return self.cached_response(request, self.get_search_response)
+
+    def get_search_response(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            raise ValidationError({'q': ['This query parameter is required.']})
+
+        results = search_products(self.get_queryset(), query)
+        page = self.paginate_queryset(results)
+        if not isinstance(results, QuerySet):
+            # the token index only gives ids, fetch the current page in rank order
+            products = self.get_queryset().in_bulk(page)
+            page = [products[product_id] for product_id in page if product_id in products]
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk_create(self, request):
+        """
+        Creates every valid product of a list, answering with one result per
+        item, with the id of each created product.
+        """
+        items = self.get_bulk_items(request)
+        serializer = self.get_serializer(data=items, many=True)
+        results = [None] * len(items)
+        valid = []
+        for index, item in enumerate(items):
+            attrs = self.validate_bulk_item(serializer, item, results, index)
+            if attrs is not None:
+                valid.append((index, Product(**attrs)))
+
+        products = [product for _, product in valid]
+        for batch in self.get_bulk_batches(products):
+            with transaction.atomic():
+                created_after = get_last_pk(Product)
+                Product.objects.bulk_create(batch)
+                # bulk_create only sets them on Postgres
+                set_created_pks(Product, batch, created_after)
+                bulk_saved.send(sender=Product, objs=batch, created=True,
+                                created_after=created_after)
+        for index, product in valid:
+            results[index] = {'status': status.HTTP_201_CREATED, 'id': product.pk}
+        return self.get_bulk_response(results, status.HTTP_201_CREATED)
+
+    @bulk_create.mapping.put
+    def bulk_update(self, request):
+        return self.perform_bulk_update(request, partial=False)
+
+    @bulk_create.mapping.patch
+    def bulk_partial_update(self, request):
+        return self.perform_bulk_update(request, partial=True)
+
+    @bulk_create.mapping.delete
+    def bulk_destroy(self, request):
+        ids = self.get_bulk_items(request)
+        results = [None] * len(ids)
+        for index, product_id in enumerate(ids):
+            if not self.is_bulk_id(product_id):
+                results[index] = {'status': status.HTTP_400_BAD_REQUEST,
+                                  'errors': {'id': ['A valid integer is required.']}}
+
+        valid_ids = [product_id for product_id in ids if self.is_bulk_id(product_id)]
+        deleted = set()
+        for batch in self.get_bulk_batches(valid_ids):
+            with transaction.atomic():
+                queryset = Product.objects.filter(id__in=batch)
+                deleted.update(queryset.values_list('id', flat=True))
+                with bulk_deleting():
+                    queryset.delete()
+        for index, product_id in enumerate(ids):
+            if results[index] is None:
+                code = (status.HTTP_204_NO_CONTENT if product_id in deleted
+                        else status.HTTP_404_NOT_FOUND)
+                results[index] = {'status': code, 'id': product_id}
+        return self.get_bulk_response(results, status.HTTP_200_OK)
+
+    def perform_bulk_update(self, request, partial):
+        items = self.get_bulk_items(request)
+        results = [None] * len(items)
+        ids = [item.get('id') if isinstance(item, dict) else None for item in items]
+        products = Product.objects.in_bulk(
+            [product_id for product_id in ids if self.is_bulk_id(product_id)])
+        serializer = self.get_serializer(data=items, many=True, partial=partial)
+
+        changed = {}
+        # bulk_update skips auto_now
+        fields = {'updated'}
+        now = timezone.now()
+        for index, (product_id, item) in enumerate(zip(ids, items)):
+            if not self.is_bulk_id(product_id):
+                results[index] = {'status': status.HTTP_400_BAD_REQUEST,
+                                  'errors': {'id': ['A valid integer is required.']}}
+                continue
+            if product_id not in products:
+                results[index] = {'status': status.HTTP_404_NOT_FOUND, 'id': product_id}
+                continue
+            attrs = self.validate_bulk_item(serializer, item, results, index)
+            if attrs is None:
+                continue
+            product = products[product_id]
+            for attr, value in attrs.items():
+                setattr(product, attr, value)
+            product.updated = now
+            changed[product_id] = product
+            fields.update(attrs)
+            results[index] = {'status': status.HTTP_200_OK, 'id': product_id}
+
+        for batch in self.get_bulk_batches(list(changed.values())):
+            with transaction.atomic():
+                bulk_update(batch, fields, batch_size=self.bulk_batch_size)
+                bulk_saved.send(sender=Product, objs=batch, created=False)
+        return self.get_bulk_response(results, status.HTTP_200_OK)
+
+    def is_bulk_id(self, value):
+        # JSON true and false are parsed as bools, which are ints too
+        return isinstance(value, int) and not isinstance(value, bool)
+
+    def get_bulk_items(self, request):
+        if not isinstance(request.data, list):
+            raise ValidationError({'non_field_errors': [
+                'Expected a list of items but got type "{}".'.format(
+                    type(request.data).__name__)]})
+        return request.data
+
+    def get_bulk_batches(self, objs):
+        for start in range(0, len(objs), self.bulk_batch_size):
+            yield objs[start:start + self.bulk_batch_size]
+
+    def validate_bulk_item(self, serializer, item, results, index):
+        """Returns validated attrs of item, or records its errors in results"""
+        try:
+            return serializer.child.run_validation(item)
+        except ValidationError as exc:
+            results[index] = {'status': status.HTTP_400_BAD_REQUEST, 'errors': exc.detail}
+
+    def get_bulk_response(self, results, success_status):
+        failed = any(result['status'] >= 400 for result in results)
+        return Response(results, status=status.HTTP_207_MULTI_STATUS if failed else success_status)
+
+    @action(detail=False)
+    def export(self, request):
+        """
+        Streams the whole catalog, oldest first, as NDJSON or, with
+        `?output=csv`, as CSV. `?since=<datetime>` only exports products
+        created after that watermark.
+        """
+        output = request.query_params.get('output', 'ndjson')
+        if output not in ['ndjson', 'csv']:
+            raise ValidationError({'output': ['Must be either ndjson or csv.']})
+
+        # pinned to the database routed to now, while use_replica() is on,
+        # since the rows are only read once dispatch returned the response
+        queryset = Product.objects.order_by('created', 'id')
+        queryset = queryset.using(queryset.db)
+        since = request.query_params.get('since')
+        if since:
+            try:
+                since = parse_datetime(since)
+            except ValueError:
+                since = None
+            if since is None:
+                raise ValidationError({'since': ['A valid ISO 8601 datetime is required.']})
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since, timezone.utc)
+            queryset = queryset.filter(created__gt=since)
+
+        rows = queryset.values_list(
+            *ProductReadSerializer.get_columns(), named=True
+        ).iterator(chunk_size=self.export_chunk_size)
+        if output == 'csv':
+            content, content_type = self.export_csv(rows), 'text/csv; charset=utf-8'
+        else:
+            content, content_type = self.export_ndjson(rows), 'application/x-ndjson'
+
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = 'attachment; filename="products.{}"'.format(output)
+        return response
+
+    def export_chunks(self, rows, format_row):
+        serializer = ProductReadSerializer()
+        chunk = []
+        for row in rows:
+            chunk.append(format_row(serializer.to_representation(row)))
+            if len(chunk) == self.export_chunk_size:
+                yield ''.join(chunk)
+                chunk = []
+        if chunk:
+            yield ''.join(chunk)
+
+    def export_ndjson(self, rows):
+        def format_row(product):
+            # same escaping of line separators as rest_framework's JSONRenderer
+            line = json.dumps(product, ensure_ascii=False, separators=(',', ':'))
+            return line.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029') + '\n'
+        return self.export_chunks(rows, format_row)
+
+    def export_csv(self, rows):
+        class Echo(object):
+            def write(self, value):
+                return value
+
+        writer = csv.writer(Echo())
+        fields = [field.field_name for field in ProductReadSerializer.get_model_fields()]
+
+        def format_value(value):
+            # keep JSON spellings so both formats read the same
+            if value is None:
+                return ''
+            if isinstance(value, bool):
+                return 'true' if value else 'false'
+            return value
+
+        def format_row(product):
+            return writer.writerow([format_value(value) for value in product.values()])
+
+        yield writer.writerow(fields)
+        yield from self.export_chunks(rows, format_row)
+
+
+class CategoryViewSet(RequestProfileMixin, CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
+    serializer_class = CategorySerializer
+    queryset = Category.objects.order_by('id')
+    permission_classes = [IsAuthenticated, IsNotHacker]
+
+    @action(detail=False, pagination_class=None)
+    def stats(self, request):
+        """
+        Product count, featured count and min, max and average price of every
+        category, in one page, read from the CategoryStats table rather than
+        from the products.
+        """
+        return self.cached_response(request, self.get_stats_response)
+
+    def get_stats_response(self, request):
+        queryset = self.get_queryset().select_related('stats')
+        return Response(CategoryStatsSerializer(queryset, many=True).data)
+
+
+class ChangeListView(RequestProfileMixin, APIView):
+    """
+    Creates, updates and deletes of categories, products and images, in
+    the order they committed, with the current state of each object.
+
+    Clients sync with `?after=<last_seq>` until `has_more` is false, from
+    seq 0 the first time. Up to `limit` changes are returned at once.
+    Clients that fall behind compaction get a 410 and start over from 0.
+    """
+    permission_classes = [IsAuthenticated, IsNotHacker]
+    default_limit = 100
+    max_limit = 1000
+    # seq is a bigint on Postgres
+    max_seq = 2 ** 63 - 1
+
+    def get(self, request):
+        after = self.get_int_param(request, 'after', 0, min_value=0, max_value=self.max_seq)
+        limit = min(self.get_int_param(request, 'limit', self.default_limit, min_value=1),
+                    self.max_limit)
+        if 0 < after < get_compaction_horizon():
+            return Response(
+                {'detail': 'Changes after {} were compacted, sync again from 0.'.format(after)},
+                status=status.HTTP_410_GONE)
+
+        changes = list(Change.objects.filter(seq__gt=after).order_by('seq')[:limit + 1])
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+
+        ids = {}
+        for change in changes:
+            ids.setdefault(change.model, set()).add(change.object_id)
+        objects = {
+            model._meta.model_name: model.objects.in_bulk(ids[model._meta.model_name])
+            for model in LOGGED_MODELS if model._meta.model_name in ids
+        }
+        serializer = ChangeSerializer(changes, many=True, context={
+            'request': request, 'objects': objects})
+        return Response({
+            'results': serializer.data,
+            'last_seq': changes[-1].seq if changes else after,
+            'has_more': has_more,
+        })
+
+    def get_int_param(self, request, name, default, **kwargs):
+        field = serializers.IntegerField(**kwargs)
+        try:
+            return field.run_validation(request.query_params.get(name, default))
+        except ValidationError as error:
+            raise ValidationError({name: error.detail})
+
+
+class MetricsView(APIView):
+    """Metrics of this process in the Prometheus text format"""
+    permission_classes = [IsAuthenticated, IsAdminUser]
+    renderer_classes = [PlainTextRenderer]
+
+    def get(self, request):
+        return Response(render_metrics())
+
+
+class ProfileListView(APIView):
+    """Request profiles kept by InstrumentationMiddleware, newest first"""
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def get(self, request):
+        return Response(profiles.list())
+
+
+class ProfileDetailView(APIView):
+    """cProfile statistics of one request, sorted by cumulative time"""
+    permission_classes = [IsAuthenticated, IsAdminUser]
+    renderer_classes = [PlainTextRenderer]
+
+    def get(self, request, profile_id):
+        profile = profiles.get(profile_id)
+        if profile is None:
+            raise NotFound()
+        return Response(profile['stats'])
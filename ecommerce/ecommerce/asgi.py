@@ -0,0 +1,23 @@
+"""
+ASGI config for ecommerce project.
+
+It exposes the ASGI callable as a module-level variable named ``application``,
+served by uvicorn workers with:
+
+    GUNICORN_WORKER_CLASS=uvicorn gunicorn -c gunicorn.conf.py ecommerce.asgi
+"""
+
+import os
+
+import django
+from django.urls import get_resolver
+
+from ecommerce.handlers import ASGIHandler
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce.settings.prod')
+django.setup(set_prefix=False)
+
+application = ASGIHandler()
+
+# Same as in wsgi.py, load every view before the first request
+get_resolver().url_patterns
@@ -0,0 +1,163 @@
+import os
+import threading
+import time
+
+import psycopg2
+from django.db.backends.postgresql import base
+from psycopg2 import extensions, pool
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class BlockingConnectionPool(pool.ThreadedConnectionPool):
+    """
+    ThreadedConnectionPool whose getconn waits up to `timeout` seconds for a
+    connection to be given back, rather than failing as soon as every one
+    of them is in use.
+
+    A connection idle in the pool for `health_check_interval` seconds or
+    more is pinged with `SELECT 1` before it is handed out, and replaced if
+    the server dropped it meanwhile, which psycopg2 only notices on use.
+    """
+
+    def __init__(self, minconn, maxconn, *args, timeout=10, health_check_interval=None,
+                 **kwargs):
+        self._returned = {}
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._lock = threading.Condition(self._lock)
+
+    def getconn(self, key=None):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            conn, returned = self._wait_for_conn(key, deadline)
+            if self.is_healthy(conn, returned):
+                return conn
+            self.putconn(conn, key, close=True)
+
+    def _wait_for_conn(self, key, deadline):
+        with self._lock:
+            while True:
+                try:
+                    conn = self._getconn(key)
+                    return conn, self._returned.pop(id(conn), None)
+                except pool.PoolError:
+                    if self.closed:
+                        raise
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise psycopg2.OperationalError(
+                        'No connection was given back to the pool within {}s'.format(
+                            self.timeout))
+                self._lock.wait(remaining)
+
+    def is_healthy(self, conn, returned):
+        if conn.closed:
+            return False
+        interval = self.health_check_interval
+        if returned is None or interval is None or time.monotonic() - returned < interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    def putconn(self, conn=None, key=None, close=False):
+        with self._lock:
+            self._putconn(conn, key, close)
+            if close or conn.closed:
+                self._returned.pop(id(conn), None)
+            else:
+                self._returned[id(conn)] = time.monotonic()
+            self._lock.notify()
+
+
+def get_pool(alias, settings_dict, conn_params):
+    """
+    Returns the connection pool of `alias` for the current process.
+
+    Pools are keyed by pid as well, so a gunicorn worker forked from a
+    preloaded master never shares sockets with its parent or siblings.
+    """
+    key = (alias, os.getpid())
+    with _pools_lock:
+        if key not in _pools:
+            config = settings_dict['POOL']
+            _pools[key] = BlockingConnectionPool(
+                config.get('MIN_SIZE', 0), config['MAX_SIZE'],
+                timeout=config.get('TIMEOUT', 10),
+                health_check_interval=settings_dict.get('HEALTH_CHECK_INTERVAL'),
+                **conn_params)
+        return _pools[key]
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    PostgreSQL backend with health checked connection reuse and an optional
+    in-process connection pool.
+
+    Besides the stock options, the DATABASES entry accepts:
+
+    - `HEALTH_CHECK_INTERVAL`: seconds a persistent or pooled connection may
+      sit idle before it is pinged with `SELECT 1` at the start of the next
+      request or when borrowed from the pool, instead of failing that
+      request with a dropped socket.
+    - `POOL`: a dict with `MAX_SIZE` and optionally `MIN_SIZE` and `TIMEOUT`.
+      Connections are then borrowed from a pool shared by the threads of the
+      process and given back when Django closes them, which should happen at
+      the end of every request (CONN_MAX_AGE = 0). A thread finding every
+      connection in use waits up to TIMEOUT seconds for one, then fails
+      with OperationalError.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.last_checked = time.monotonic()
+
+    @property
+    def pool(self):
+        if not self.settings_dict.get('POOL'):
+            return None
+        return get_pool(self.alias, self.settings_dict, self.get_connection_params())
+
+    def get_new_connection(self, conn_params):
+        connection_pool = self.pool
+        if connection_pool is None:
+            return super().get_new_connection(conn_params)
+
+        connection = connection_pool.getconn()
+        options = self.settings_dict['OPTIONS']
+        self.isolation_level = options.get('isolation_level', connection.isolation_level)
+        if self.isolation_level != connection.isolation_level:
+            connection.set_session(isolation_level=self.isolation_level)
+        return connection
+
+    def _close(self):
+        connection_pool = self.pool
+        if connection_pool is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            connection = self.connection
+            broken = bool(connection.closed) or (self.errors_occurred and not self.is_usable())
+            if (not broken and connection.get_transaction_status() !=
+                    extensions.TRANSACTION_STATUS_IDLE):
+                connection.rollback()
+            connection_pool.putconn(connection, close=broken)
+
+    def close_if_unusable_or_obsolete(self):
+        # called when a request starts and when it finishes, so the time since
+        # the last call is how long the connection sat idle between requests
+        super().close_if_unusable_or_obsolete()
+        now = time.monotonic()
+        idle, self.last_checked = now - self.last_checked, now
+        interval = self.settings_dict.get('HEALTH_CHECK_INTERVAL')
+        if self.connection is not None and interval is not None and idle >= interval:
+            if not self.is_usable():
+                self.close()
@@ -0,0 +1,45 @@
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+_state = threading.local()
+
+
+@contextmanager
+def use_replica():
+    """Routes reads made by the current thread to the replica, if any"""
+    previous = getattr(_state, 'replica', False)
+    _state.replica = True
+    try:
+        yield
+    finally:
+        _state.replica = previous
+
+
+class ReplicaRouter(object):
+    """
+    Sends reads of `replica_apps` models to the `replica` database, but only
+    inside `use_replica()` blocks, so anything that has to read its own
+    writes (admin, authentication, bulk endpoints) stays on the primary.
+    """
+    replica_alias = 'replica'
+    replica_apps = ('products',)
+
+    def db_for_read(self, model, **hints):
+        if (getattr(_state, 'replica', False) and
+                model._meta.app_label in self.replica_apps and
+                self.replica_alias in settings.DATABASES):
+            return self.replica_alias
+        return None
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replica holds the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != self.replica_alias
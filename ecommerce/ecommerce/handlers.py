@@ -0,0 +1,81 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+class ASGIHandler(WsgiToAsgi):
+    """
+    Serves the project over ASGI, for uvicorn.
+
+    Django 2.1 has no async views, so asgiref's WsgiToAsgi runs every
+    request through the regular WSGI handler, middleware, authentication and
+    permission classes. The event loop buffers request bodies before a
+    thread is taken. Views then run in a pool of `ASGI_THREADS` threads,
+    which bounds the database connections a worker opens, instead of
+    asgiref's default single thread shared by every request.
+    """
+
+    def __init__(self):
+        super().__init__(WSGIHandler())
+        # threads are only started on the first request, so none exist yet
+        # when gunicorn forks a preloaded application
+        self.executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'ASGI_THREADS', None), thread_name_prefix='asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+
+        async def receive_request():
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                raise ClientDisconnected
+            return message
+
+        instance = ASGIHandlerInstance(self.wsgi_application, self.executor)
+        try:
+            await instance(scope, receive_request, send)
+        except ClientDisconnected:
+            pass
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+class ASGIHandlerInstance(WsgiToAsgiInstance):
+
+    def __init__(self, wsgi_application, executor):
+        super().__init__(self.closing(wsgi_application))
+        self.executor = executor
+
+    async def run_wsgi_app(self, body):
+        # the same function, without the thread_sensitive decorator
+        run = WsgiToAsgiInstance.__dict__['run_wsgi_app'].func
+        await sync_to_async(run, thread_sensitive=False, executor=self.executor)(self, body)
+
+    @staticmethod
+    def closing(wsgi_application):
+        # asgiref 3.4 never closes the response, and request_finished, which
+        # releases the database connection of the thread that ran the view,
+        # is sent on close
+        def application(environ, start_response):
+            response = wsgi_application(environ, start_response)
+            try:
+                yield from response
+            finally:
+                response.close()
+        return application
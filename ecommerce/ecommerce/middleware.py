@@ -0,0 +1,56 @@
+"""
+Browser oriented middleware that steps aside for API requests.
+
+API clients authenticate with tokens, basic auth or APIClient keys on every
+request, so sessions, CSRF cookies, messages and user loading are pure
+overhead under `API_PATH_PREFIXES`. Everything else, the admin included,
+goes through the stock Django middleware.
+"""
+from django.conf import settings
+from django.contrib.auth import middleware as auth_middleware
+from django.contrib.messages import middleware as messages_middleware
+from django.contrib.sessions import middleware as sessions_middleware
+from django.middleware import clickjacking, csrf
+
+
+def is_api_request(request):
+    return request.path_info.startswith(getattr(settings, 'API_PATH_PREFIXES', ('/api/',)))
+
+
+class APIExemptMixin(object):
+    """Calls straight through to the next middleware for API requests"""
+
+    def __call__(self, request):
+        if is_api_request(request):
+            return self.get_response(request)
+        return super().__call__(request)
+
+
+class SessionMiddleware(APIExemptMixin, sessions_middleware.SessionMiddleware):
+    pass
+
+
+class CsrfViewMiddleware(APIExemptMixin, csrf.CsrfViewMiddleware):
+
+    def process_view(self, request, callback, callback_args, callback_kwargs):
+        if is_api_request(request):
+            return None
+        return super().process_view(request, callback, callback_args, callback_kwargs)
+
+
+class AuthenticationMiddleware(APIExemptMixin, auth_middleware.AuthenticationMiddleware):
+    pass
+
+
+class MessageMiddleware(APIExemptMixin, messages_middleware.MessageMiddleware):
+    pass
+
+
+class XFrameOptionsMiddleware(clickjacking.XFrameOptionsMiddleware):
+    # the browsable API is still HTML that a browser holding basic auth
+    # credentials could be tricked into framing
+    def process_response(self, request, response):
+        if (is_api_request(request) and
+                not response.get('Content-Type', '').startswith('text/html')):
+            return response
+        return super().process_response(request, response)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/2.1/ref/settings/
 """
 
+import importlib.util
 import os
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -49,15 +50,47 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'api.middleware.CompressionMiddleware',
+    'ecommerce.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'ecommerce.middleware.CsrfViewMiddleware',
+    'ecommerce.middleware.AuthenticationMiddleware',
+    'ecommerce.middleware.MessageMiddleware',
+    'ecommerce.middleware.XFrameOptionsMiddleware',
 ]
 
+# Timings of API requests, see api/middleware.py. PROFILE_SAMPLE_RATE is
+# the fraction of requests run under cProfile, the last PROFILE_BUFFER_SIZE
+# profiles are listed to admins at /api/metrics/profiles/.
+INSTRUMENTATION = {
+    'SERVER_TIMING': True,
+    'PROFILE_SAMPLE_RATE': 0.0,
+    'PROFILE_BUFFER_SIZE': 20,
+}
+
+# Compression of API responses, see api/middleware.py. Static files are
+# compressed ahead of time by collectstatic instead. Levels trade CPU for
+# bytes, `make bench_compression` measures both on product pages.
+RESPONSE_COMPRESSION = {
+    'ENCODINGS': ('br', 'gzip'),
+    'MIN_SIZE': 1024,
+    'GZIP_LEVEL': 6,
+    'BROTLI_QUALITY': 4,
+    'CONTENT_TYPES': (
+        'application/json',
+        'application/x-ndjson',
+        'text/csv',
+        'text/plain',
+    ),
+}
+
+# Requests under these paths skip the session, CSRF, authentication and
+# messages middleware, see ecommerce/middleware.py
+API_PATH_PREFIXES = ('/api/',)
+
 ROOT_URLCONF = 'ecommerce.urls'
 
 TEMPLATES = [
@@ -131,13 +164,69 @@ STATIC_ROOT = os.path.join(PROJECT_DIR, 'staticfiles')
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.BasicAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
-        'api.authentication.APIClientAuthentication',
+        'api.authentication.DispatchingAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'rest_framework.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 3
 }
+
+# Clients get MessagePack with `Accept: application/msgpack` and may send it
+# with `Content-Type: application/msgpack`, when msgpack is installed.
+# FastJSONRenderer falls back to the stdlib json without orjson.
+if importlib.util.find_spec('msgpack') is not None:
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] += ('api.renderers.MessagePackRenderer',)
+    REST_FRAMEWORK['DEFAULT_PARSER_CLASSES'] += ('api.renderers.MessagePackParser',)
+
+# Resolved APIClient credentials are kept in an in-process LRU, unknown
+# ones for NEGATIVE_TTL seconds. Other processes only see a client saved or
+# deleted once TTL expires, unless BACKEND is an alias from CACHES shared by
+# all of them, see prod.py.
+API_CLIENT_CACHE = {
+    'TTL': 60,
+    'NEGATIVE_TTL': 10,
+    'MAX_SIZE': 1024,
+    'BACKEND': None,
+}
+
+# Resolved auth tokens, same keys as API_CLIENT_CACHE. A token deleted, or
+# its user deactivated, keeps working in other processes for up to TTL
+# seconds without a shared BACKEND, and in every process if it was done
+# through queryset.update(), which sends no signals. Last use of each
+# token is recorded in memory and written at most every
+# TOKEN_USAGE_FLUSH_INTERVAL seconds, once a response has been sent.
+API_TOKEN_CACHE = {
+    'TTL': 60,
+    'MAX_SIZE': 4096,
+    'BACKEND': None,
+}
+TOKEN_USAGE_FLUSH_INTERVAL = 60
+
+# Verified basic auth credentials, keyed by an HMAC under SECRET_KEY. Other
+# processes only see a password change once TTL expires, unless BACKEND is
+# shared by all of them (see TieredCache), so keep it short.
+API_BASIC_AUTH_CACHE = {
+    'TTL': 30,
+    'MAX_SIZE': 1024,
+    'BACKEND': None,
+}
+
+# List and detail responses of the products API are cached under the
+# catalog version, which is bumped whenever a product, category or image
+# changes. BACKEND is an alias from CACHES, or None to disable caching.
+# With several processes it has to be shared by all of them, see prod.py.
+API_RESPONSE_CACHE = {
+    'TIMEOUT': 300,
+    'BACKEND': 'default',
+}
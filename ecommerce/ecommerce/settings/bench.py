@@ -0,0 +1,16 @@
+import os
+from .prod import *
+
+
+# Settings for `make bench`, which flushes and reseeds the database, so it
+# never touches the development one. Point DATABASE_URL at a scratch
+# Postgres database to benchmark against Postgres instead.
+BENCHMARK = True
+DEBUG = False
+
+if not os.getenv('DATABASE_URL'):
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'bench.sqlite3'),
+        'OPTIONS': {'timeout': 30},
+    }
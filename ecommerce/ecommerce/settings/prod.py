@@ -9,4 +9,83 @@ SECRET_KEY = os.getenv(
     '^8ai-6gb!yyg19uangdahsi8a%c=)mb0xler7%0klh1mz!^snago;91_')
 
 
-# YOUR CODE HERE
+# Static files
+# collectstatic writes content hashed copies of every file, plus .gz and .br
+# (with the brotli package) variants where compression pays off. WhiteNoise
+# serves hashed names with a far-future immutable Cache-Control and picks
+# the variant from Accept-Encoding, so nothing is compressed per request.
+STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+
+
+# Cache
+# Cached responses, and the catalog version they are keyed by, have to be
+# shared by every worker, or a write handled by one of them leaves the others
+# serving stale bodies. They are kept in Redis at REDIS_URL (set by Heroku
+# Redis), and responses are not cached at all without it. Resolved API
+# clients, tokens and basic auth credentials are shared there too, so
+# deactivating one reaches every worker.
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+    API_CLIENT_CACHE = dict(API_CLIENT_CACHE, BACKEND='default')
+    API_TOKEN_CACHE = dict(API_TOKEN_CACHE, BACKEND='default')
+    API_BASIC_AUTH_CACHE = dict(API_BASIC_AUTH_CACHE, BACKEND='default')
+else:
+    API_RESPONSE_CACHE = dict(API_RESPONSE_CACHE, BACKEND=None)
+
+
+# Threads of each ASGI worker running views, see ecommerce/handlers.py.
+# Like GUNICORN_THREADS, it bounds the database connections of a worker.
+ASGI_THREADS = int(os.getenv('ASGI_THREADS', 8))
+
+
+# Database
+# DATABASE_URL (set by Heroku Postgres) replaces the SQLite default. Without
+# a pool, connections persist for DATABASE_CONN_MAX_AGE seconds and are
+# pinged before reuse once idle for DATABASE_HEALTH_CHECK_INTERVAL seconds.
+# By default, connections are borrowed from an in-process pool instead,
+# sized to the threads of a worker (ASGI_THREADS for uvicorn workers,
+# GUNICORN_THREADS otherwise), so the connections opened are bounded by
+# workers * DATABASE_POOL_MAX_SIZE. Threads wait up to DATABASE_POOL_TIMEOUT
+# seconds for a connection when all of them are in use, and connections idle
+# in the pool for the health check interval are pinged before being handed
+# out. Set DATABASE_POOL_MAX_SIZE to 0 to disable the pool.
+
+POSTGRES_ENGINE = 'ecommerce.db.backends.postgresql'
+WORKER_THREADS = (ASGI_THREADS if os.getenv('GUNICORN_WORKER_CLASS') == 'uvicorn'
+                  else int(os.getenv('GUNICORN_THREADS', 4)))
+DATABASE_POOL_MAX_SIZE = int(os.getenv('DATABASE_POOL_MAX_SIZE', WORKER_THREADS))
+
+
+def database_config(url):
+    config = dj_database_url.parse(
+        url, conn_max_age=int(os.getenv('DATABASE_CONN_MAX_AGE', 600)))
+    if config['ENGINE'] == 'django.db.backends.postgresql_psycopg2':
+        config['ENGINE'] = POSTGRES_ENGINE
+        config['HEALTH_CHECK_INTERVAL'] = int(os.getenv('DATABASE_HEALTH_CHECK_INTERVAL', 30))
+        if DATABASE_POOL_MAX_SIZE:
+            config['CONN_MAX_AGE'] = 0
+            config['POOL'] = {
+                'MIN_SIZE': int(os.getenv('DATABASE_POOL_MIN_SIZE', 0)),
+                'MAX_SIZE': DATABASE_POOL_MAX_SIZE,
+                'TIMEOUT': float(os.getenv('DATABASE_POOL_TIMEOUT', 10)),
+            }
+    return config
+
+
+if os.getenv('DATABASE_URL'):
+    DATABASES['default'] = database_config(os.environ['DATABASE_URL'])
+
+# GETs of ProductViewSet read products from DATABASE_REPLICA_URL, when set.
+# Cached responses are not stored until the catalog has been unchanged for
+# DATABASE_REPLICA_MAX_LAG seconds, so a lagging replica can't pin stale data.
+if os.getenv('DATABASE_REPLICA_URL'):
+    DATABASES['replica'] = database_config(os.environ['DATABASE_REPLICA_URL'])
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+    DATABASE_ROUTERS = ['ecommerce.db.routers.ReplicaRouter']
+    API_RESPONSE_CACHE = dict(
+        API_RESPONSE_CACHE, SETTLE_TIME=int(os.getenv('DATABASE_REPLICA_MAX_LAG', 5)))
@@ -10,8 +10,13 @@ https://docs.djangoproject.com/en/2.1/howto/deployment/wsgi/
 import os
 
 from django.core.wsgi import get_wsgi_application
-from whitenoise.django import DjangoWhiteNoise
+from django.urls import get_resolver
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce.settings.prod')
 
-application = DjangoWhiteNoise(get_wsgi_application())
+application = get_wsgi_application()
+
+# Import every view, serializer and authentication class now rather than on
+# the first request. With gunicorn's preload_app this happens once in the
+# master and the workers inherit the loaded modules.
+get_resolver().url_patterns
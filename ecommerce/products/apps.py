@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class ProductsConfig(AppConfig):
     name = 'products'
+
+    def ready(self):
+        # the change log, category stats and search vectors are written from
+        # within the transaction of each catalog write
+        from products import signals  # noqa: F401
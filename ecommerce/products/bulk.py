@@ -0,0 +1,30 @@
+from django.db import connections
+from django.db.models import Case, Value, When
+
+
+def bulk_update(objs, fields, batch_size=None, using='default'):
+    """
+    Saves `fields` of every object in objs with one UPDATE per batch.
+
+    Backport of QuerySet.bulk_update from Django 2.2, which sets each column
+    through a CASE on the primary key.
+    """
+    if not objs:
+        return
+    model = type(objs[0])
+    fields = [model._meta.get_field(name) for name in fields]
+    max_batch_size = connections[using].ops.bulk_batch_size(
+        ['pk', 'pk'] + fields, objs)
+    batch_size = min(batch_size, max_batch_size) if batch_size else max_batch_size
+
+    for start in range(0, len(objs), batch_size):
+        batch = objs[start:start + batch_size]
+        updates = {}
+        for field in fields:
+            whens = [
+                When(pk=obj.pk, then=Value(getattr(obj, field.attname), output_field=field))
+                for obj in batch
+            ]
+            updates[field.attname] = Case(*whens, output_field=field)
+        model._default_manager.using(using).filter(
+            pk__in=[obj.pk for obj in batch]).update(**updates)
@@ -0,0 +1,106 @@
+from collections import defaultdict, deque
+
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from products.models import Category, Change, ChangeCompaction, Product, ProductImage
+
+
+# lets one transaction at a time write to the log on Postgres, held until it
+# commits, so a change is never visible before one with a lower seq
+CHANGE_LOG_LOCK_ID = 4242
+
+LOGGED_MODELS = (Category, Product, ProductImage)
+
+# columns telling apart objects from bulk_create, which only sets their
+# primary keys on Postgres, from the other rows of the same batch
+NATURAL_KEYS = {
+    Category: ('name',),
+    Product: ('sku',),
+    ProductImage: ('product_id', 'url'),
+}
+
+
+def record_changes(model, object_ids, action):
+    """Logs action on the given objects of model, in the current transaction"""
+    if not object_ids:
+        return
+    with transaction.atomic(savepoint=False):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_xact_lock(%s)', [CHANGE_LOG_LOCK_ID])
+        now = timezone.now()
+        Change.objects.bulk_create([
+            Change(model=model._meta.model_name, object_id=object_id, action=action,
+                   timestamp=now)
+            for object_id in object_ids
+        ])
+
+
+def get_last_pk(model):
+    """
+    Returns the highest primary key of model before a bulk_create, to send
+    as created_after with bulk_saved. None where bulk_create sets them.
+    """
+    if connection.features.can_return_ids_from_bulk_insert:
+        return None
+    return model.objects.aggregate(pk=Max('pk'))['pk'] or 0
+
+
+def set_created_pks(model, objs, created_after=None):
+    """
+    Sets the primary keys bulk_create left unset on objs, looking them up by
+    natural key among the rows created after the primary key created_after,
+    so older rows sharing a sku are left out. Objects sharing a key get
+    their rows in insertion order.
+    """
+    missing = [obj for obj in objs if obj.pk is None]
+    if not missing:
+        return
+    fields = NATURAL_KEYS[model]
+    rows = model.objects.filter(**{
+        'pk__gt': created_after or 0,
+        '{}__in'.format(fields[0]): {getattr(obj, fields[0]) for obj in missing},
+    }).order_by('pk').values_list('pk', *fields)
+    pks = defaultdict(deque)
+    for row in rows:
+        pks[tuple(row[1:])].append(row[0])
+    for obj in missing:
+        key = tuple(getattr(obj, field) for field in fields)
+        if pks[key]:
+            obj.pk = pks[key].popleft()
+
+
+def get_object_ids(model, objs, created_after=None):
+    """Returns the primary keys of objs, see set_created_pks"""
+    set_created_pks(model, objs, created_after)
+    return [obj.pk for obj in objs if obj.pk is not None]
+
+
+def get_compaction_horizon():
+    """Returns the highest seq of a purged tombstone, 0 if none was purged"""
+    return ChangeCompaction.objects.aggregate(seq=Max('purged_seq'))['seq'] or 0
+
+
+def compact_changes(tombstone_age):
+    """
+    Deletes every change superseded by a later one of the same object, and
+    tombstones older than tombstone_age, a timedelta. Clients that synced
+    after the last purged tombstone still end up with the same catalog,
+    while those that synced before it have to start over from seq 0.
+    Returns the ChangeCompaction recording the run.
+    """
+    with transaction.atomic():
+        latest = Change.objects.values('model', 'object_id').annotate(
+            last_seq=Max('seq')).values('last_seq')
+        deleted, _ = Change.objects.exclude(seq__in=latest).delete()
+
+        tombstones = Change.objects.filter(
+            action=Change.DELETED, timestamp__lt=timezone.now() - tombstone_age)
+        purged_seq = tombstones.aggregate(seq=Max('seq'))['seq']
+        if purged_seq is not None:
+            purged, _ = tombstones.filter(seq__lte=purged_seq).delete()
+            deleted += purged
+        return ChangeCompaction.objects.create(
+            deleted=deleted, purged_seq=max(purged_seq or 0, get_compaction_horizon()))
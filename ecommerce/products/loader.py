@@ -0,0 +1,253 @@
+import csv
+import json
+import time
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+
+from products.bulk import bulk_update
+from products.changes import get_last_pk
+from products.models import Category, Product, ProductImage
+from products.signals import bulk_saved
+
+
+PRODUCT_FIELDS = ('name', 'category_id', 'description', 'price', 'featured')
+TRUE_VALUES = ('true', '1', 'yes')
+
+
+class LoaderError(Exception):
+    pass
+
+
+def read_json(path, chunk_size=64 * 1024):
+    """Yields the objects of a JSON array file without reading it whole"""
+    decoder = json.JSONDecoder()
+    with open(path, encoding='utf-8') as fixture:
+        buffer = fixture.read(chunk_size).lstrip()
+        if not buffer.startswith('['):
+            raise LoaderError('{} does not contain a JSON array'.format(path))
+        buffer = buffer[1:]
+        eof = False
+        while True:
+            buffer = buffer.lstrip()
+            if buffer.startswith(','):
+                buffer = buffer[1:].lstrip()
+            if buffer.startswith(']'):
+                return
+            try:
+                record, end = decoder.raw_decode(buffer)
+            except ValueError:
+                if eof:
+                    raise LoaderError('{} is not a valid JSON array'.format(path))
+                chunk = fixture.read(chunk_size)
+                eof = not chunk
+                buffer += chunk
+                continue
+            yield record
+            buffer = buffer[end:]
+
+
+def read_ndjson(path):
+    with open(path, encoding='utf-8') as fixture:
+        for line in fixture:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_csv(path):
+    """Yields CSV rows as dicts, `images` holds whitespace separated urls"""
+    with open(path, encoding='utf-8', newline='') as fixture:
+        for row in csv.DictReader(fixture):
+            row['images'] = (row.get('images') or '').split()
+            yield row
+
+
+READERS = {
+    '.json': read_json,
+    '.ndjson': read_ndjson,
+    '.jsonl': read_ndjson,
+    '.csv': read_csv,
+}
+
+
+def synthetic_records(count, categories=('Shoes', 'Accessories', 'Clothing', 'Sports')):
+    """Yields `count` deterministic products, for load testing"""
+    for i in range(count):
+        yield {
+            'name': 'Product {}'.format(i),
+            'sku': '{:08d}'.format(i),
+            'category': categories[i % len(categories)],
+            'description': 'Synthetic product number {}'.format(i),
+            'price': Decimal(i * 7919 % 99999) / 100,
+            'featured': i % 10 == 0,
+        }
+
+
+def batched(records, size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class CatalogLoader(object):
+    """
+    Upserts products by SKU from an iterable of records.
+
+    Records are dicts with `name`, `sku`, `category` (a name) or
+    `category_id`, and optionally `description`, `price`, `featured` and
+    `images`, a list of urls. Records are written in batches with
+    bulk_create and bulk_update, and rows whose fields did not change are
+    not written at all. Missing categories are created and images are
+    only ever added. Call `load` inside a transaction to make a whole
+    import atomic, as the load_initial_data command does.
+    """
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self.categories = {}
+        self.pending_images = {}
+        self.stats = Counter()
+
+    def load(self, records):
+        for batch in batched(records, self.batch_size):
+            self.load_batch(batch)
+            self.stats['rows'] += len(batch)
+        return self.stats
+
+    def load_batch(self, records):
+        records = self.clean_records(records)
+        existing = {}
+        for product in Product.objects.filter(sku__in=list(records)).order_by('id'):
+            existing.setdefault(product.sku, product)
+
+        to_create, to_update = [], []
+        for sku, values in records.items():
+            product = existing.get(sku)
+            if product is None:
+                product = Product(sku=sku, **values)
+                to_create.append(product)
+            elif any(getattr(product, field) != value for field, value in values.items()):
+                for field, value in values.items():
+                    setattr(product, field, value)
+                to_update.append(product)
+            else:
+                self.stats['unchanged'] += 1
+
+        if to_create:
+            created_after = get_last_pk(Product)
+            Product.objects.bulk_create(to_create)
+            bulk_saved.send(sender=Product, objs=to_create, created=True,
+                            created_after=created_after)
+        if to_update:
+            now = timezone.now()
+            for product in to_update:
+                product.updated = now
+            bulk_update(to_update, PRODUCT_FIELDS + ('updated',), batch_size=self.batch_size)
+            bulk_saved.send(sender=Product, objs=to_update, created=False)
+        self.stats['created'] += len(to_create)
+        self.stats['updated'] += len(to_update)
+
+        self.add_images(records)
+
+    def clean_records(self, records):
+        """Returns the product values of records by sku, the last record wins"""
+        names = {record['category'] for record in records
+                 if record.get('category') and not record.get('category_id')}
+        self.resolve_categories(names)
+
+        cleaned = {}
+        for record in records:
+            sku = str(record.get('sku') or '').strip()
+            if not sku or not record.get('name'):
+                raise LoaderError('Every product needs a name and a sku: {}'.format(record))
+            category_id = record.get('category_id') or self.categories.get(record.get('category'))
+            if not category_id:
+                raise LoaderError('Product {} has no category'.format(sku))
+            try:
+                price = Decimal(str(record.get('price') or 0)).quantize(Decimal('0.01'))
+            except InvalidOperation:
+                raise LoaderError('Product {} has an invalid price'.format(sku))
+            featured = record.get('featured', False)
+            if isinstance(featured, str):
+                featured = featured.strip().lower() in TRUE_VALUES
+            price_field = Product._meta.get_field('price')
+            if len(price.as_tuple().digits) > price_field.max_digits:
+                raise LoaderError('Product {} has an invalid price'.format(sku))
+            for field in ['sku', 'name', 'description']:
+                max_length = Product._meta.get_field(field).max_length
+                if len(record.get(field) or '') > max_length:
+                    raise LoaderError('Product {} has a {} longer than {} characters'.format(
+                        sku, field, max_length))
+            cleaned[sku] = {
+                'name': record['name'],
+                'category_id': int(category_id),
+                'description': record.get('description') or '',
+                'price': price,
+                'featured': bool(featured),
+            }
+            images = record.get('images')
+            if images:
+                # a bare string would be split into one image per character
+                if not isinstance(images, (list, tuple)) or not all(
+                        isinstance(url, str) for url in images):
+                    raise LoaderError('Product {} images must be a list of urls'.format(sku))
+                self.pending_images[sku] = list(images)
+        return cleaned
+
+    def resolve_categories(self, names):
+        missing = names - set(self.categories)
+        if not missing:
+            return
+        for category in Category.objects.filter(name__in=missing).order_by('id'):
+            self.categories.setdefault(category.name, category.id)
+        missing -= set(self.categories)
+        if missing:
+            categories = [Category(name=name) for name in missing]
+            created_after = get_last_pk(Category)
+            Category.objects.bulk_create(categories)
+            bulk_saved.send(sender=Category, objs=categories, created=True,
+                            created_after=created_after)
+            # bulk_create only returns primary keys on Postgres
+            for category in Category.objects.filter(name__in=missing).order_by('id'):
+                self.categories.setdefault(category.name, category.id)
+
+    def add_images(self, records):
+        pending, self.pending_images = self.pending_images, {}
+        if not pending:
+            return
+        # ordered so the lowest id wins for duplicated skus, as in load_batch
+        product_ids = dict(
+            Product.objects.filter(sku__in=list(pending)).order_by('-id').values_list('sku', 'id'))
+        known = set(ProductImage.objects.filter(
+            product_id__in=product_ids.values()).values_list('product_id', 'url'))
+        images = [
+            ProductImage(product_id=product_ids[sku], url=url)
+            for sku, urls in pending.items() if sku in product_ids
+            for url in urls if (product_ids[sku], url) not in known
+        ]
+        if images:
+            created_after = get_last_pk(ProductImage)
+            ProductImage.objects.bulk_create(images)
+            bulk_saved.send(sender=ProductImage, objs=images, created=True,
+                            created_after=created_after)
+        self.stats['images'] += len(images)
+
+
+def load_catalog(records, batch_size=1000):
+    """
+    Loads records in a single transaction, returns (stats, seconds). On
+    Postgres the change log lock is held from the first write until it
+    commits, so every other catalog write waits for the whole load.
+    """
+    loader = CatalogLoader(batch_size=batch_size)
+    start = time.perf_counter()
+    with transaction.atomic():
+        stats = loader.load(records)
+    return stats, time.perf_counter() - start
@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from products.changes import compact_changes
+
+
+class Command(BaseCommand):
+    help = ('Compacts the change log served at /api/changes/, keeping only the '
+            'latest change of each object and dropping old tombstones')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tombstone-days', type=float, default=30,
+            help='Days deletes stay in the log, clients syncing less often start over')
+
+    def handle(self, *args, **options):
+        compaction = compact_changes(timedelta(days=options['tombstone_days']))
+        self.stdout.write('Deleted {} changes, tombstones purged up to seq {}'.format(
+            compaction.deleted, compaction.purged_seq))
@@ -1,71 +1,105 @@
-from django.conf import settings
+import os
+
 from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
+from products.loader import READERS, LoaderError, load_catalog, synthetic_records
 from products.models import Category, Product, ProductImage
+from products.signals import bulk_deleting
 from django.contrib.auth.models import User
 
 
+INITIAL_PRODUCTS = [
+    ('Nike Vapor', '44444444', 'Sports', 129.99, True),
+    ('Nike Cap', '33333333', 'Accessories', 27.99, True),
+    ('Diamond Necklace', '88888888', 'Accessories', 233, True),
+    ('Sweater', '55555555', 'Clothing', 49.99, True),
+    ('Socks', '11111111', 'Clothing', 8.99, False),
+    ('Jean', '22222222', 'Clothing', 39.99, False),
+    ('Rings', '66666666', 'Accessories', 19.99, False),
+    ('Shoes', '77777777', 'Shoes', 80.99, False),
+    ('Leggings', '99999999', 'Sports', 29.99, False),
+    ('Gloves', '10101010', 'Accessories', 29.99, False),
+]
+
+INITIAL_IMAGES = [
+    'https://images-na.ssl-images-amazon.com/images/I/61toIdeEdZL._UX695_.jpg',
+    'https://images-na.ssl-images-amazon.com/images/I/61-Rm5tfPML._UX679_.jpg',
+    'https://images-na.ssl-images-amazon.com/images/I/61x3zjjiDsL._UY695_.jpg',
+    'https://images-na.ssl-images-amazon.com/images/I/51DtYxTRVfL._SX679._SX._UX._SY._UY_.jpg',
+    'https://images-na.ssl-images-amazon.com/images/I/61t50Fa1WXL._SL1010_.jpg',
+    'https://images-na.ssl-images-amazon.com/images/I/815CjHgZClL._UY879_.jpg',
+    'https://images-na.ssl-images-amazon.com/images/I/71DfpJ8EatL._UX679_.jpg',
+    'https://images-na.ssl-images-amazon.com/images/I/81gVrGpMBKL._UY695_.jpg',
+    'https://images-na.ssl-images-amazon.com/images/I/613I3iAunmL._UX679_.jpg',
+    'https://images-na.ssl-images-amazon.com/images/I/71Wu3PZqRLL._UX679_.jpg'
+]
+
+
+def initial_records():
+    for (name, sku, category, price, featured), image in zip(INITIAL_PRODUCTS, INITIAL_IMAGES):
+        yield {'name': name, 'sku': sku, 'category': category, 'price': price,
+               'featured': featured, 'images': [image]}
+
+
 class Command(BaseCommand):
-    help = 'Imports initial data'
+    help = ('Loads products, upserting them by SKU. Without arguments loads '
+            'the initial catalog and the admin and test users.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'fixture', nargs='?',
+            help='JSON array, NDJSON or CSV file with the products to load')
+        parser.add_argument(
+            '--synthetic', type=int, metavar='N',
+            help='Load N generated products instead, for load testing')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--flush', action='store_true',
+            help='Delete every user, category and product first')
 
     def handle(self, *args, **options):
-        User.objects.all().delete()
-        Category.objects.all().delete()
-        Product.objects.all().delete()
-        ProductImage.objects.all().delete()
+        if options['fixture'] and options['synthetic']:
+            raise CommandError('Give either a fixture or --synthetic, not both')
 
-        User.objects.create_superuser(
-            username='admin', email='admin@example.com', password='admin')
-        user = User.objects.create(username='test', email='test@example.com')
-        user.set_password('test')
-        user.save()
+        if options['fixture']:
+            extension = os.path.splitext(options['fixture'])[1].lower()
+            if extension not in READERS:
+                raise CommandError('Fixtures must be one of: {}'.format(', '.join(READERS)))
+            records = READERS[extension](options['fixture'])
+        elif options['synthetic']:
+            records = synthetic_records(options['synthetic'])
+        else:
+            records = initial_records()
 
-        CATEGORIES = [
-            'Shoes', 'Accessories', 'Clothing', 'Sports'
-        ]
-        categories = []
-        for category in CATEGORIES:
-            c = Category.objects.create(name=category)
-            categories.append(c)
+        try:
+            # a load failing after --flush must not leave an empty catalog
+            with transaction.atomic():
+                if options['flush']:
+                    User.objects.all().delete()
+                    with bulk_deleting():
+                        Category.objects.all().delete()
+                        Product.objects.all().delete()
+                        ProductImage.objects.all().delete()
+                if not options['fixture'] and not options['synthetic']:
+                    self.create_users()
+                stats, seconds = load_catalog(records, batch_size=options['batch_size'])
+        except (LoaderError, OSError, ValueError) as exc:
+            raise CommandError(exc)
 
-        PRODUCTS = [
-            ('Nike Vapor', '44444444', categories[3], 129.99, True),
-            ('Nike Cap', '33333333', categories[1], 27.99, True),
-            ('Diamond Necklace', '88888888', categories[1], 233, True),
-            ('Sweater', '55555555', categories[2], 49.99, True),
-            ('Socks', '11111111', categories[2], 8.99, False),
-            ('Jean', '22222222', categories[2], 39.99, False),
-            ('Rings', '66666666', categories[1], 19.99, False),
-            ('Shoes', '77777777', categories[0], 80.99, False),
-            ('Leggings', '99999999', categories[3], 29.99, False),
-            ('Gloves', '99999999', categories[1], 29.99, False),
-        ]
-        products = []
-        for name, sku, category, price, featured in PRODUCTS:
-            p = Product.objects.create(
-                name=name,
-                sku=sku,
-                category=category,
-                price=price,
-                featured=featured
-            )
-            products.append(p)
+        self.stdout.write(
+            'Imported {rows} rows in {seconds:.2f}s ({rate:.0f} rows/sec): '
+            '{created} created, {updated} updated, {unchanged} unchanged, '
+            '{images} images added'.format(
+                seconds=seconds, rate=stats['rows'] / seconds if seconds else 0,
+                **{key: stats[key] for key in
+                   ['rows', 'created', 'updated', 'unchanged', 'images']}))
 
-        IMAGES = [
-            'https://images-na.ssl-images-amazon.com/images/I/61toIdeEdZL._UX695_.jpg',
-            'https://images-na.ssl-images-amazon.com/images/I/61-Rm5tfPML._UX679_.jpg',
-            'https://images-na.ssl-images-amazon.com/images/I/61x3zjjiDsL._UY695_.jpg',
-            'https://images-na.ssl-images-amazon.com/images/I/51DtYxTRVfL._SX679._SX._UX._SY._UY_.jpg',
-            'https://images-na.ssl-images-amazon.com/images/I/61t50Fa1WXL._SL1010_.jpg',
-            'https://images-na.ssl-images-amazon.com/images/I/815CjHgZClL._UY879_.jpg',
-            'https://images-na.ssl-images-amazon.com/images/I/71DfpJ8EatL._UX679_.jpg',
-            'https://images-na.ssl-images-amazon.com/images/I/81gVrGpMBKL._UY695_.jpg',
-            'https://images-na.ssl-images-amazon.com/images/I/613I3iAunmL._UX679_.jpg',
-            'https://images-na.ssl-images-amazon.com/images/I/71Wu3PZqRLL._UX679_.jpg'
-        ]
-        for index, image in enumerate(IMAGES):
-            ProductImage.objects.create(
-                product=products[index],
-                url=image
-            )
-        print('Imported!')
+    def create_users(self):
+        if not User.objects.filter(username='admin').exists():
+            User.objects.create_superuser(
+                username='admin', email='admin@example.com', password='admin')
+        if not User.objects.filter(username='test').exists():
+            user = User.objects.create(username='test', email='test@example.com')
+            user.set_password('test')
+            user.save()
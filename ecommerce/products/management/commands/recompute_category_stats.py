@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from products.stats import update_category_stats
+
+
+class Command(BaseCommand):
+    help = ('Recomputes the CategoryStats of every category from the products '
+            'table. Signals keep the stats current, run this periodically to '
+            'repair writes made behind their back, such as raw SQL.')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        count = update_category_stats()
+        self.stdout.write('Recomputed the stats of {} categories in {:.2f}s'.format(
+            count, time.perf_counter() - start))
@@ -0,0 +1,40 @@
+from django.db import migrations
+
+
+def add_search_vector(apps, schema_editor):
+    # full text search only exists on Postgres, other databases fall back
+    # to the in-process token index of api.search
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'ALTER TABLE products_product ADD COLUMN search_vector tsvector')
+    schema_editor.execute(
+        'CREATE INDEX product_search_vector_idx ON products_product '
+        'USING gin (search_vector)')
+    schema_editor.execute("""
+        UPDATE products_product SET search_vector =
+            setweight(to_tsvector('simple', coalesce(products_product.name, '')), 'A') ||
+            setweight(to_tsvector('simple', coalesce(products_product.sku, '')), 'A') ||
+            setweight(to_tsvector('simple', coalesce(products_category.name, '')), 'B') ||
+            setweight(to_tsvector('simple', coalesce(products_product.description, '')), 'C')
+        FROM products_category
+        WHERE products_category.id = products_product.category_id
+    """)
+
+
+def remove_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX product_search_vector_idx')
+    schema_editor.execute('ALTER TABLE products_product DROP COLUMN search_vector')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_product_created_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_search_vector, remove_search_vector),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 2.1.5 on 2026-10-18 11:51
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Q, Sum
+from django.utils import timezone
+import django.db.models.deletion
+
+
+def populate_category_stats(apps, schema_editor):
+    Category = apps.get_model('products', 'Category')
+    CategoryStats = apps.get_model('products', 'CategoryStats')
+    Product = apps.get_model('products', 'Product')
+    aggregates = {
+        row.pop('category_id'): row
+        for row in Product.objects.order_by().values('category_id').annotate(
+            product_count=Count('id'),
+            featured_count=Count('id', filter=Q(featured=True)),
+            price_sum=Sum('price'),
+            price_min=Min('price'),
+            price_max=Max('price'),
+        )
+    }
+    now = timezone.now()
+    CategoryStats.objects.bulk_create([
+        CategoryStats(category_id=category_id, updated=now, **aggregates.get(category_id, {}))
+        for category_id in Category.objects.values_list('id', flat=True)
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_product_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryStats',
+            fields=[
+                ('category', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='products.Category')),
+                ('product_count', models.PositiveIntegerField(default=0)),
+                ('featured_count', models.PositiveIntegerField(default=0)),
+                ('price_sum', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('price_min', models.DecimalField(decimal_places=2, max_digits=6, null=True)),
+                ('price_max', models.DecimalField(decimal_places=2, max_digits=6, null=True)),
+                ('updated', models.DateTimeField()),
+            ],
+        ),
+        migrations.RunPython(populate_category_stats, migrations.RunPython.noop),
+    ]
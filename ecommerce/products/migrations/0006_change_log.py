@@ -0,0 +1,59 @@
+# Generated by Django 2.1.5 on 2026-10-18 12:08
+
+from django.db import migrations, models
+from django.db.models import F
+import django.utils.timezone
+
+
+def backfill(apps, schema_editor):
+    Change = apps.get_model('products', 'Change')
+    Product = apps.get_model('products', 'Product')
+    Product.objects.update(updated=F('created'))
+    # every existing object starts the log as created, parents first
+    now = django.utils.timezone.now()
+    for model_name in ['category', 'product', 'productimage']:
+        model = apps.get_model('products', model_name)
+        ids = model.objects.order_by('pk').values_list('pk', flat=True).iterator()
+        Change.objects.bulk_create(
+            (Change(model=model_name, object_id=object_id, action='created', timestamp=now)
+             for object_id in ids),
+            batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_categorystats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False)),
+                ('model', models.CharField(max_length=20)),
+                ('object_id', models.IntegerField()),
+                ('action', models.CharField(choices=[('created', 'Created'), ('updated', 'Updated'), ('deleted', 'Deleted')], max_length=7)),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChangeCompaction',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('deleted', models.PositiveIntegerField()),
+                ('purged_seq', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='change',
+            index=models.Index(fields=['model', 'object_id', 'seq'], name='change_object_idx'),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -1,26 +1,126 @@
-from django.db import models
+from django.db import models, router, transaction
+from django.utils import timezone
 
 
-class Category(models.Model):
+class AtomicSaveMixin(object):
+    """
+    Saves in a transaction, so what post_save receivers write, such as the
+    change log, commits or rolls back along with the row. Deletes already
+    send post_delete from within their transaction.
+    """
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            super().save(*args, **kwargs)
+
+
+class Category(AtomicSaveMixin, models.Model):
     name = models.CharField(max_length=100)
 
     def __str__(self):
         return self.name
 
 
-class Product(models.Model):
+class Product(AtomicSaveMixin, models.Model):
     name = models.CharField(max_length=100)
     sku = models.CharField(max_length=8)
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
     description = models.CharField(max_length=1000, blank=True)
     price = models.DecimalField(max_digits=6, decimal_places=2)
     created = models.DateTimeField(auto_now_add=True)
+    # bulk_update skips auto_now, callers set it themselves
+    updated = models.DateTimeField(auto_now=True)
     featured = models.BooleanField(default=False)
 
+    class Meta:
+        # one index per query shape allowed by api.filters.ProductFilterBackend
+        indexes = [
+            models.Index(fields=['created', 'id'], name='product_created_id_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_id_idx'),
+            models.Index(fields=['sku'], name='product_sku_idx'),
+            models.Index(fields=['category', 'created', 'id'],
+                         name='product_cat_created_idx'),
+            models.Index(fields=['category', 'price', 'id'],
+                         name='product_cat_price_idx'),
+            models.Index(fields=['featured', 'created', 'id'],
+                         name='product_feat_created_idx'),
+            models.Index(fields=['featured', 'price', 'id'],
+                         name='product_feat_price_idx'),
+            models.Index(fields=['category', 'featured', 'created', 'id'],
+                         name='product_cat_feat_created_idx'),
+            models.Index(fields=['category', 'featured', 'price', 'id'],
+                         name='product_cat_feat_price_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # the category stats of both sides change when a product updated in
+        # bulk moves, see products.signals.update_category_stats_in_bulk
+        if 'category_id' in instance.__dict__:
+            instance._loaded_category_id = instance.category_id
+        return instance
+
 
-class ProductImage(models.Model):
+class ProductImage(AtomicSaveMixin, models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     url = models.URLField(max_length=300)
+
+
+class CategoryStats(models.Model):
+    """Aggregates of the products of a category, kept up to date by products.stats"""
+    category = models.OneToOneField(
+        Category, primary_key=True, on_delete=models.CASCADE, related_name='stats')
+    product_count = models.PositiveIntegerField(default=0)
+    featured_count = models.PositiveIntegerField(default=0)
+    price_sum = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    price_min = models.DecimalField(max_digits=6, decimal_places=2, null=True)
+    price_max = models.DecimalField(max_digits=6, decimal_places=2, null=True)
+    updated = models.DateTimeField()
+
+    def __str__(self):
+        return 'Stats of {}'.format(self.category_id)
+
+
+class Change(models.Model):
+    """
+    One create, update or delete of a category, product or image, written
+    in the transaction that made it, see products.changes. Deleted objects
+    leave their change as a tombstone.
+    """
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    ACTIONS = (
+        (CREATED, 'Created'),
+        (UPDATED, 'Updated'),
+        (DELETED, 'Deleted'),
+    )
+
+    seq = models.BigAutoField(primary_key=True)
+    model = models.CharField(max_length=20)
+    object_id = models.IntegerField()
+    action = models.CharField(max_length=7, choices=ACTIONS)
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['model', 'object_id', 'seq'], name='change_object_idx'),
+        ]
+
+    def __str__(self):
+        return '{} {} {} {}'.format(self.seq, self.action, self.model, self.object_id)
+
+
+class ChangeCompaction(models.Model):
+    """A run of compact_changes, tombstones up to `purged_seq` are gone"""
+    timestamp = models.DateTimeField(default=timezone.now)
+    deleted = models.PositiveIntegerField()
+    purged_seq = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return 'Compaction of {}'.format(self.timestamp)
@@ -0,0 +1,32 @@
+from django.db import connection
+
+
+SEARCH_VECTOR_SQL = """
+    UPDATE products_product SET search_vector =
+        setweight(to_tsvector('simple', coalesce(products_product.name, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(products_product.sku, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(products_category.name, '')), 'B') ||
+        setweight(to_tsvector('simple', coalesce(products_product.description, '')), 'C')
+    FROM products_category
+    WHERE products_category.id = products_product.category_id
+      AND products_product.{column} IN %s
+"""
+
+
+def uses_search_vector():
+    return connection.vendor == 'postgresql'
+
+
+def update_search_index(product_ids=(), category_ids=()):
+    """
+    Recomputes the search vector of the given products, and of every
+    product of the given categories. Without full text search there's
+    nothing to do, the token index of api.search catches up from the
+    change log.
+    """
+    if not uses_search_vector():
+        return
+    for column, ids in [('id', product_ids), ('category_id', category_ids)]:
+        if ids:
+            with connection.cursor() as cursor:
+                cursor.execute(SEARCH_VECTOR_SQL.format(column=column), [tuple(ids)])
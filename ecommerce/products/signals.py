@@ -0,0 +1,167 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import Signal, receiver
+
+from products.changes import LOGGED_MODELS, get_object_ids, record_changes
+from products.models import Category, Change, Product, ProductImage
+from products.search import update_search_index
+from products.stats import apply_category_stats_delta, schedule_category_stats_update
+
+
+# bulk_create and queryset updates skip post_save, code writing products in
+# bulk sends this instead, from within the transaction doing the writes.
+# Primary keys of created objects are only known on Postgres, elsewhere
+# senders of created objects pass created_after, see get_last_pk.
+bulk_saved = Signal(providing_args=['objs', 'created', 'created_after'])
+
+# sent by bulk_deleting for the objects of each model deleted in its block,
+# with their former primary keys in ids, as Django clears objs' ones
+bulk_deleted = Signal(providing_args=['objs', 'ids'])
+
+_deleting = threading.local()
+
+
+@contextmanager
+def bulk_deleting():
+    """
+    Collects the objects deleted in the block, cascades included, and sends
+    bulk_deleted once per model at its end instead of having receivers
+    decorated with per_object handle every row. Use it within the
+    transaction doing the deletes.
+    """
+    if getattr(_deleting, 'objs', None) is not None:
+        yield
+        return
+    _deleting.objs = OrderedDict()
+    try:
+        yield
+        deleted = _deleting.objs
+    finally:
+        _deleting.objs = None
+    for model, objs in deleted.items():
+        bulk_deleted.send(sender=model, objs=[obj for obj, _ in objs],
+                          ids=[pk for _, pk in objs])
+
+
+@receiver(post_delete)
+def collect_bulk_deleted(sender, instance, **kwargs):
+    objs = getattr(_deleting, 'objs', None)
+    if objs is not None:
+        objs.setdefault(sender, []).append((instance, instance.pk))
+
+
+def per_object(func):
+    """Skips post_delete receivers for objects deleted within bulk_deleting"""
+    @wraps(func)
+    def wrapper(sender, **kwargs):
+        if kwargs.get('signal') is post_delete and getattr(_deleting, 'objs', None) is not None:
+            return
+        return func(sender, **kwargs)
+    return wrapper
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_stats(sender, instance, **kwargs):
+    # the stats of the category the product was in lose it as it was saved
+    instance._previous_stats = None
+    if instance.pk is not None:
+        instance._previous_stats = sender.objects.filter(pk=instance.pk).values_list(
+            'category_id', 'price', 'featured').first()
+
+
+# connected before the receivers of the api app, so stats written outside
+# of a transaction are in place by the time the catalog version moves
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@per_object
+def update_category_stats(sender, instance, signal, **kwargs):
+    category_id = instance.category_id
+    price = Product._meta.get_field('price').to_python(instance.price)
+    featured = int(bool(instance.featured))
+    if signal is post_delete:
+        apply_category_stats_delta(category_id, -1, -featured, -price, removed=price)
+        return
+
+    previous = instance.__dict__.pop('_previous_stats', None)
+    if previous is None:
+        apply_category_stats_delta(category_id, 1, featured, price, added=price)
+        return
+    previous_category_id, previous_price, previous_featured = previous
+    previous_featured = int(previous_featured)
+    if previous == (category_id, price, bool(featured)):
+        return
+    if previous_category_id == category_id:
+        apply_category_stats_delta(
+            category_id, 0, featured - previous_featured, price - previous_price,
+            added=price, removed=None if price == previous_price else previous_price)
+    else:
+        apply_category_stats_delta(previous_category_id, -1, -previous_featured,
+                                   -previous_price, removed=previous_price)
+        apply_category_stats_delta(category_id, 1, featured, price, added=price)
+
+
+@receiver(bulk_saved, sender=Product)
+def update_category_stats_in_bulk(sender, objs, created, **kwargs):
+    category_ids = {product.category_id for product in objs}
+    if not created:
+        # products updated in bulk may have left the category they were loaded with
+        loaded = [getattr(product, '_loaded_category_id', None) for product in objs]
+        if None in loaded:
+            category_ids = None
+        else:
+            category_ids.update(loaded)
+    schedule_category_stats_update(category_ids)
+
+
+@receiver(bulk_deleted, sender=Product)
+def update_category_stats_on_bulk_delete(sender, objs, **kwargs):
+    schedule_category_stats_update({product.category_id for product in objs})
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductImage)
+def log_saved_object(sender, instance, created, **kwargs):
+    record_changes(sender, [instance.pk], Change.CREATED if created else Change.UPDATED)
+
+
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=ProductImage)
+@per_object
+def log_deleted_object(sender, instance, **kwargs):
+    record_changes(sender, [instance.pk], Change.DELETED)
+
+
+@receiver(bulk_saved)
+def log_bulk_saved_objects(sender, objs, created, created_after=None, **kwargs):
+    if sender in LOGGED_MODELS:
+        record_changes(sender, get_object_ids(sender, objs, created_after),
+                       Change.CREATED if created else Change.UPDATED)
+
+
+@receiver(bulk_deleted)
+def log_bulk_deleted_objects(sender, ids, **kwargs):
+    if sender in LOGGED_MODELS:
+        record_changes(sender, ids, Change.DELETED)
+
+
+# deleted rows have no search vector left to update
+@receiver(post_save, sender=Product)
+def update_product_search_index(sender, instance, **kwargs):
+    update_search_index(product_ids=[instance.pk])
+
+
+@receiver(post_save, sender=Category)
+def update_category_search_index(sender, instance, created, **kwargs):
+    if not created:
+        update_search_index(category_ids=[instance.pk])
+
+
+@receiver(bulk_saved, sender=Product)
+def update_search_index_in_bulk(sender, objs, **kwargs):
+    update_search_index(product_ids=[product.pk for product in objs])
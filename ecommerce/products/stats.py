@@ -0,0 +1,132 @@
+import threading
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Case, Count, F, Max, Min, Q, Sum, Value, When
+from django.utils import timezone
+
+from products.bulk import bulk_update
+from products.models import Category, CategoryStats, Product
+
+
+STATS_FIELDS = ('product_count', 'featured_count', 'price_sum', 'price_min', 'price_max',
+                'updated')
+EMPTY_STATS = {
+    'product_count': 0,
+    'featured_count': 0,
+    'price_sum': Decimal('0.00'),
+    'price_min': None,
+    'price_max': None,
+}
+
+
+def compute_category_stats(category_ids=None):
+    """Returns the aggregates of each category with products, by category id"""
+    products = Product.objects.order_by()
+    if category_ids is not None:
+        products = products.filter(category_id__in=category_ids)
+    rows = products.values('category_id').annotate(
+        product_count=Count('id'),
+        featured_count=Count('id', filter=Q(featured=True)),
+        price_sum=Sum('price'),
+        price_min=Min('price'),
+        price_max=Max('price'),
+    )
+    return {row.pop('category_id'): row for row in rows}
+
+
+def update_category_stats(category_ids=None):
+    """
+    Recomputes the CategoryStats rows of category_ids, or of every category
+    when None, from the products table. Returns the number of rows written.
+    """
+    categories = Category.objects.all()
+    existing = CategoryStats.objects.all()
+    if category_ids is not None:
+        category_ids = list(category_ids)
+        categories = categories.filter(id__in=category_ids)
+        existing = existing.filter(category_id__in=category_ids)
+    aggregates = compute_category_stats(category_ids)
+    # ids of categories deleted since they were scheduled are dropped here
+    category_ids = list(categories.values_list('id', flat=True))
+    existing = set(existing.values_list('category_id', flat=True))
+
+    now = timezone.now()
+    stats = [CategoryStats(category_id=category_id, updated=now,
+                           **aggregates.get(category_id, EMPTY_STATS))
+             for category_id in category_ids]
+    with transaction.atomic():
+        bulk_update([row for row in stats if row.category_id in existing], STATS_FIELDS)
+        CategoryStats.objects.bulk_create(
+            [row for row in stats if row.category_id not in existing])
+    return len(stats)
+
+
+# categories whose stats are due once the transaction of the thread commits,
+# None for all of them
+_dirty = threading.local()
+
+
+def update_dirty_category_stats():
+    """Recomputes the stats of the categories marked dirty in this thread"""
+    if not hasattr(_dirty, 'category_ids'):
+        return
+    category_ids = _dirty.category_ids
+    del _dirty.category_ids
+    update_category_stats(category_ids)
+
+
+def schedule_category_stats_update(category_ids=None):
+    """
+    Recomputes the stats of category_ids once the current transaction
+    commits, right away outside of one. Used for bulk writes and where a
+    delta can't keep the stats exact, see apply_category_stats_delta.
+    Every write of a transaction is folded into a single recompute, so
+    deleting a thousand products costs one aggregate query per affected
+    category rather than a thousand.
+    """
+    dirty = getattr(_dirty, 'category_ids', set())
+    if dirty is None or category_ids is None:
+        _dirty.category_ids = None
+    else:
+        _dirty.category_ids = dirty | set(category_ids)
+    if connection.in_atomic_block:
+        # the first callback to run recomputes for every write, the others
+        # find nothing left to do. Categories of a rolled back transaction
+        # are recomputed with the next one, which is wasted but harmless.
+        transaction.on_commit(update_dirty_category_stats)
+    else:
+        update_dirty_category_stats()
+
+
+def apply_category_stats_delta(category_id, count, featured, price_sum, added=None,
+                               removed=None):
+    """
+    Adds count products, featured of them featured, and price_sum to the
+    stats of category_id in the current transaction. The price range is
+    widened to the added price. A removed price at either end of the range,
+    unless replaced by one beyond it, can only be narrowed by recomputing
+    the category, which is scheduled instead, as it is when the category
+    has no stats row yet.
+    """
+    stats = CategoryStats.objects.filter(category_id=category_id)
+    if removed is not None:
+        if added is None or added > removed:
+            stats = stats.exclude(price_min=removed)
+        if added is None or added < removed:
+            stats = stats.exclude(price_max=removed)
+    values = {
+        'product_count': F('product_count') + count,
+        'featured_count': F('featured_count') + featured,
+        'price_sum': F('price_sum') + price_sum,
+        'updated': timezone.now(),
+    }
+    if added is not None:
+        values['price_min'] = Case(
+            When(Q(price_min__isnull=True) | Q(price_min__gt=added), then=Value(added)),
+            default=F('price_min'))
+        values['price_max'] = Case(
+            When(Q(price_max__isnull=True) | Q(price_max__lt=added), then=Value(added)),
+            default=F('price_max'))
+    if not stats.update(**values):
+        schedule_category_stats_update([category_id])
@@ -1,3 +1,106 @@
+import json
+import os
+import tempfile
+from decimal import Decimal
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.contrib.auth.models import User
 from django.test import TestCase
 
-# Create your tests here.
+from products.loader import read_json
+from products.models import Category, Product, ProductImage
+
+
+class LoadInitialDataTestCase(TestCase):
+
+    def call(self, *args):
+        call_command('load_initial_data', *args, stdout=open(os.devnull, 'w'))
+
+    def write_fixture(self, suffix, content):
+        fixture = tempfile.NamedTemporaryFile(
+            'w', suffix=suffix, delete=False, encoding='utf-8')
+        fixture.write(content)
+        fixture.close()
+        self.addCleanup(os.remove, fixture.name)
+        return fixture.name
+
+    def test_initial_data_is_idempotent(self):
+        """Should load the initial catalog once no matter how often it runs"""
+        self.call()
+        self.call()
+        self.assertEqual(Product.objects.count(), 10)
+        self.assertEqual(Category.objects.count(), 4)
+        self.assertEqual(ProductImage.objects.count(), 10)
+        self.assertTrue(User.objects.get(username='admin').is_superuser)
+        self.assertTrue(User.objects.get(username='test').check_password('test'))
+
+    def test_upsert_by_sku(self):
+        """Should update changed products and leave unchanged ones alone"""
+        self.call()
+        vapor = Product.objects.get(sku='44444444')
+        fixture = self.write_fixture('.json', json.dumps([
+            {'name': 'Nike Vapor', 'sku': '44444444', 'category': 'Sports',
+             'price': '99.99', 'featured': True},
+            {'name': 'Nike Cap', 'sku': '33333333', 'category': 'Accessories',
+             'price': 27.99, 'featured': True},
+            {'name': 'Ball', 'sku': '12121212', 'category': 'Balls', 'price': 15,
+             'images': ['https://example.com/ball.jpg']},
+        ]))
+        self.call(fixture)
+
+        self.assertEqual(Product.objects.count(), 11)
+        self.assertEqual(Product.objects.get(id=vapor.id).price, Decimal('99.99'))
+        ball = Product.objects.get(sku='12121212')
+        self.assertEqual(ball.category.name, 'Balls')
+        self.assertEqual(list(ball.productimage_set.values_list('url', flat=True)),
+                         ['https://example.com/ball.jpg'])
+
+    def test_csv_fixture(self):
+        """Should load CSV fixtures with whitespace separated image urls"""
+        fixture = self.write_fixture('.csv', (
+            'name,sku,category,description,price,featured,images\n'
+            'Ball,12121212,Balls,"Round, white",15.50,true,'
+            'https://example.com/1.jpg https://example.com/2.jpg\n'))
+        self.call(fixture)
+
+        ball = Product.objects.get(sku='12121212')
+        self.assertEqual(ball.description, 'Round, white')
+        self.assertEqual(ball.price, Decimal('15.50'))
+        self.assertTrue(ball.featured)
+        self.assertEqual(ball.productimage_set.count(), 2)
+
+    def test_synthetic(self):
+        """Should generate the requested number of products"""
+        self.call('--synthetic', '25', '--batch-size', '10')
+        self.call('--synthetic', '30', '--batch-size', '10')
+        self.assertEqual(Product.objects.count(), 30)
+
+    def test_invalid_fixture_loads_nothing(self):
+        """Should roll back the whole load when a record is invalid"""
+        fixture = self.write_fixture('.ndjson', '\n'.join([
+            json.dumps({'name': 'Ball', 'sku': '12121212', 'category': 'Balls'}),
+            json.dumps({'name': 'Bat', 'sku': '123456789', 'category': 'Balls'}),
+        ]))
+        with self.assertRaises(CommandError):
+            self.call(fixture)
+        self.assertEqual(Product.objects.count(), 0)
+
+    def test_failed_flush_keeps_catalog(self):
+        """Should keep the current catalog when a load after --flush fails"""
+        self.call()
+        fixture = self.write_fixture('.json', json.dumps([
+            {'name': 'Ball', 'sku': '12121212', 'category': 'Balls',
+             'images': 'https://example.com/ball.jpg'},
+        ]))
+        with self.assertRaises(CommandError):
+            self.call(fixture, '--flush')
+        self.assertEqual(Product.objects.count(), 10)
+        self.assertTrue(User.objects.filter(username='admin').exists())
+
+    def test_read_json_streams(self):
+        """Should read JSON arrays in chunks smaller than a single record"""
+        records = [{'name': 'Product {}'.format(i), 'tags': ['a', ']', '}']}
+                   for i in range(50)]
+        fixture = self.write_fixture('.json', json.dumps(records, indent=2))
+        self.assertEqual(list(read_json(fixture, chunk_size=7)), records)
@@ -0,0 +1,80 @@
+"""
+Gunicorn configuration, run with:
+
+    gunicorn -c gunicorn.conf.py ecommerce.wsgi
+
+or, with uvicorn workers:
+
+    GUNICORN_WORKER_CLASS=uvicorn gunicorn -c gunicorn.conf.py ecommerce.asgi
+
+The application is loaded once in the master (`preload_app`) and shared
+copy-on-write by the forked workers. Every setting can be overridden from
+the environment:
+
+- GUNICORN_WORKER_CLASS: `gthread` (default), `gevent` or `uvicorn`, the
+  latter serving ecommerce.asgi with ASGI_THREADS threads per worker
+- WEB_CONCURRENCY: number of workers, 2 * CPUs + 1 by default
+- GUNICORN_THREADS: threads per gthread worker, DATABASE_POOL_MAX_SIZE
+  defaults to it (to ASGI_THREADS for uvicorn workers)
+- GUNICORN_PRELOAD: set to 0 to load the application in every worker
+"""
+import multiprocessing
+import os
+import time
+
+
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+if worker_class == 'uvicorn':
+    worker_class = 'uvicorn.workers.UvicornWorker'
+
+if worker_class == 'gevent':
+    # patch before the application is preloaded, so module level locks and
+    # thread locals created at import time are already cooperative
+    from gevent import monkey
+    from psycogreen.gevent import patch_psycopg
+    monkey.patch_all()
+    patch_psycopg()
+
+bind = '0.0.0.0:{}'.format(os.getenv('PORT', '8000'))
+pythonpath = 'ecommerce'
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') != '0'
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+# recycle workers now and then to bound memory growth, with jitter so they
+# don't all restart at once
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+# gunicorn 19 adds the jitter even when max_requests is 0 (disabled)
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 100)) if max_requests else 0
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = timeout
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+accesslog = os.getenv('GUNICORN_ACCESS_LOG')
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    worker.forked_at = time.monotonic()
+    if not server.cfg.preload_app:
+        return
+    from django.db import connections
+    # a connection opened by the master while preloading shares its socket
+    # with every worker: forget it without closing it, so each worker opens
+    # its own and the master's session is left untouched
+    for connection in connections.all():
+        connection.connection = None
+
+
+def post_worker_init(worker):
+    worker.log.info('Worker %s ready in %.1f ms', worker.pid,
+                    (time.monotonic() - worker.forked_at) * 1000)
+
+
+def worker_exit(server, worker):
+    from django.apps import apps
+    if not apps.ready:
+        return
+    # token uses are otherwise only written by the next request to finish
+    from api.authentication import token_usage
+    token_usage.flush()